@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Access log of the development server, written by a background thread.
+"""
+from __future__ import print_function
+
+import io
+import os
+from Queue import Full, Queue
+import sys
+from threading import Lock, Thread
+
+from .helpers import to_unicode
+
+
+# The fields are `time`, `date` (ISO 8601), `remote_addr`, `method`, `uri`,
+# `protocol`, `status`, `bytes`, `duration` (in milliseconds), `referer` and
+# `user_agent`. The missing ones are replaced by '-'.
+DEFAULT_FORMAT = (
+    u' %(time)s | %(remote_addr)s  %(uri)s  (%(method)s)  '
+    u'%(status)s  %(bytes)s  %(duration)sms'
+)
+DEFAULT_QUEUE_SIZE = 1024
+# In bytes. The log file is rotated when it grows bigger
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 3
+
+# Only these are kept from the WSGI environ of a request, so the records
+# waiting in the queue don't keep alive its body or file wrappers
+ENVIRON_KEYS = ('REMOTE_ADDR', 'REQUEST_METHOD', 'REQUEST_URI',
+                'SERVER_PROTOCOL', 'HTTP_REFERER', 'HTTP_USER_AGENT')
+
+DROPPED = u' -- %s requests not logged (the log queue was full)'
+FORMAT_ERROR = u' -- Error formatting a request of the access log: %s'
+WRITE_ERROR = u' -- Error writing the access log: %s'
+
+
+class LogRecord(object):
+    __slots__ = ('environ', 'now', 'status', 'size', 'duration')
+
+    def __init__(self, environ, now, status=None, size=None, duration=None):
+        self.environ = dict(
+            (key, environ[key]) for key in ENVIRON_KEYS if key in environ)
+        self.now = now
+        self.status = status
+        self.size = size
+        self.duration = duration
+
+
+def format_record(record, fmt=DEFAULT_FORMAT):
+    environ = record.environ
+    status = record.status
+    fields = {
+        'time': record.now.strftime('%H:%M:%S'),
+        'date': record.now.isoformat(),
+        'remote_addr': environ.get('REMOTE_ADDR') or '?',
+        'method': environ.get('REQUEST_METHOD', ''),
+        'uri': environ.get('REQUEST_URI', ''),
+        'protocol': environ.get('SERVER_PROTOCOL') or '-',
+        'status': status.split(None, 1)[0] if status else '-',
+        'bytes': record.size if record.size is not None else '-',
+        'duration': ('%.1f' % (record.duration * 1000)
+                     if record.duration is not None else '-'),
+        'referer': environ.get('HTTP_REFERER') or '-',
+        'user_agent': environ.get('HTTP_USER_AGENT') or '-',
+    }
+    for key, value in fields.items():
+        fields[key] = to_unicode(value)
+    return fmt % fields
+
+
+class RotatingFile(object):
+    """A log file that, before growing over `max_size` bytes, is renamed to
+    `path.1` (and the previous `path.1` to `path.2`, and so on, keeping
+    `backups` of them).
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE,
+                 backups=DEFAULT_BACKUPS):
+        self.path = path
+        self.max_size = max_size
+        self.backups = backups
+        self._file = None
+        self.size = 0
+        self._open()
+
+    def write(self, data):
+        if self.max_size and self.size and \
+                self.size + len(data) > self.max_size:
+            self.rotate()
+        self._file.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = '%s.%s' % (self.path, i)
+            if os.path.exists(src):
+                self._replace(src, '%s.%s' % (self.path, i + 1))
+        if self.backups > 0:
+            self._replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        self._file = io.open(self.path, 'ab')
+        self.size = self._file.tell()
+
+    def _replace(self, src, dest):
+        if os.name == 'nt' and os.path.exists(dest):
+            os.remove(dest)
+        os.rename(src, dest)
+
+
+class AccessLog(object):
+    """Writes the requests to `path` (a `RotatingFile`) or, without one, to
+    the standard output, in a background thread, so the workers never wait
+    for the terminal or the disk.
+
+    The records wait in a queue of at most `queue_size` of them. When it's
+    full, the new ones are dropped and counted in `dropped`; the count is
+    written to the log as soon as there's room again.
+    """
+
+    def __init__(self, path=None, fmt=DEFAULT_FORMAT,
+                 queue_size=DEFAULT_QUEUE_SIZE, max_size=DEFAULT_MAX_SIZE,
+                 backups=DEFAULT_BACKUPS, encoding='utf8'):
+        self.path = path
+        self.fmt = fmt
+        self.max_size = max_size
+        self.backups = backups
+        self.encoding = encoding
+        self.logged = 0
+        self.dropped = 0
+        self._reported = 0
+        self._lock = Lock()
+        self._file = None
+        self._queue = Queue(queue_size)
+        self._thread = None
+
+    def log(self, environ, now, status=None, size=None, duration=None):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(
+                LogRecord(environ, now, status, size, duration))
+        except Full:
+            with self._lock:
+                self.dropped += 1
+
+    def close(self):
+        """Writes the records still in the queue and stops the thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            if self.path and self._file is None:
+                self._file = RotatingFile(
+                    self.path, self.max_size, self.backups)
+            thread = Thread(target=self._run, name='clay-access-log')
+            thread.daemon = True
+            thread.start()
+            self._thread = thread
+
+    def get_stats(self):
+        return {
+            'logged': self.logged,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize(),
+        }
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            records = []
+            # Everything waiting is written at once
+            while record is not None:
+                records.append(record)
+                if self._queue.empty():
+                    break
+                record = self._queue.get()
+            with self._lock:
+                dropped = self.dropped - self._reported
+                self._reported = self.dropped
+            lines = []
+            for r in records:
+                # A bad record (eg: an undecodable user agent) is skipped
+                try:
+                    lines.append(format_record(r, self.fmt))
+                except Exception as e:
+                    print(FORMAT_ERROR % e, file=sys.stderr)
+            logged = len(lines)
+            if dropped:
+                lines.append(DROPPED % dropped)
+            if lines:
+                try:
+                    self._write(lines)
+                    self.logged += logged
+                except Exception as e:
+                    print(WRITE_ERROR % e, file=sys.stderr)
+            if record is None:
+                return
+
+    def _write(self, lines):
+        data = u'\n'.join(lines) + u'\n'
+        if self._file is None:
+            sys.stdout.write(data)
+            sys.stdout.flush()
+            return
+        self._file.write(data.encode(self.encoding))
+        self._file.flush()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Writes the build straight into a tar or zip archive.
+"""
+import gzip
+import io
+import os
+from Queue import Queue
+import shutil
+import sys
+import tarfile
+from tempfile import mkstemp
+from threading import Thread
+import time
+import zipfile
+
+from .assets import COMPRESSIBLE_EXTS, GZIP_EXT, GZIP_LEVEL, gzip_data
+from .helpers import COPY_BUFSIZE, get_file_mode
+
+
+ARCHIVE_EXTS = {
+    '.zip': 'zip',
+    '.tar': 'tar',
+    '.tar.gz': 'tgz',
+    '.tgz': 'tgz',
+}
+
+# 1980-01-01, the earliest date a zip file can store.
+DEFAULT_EPOCH = 315532800
+FILE_MODE = 0o644
+DEFAULT_QUEUE_SIZE = 64
+
+
+def get_archive_format(path):
+    for ext, fmt in ARCHIVE_EXTS.items():
+        if path.lower().endswith(ext):
+            return fmt
+    return None
+
+
+def get_epoch():
+    # https://reproducible-builds.org/specs/source-date-epoch/
+    try:
+        return int(os.environ['SOURCE_DATE_EPOCH'])
+    except (KeyError, ValueError):
+        return DEFAULT_EPOCH
+
+
+class ArchiveWriter(object):
+    """Adds the files of the build to an archive, in the order they arrive,
+    from a background thread. Has the interface of both the `OutputWriter`
+    and the `StaticCopier`, with the paths inside `build_dir` used as the
+    names of the files in the archive.
+
+    Every file gets the same timestamp (`SOURCE_DATE_EPOCH`, if set) and
+    permissions, so building the same sources twice produces the same
+    archive. The archive is written to a temporal file and renamed when
+    closed.
+
+    With `gzip`, a compressed copy of the compressible files is added too,
+    if it's smaller.
+    """
+
+    def __init__(self, path, build_dir, gzip=False, mtime=None,
+                 maxsize=DEFAULT_QUEUE_SIZE):
+        self.path = path
+        self.format = get_archive_format(path)
+        if self.format is None:
+            raise ValueError('Unknown archive format: %s' % path)
+        self.build_dir = build_dir
+        self.gzip = gzip
+        self.mtime = get_epoch() if mtime is None else mtime
+        self.written = 0
+        self._error = None
+
+        folder, filename = os.path.split(os.path.abspath(path))
+        fd, self._tmp_path = mkstemp(prefix='.' + filename, dir=folder)
+        self._file = os.fdopen(fd, 'wb')
+        self._gzfile = None
+        self._archive = self._open()
+
+        self._queue = Queue(maxsize)
+        self._thread = Thread(target=self._run, name='clay-archive')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _open(self):
+        if self.format == 'zip':
+            return zipfile.ZipFile(
+                self._file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        fileobj = self._file
+        if self.format == 'tgz':
+            fileobj = self._gzfile = gzip.GzipFile(
+                filename='', mode='wb', compresslevel=GZIP_LEVEL,
+                fileobj=self._file, mtime=self.mtime)
+        return tarfile.open(
+            fileobj=fileobj, mode='w', format=tarfile.PAX_FORMAT,
+            encoding='utf8')
+
+    def write(self, path, content):
+        self._check_error()
+        if not isinstance(content, bytes):
+            content = content.encode('utf8')
+        self._queue.put((path, content, None))
+
+    def copy(self, path_in, path_out, st_in=None):
+        self._check_error()
+        self._queue.put((path_out, None, path_in))
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        try:
+            self._archive.close()
+            if self._gzfile is not None:
+                self._gzfile.close()
+        finally:
+            self._file.close()
+        if self._error is None:
+            os.chmod(self._tmp_path, get_file_mode(self.path))
+            if os.name == 'nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(self._tmp_path, self.path)
+        elif os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        self._check_error()
+
+    def _check_error(self):
+        if self._error:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error:
+                continue
+            try:
+                self._add(*item)
+            except Exception as e:
+                self._error = e
+
+    def _add(self, path, data, source):
+        name = os.path.relpath(path, self.build_dir).replace(os.sep, '/')
+        compress = self.gzip and name.endswith(COMPRESSIBLE_EXTS)
+        if data is None and not compress:
+            # Streamed from the source
+            with io.open(source, 'rb') as f:
+                self._add_file(name, f, os.fstat(f.fileno()).st_size)
+        else:
+            if data is None:
+                with io.open(source, 'rb') as f:
+                    data = f.read()
+            self._add_file(name, io.BytesIO(data), len(data))
+            if compress:
+                compressed = gzip_data(data)
+                if len(compressed) < len(data):
+                    self._add_file(name + GZIP_EXT, io.BytesIO(compressed),
+                                   len(compressed))
+        self.written += 1
+
+    def _add_file(self, name, fileobj, size):
+        if self.format != 'zip':
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = self.mtime
+            info.mode = FILE_MODE
+            self._archive.addfile(info, fileobj)
+            return
+
+        info = zipfile.ZipInfo(name, date_time=get_zip_date(self.mtime))
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = (0o100000 | FILE_MODE) << 16
+        if sys.version_info >= (3, 6):
+            with self._archive.open(info, 'w', force_zip64=True) as dest:
+                shutil.copyfileobj(fileobj, dest, COPY_BUFSIZE)
+        else:
+            self._archive.writestr(info, fileobj.read())
+
+
+def get_zip_date(timestamp):
+    date = time.gmtime(max(timestamp, DEFAULT_EPOCH))
+    return date[:6]
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+from multiprocessing.pool import ThreadPool
+import os
+
+from .helpers import get_file_hash, get_matcher, walk_files
+from .manifest import MANIFEST_FILENAME
+from .writer import write_file
+
+
+COMPRESSIBLE_EXTS = ('.html', '.css', '.js', '.json', '.svg')
+GZIP_EXT = '.gz'
+GZIP_LEVEL = 9
+
+DEFAULT_FINGERPRINT = [
+    '*.css', '*.js', '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico',
+    '*.webp', '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+]
+FINGERPRINT_LENGTH = 10
+
+
+def get_stat_key(path, st=None):
+    st = st or os.stat(path)
+    return [st.st_size, st.st_mtime]
+
+
+def get_cached_hash(path, known, st=None):
+    """Returns the `[size, mtime, hash]` of a file, reusing the `known` one
+    if the file size and mtime haven't changed. `st` is its stat result,
+    if already known.
+    """
+    stat = get_stat_key(path, st)
+    if known and known[:2] == stat:
+        return known
+    return stat + [get_file_hash(path)]
+
+
+def get_fingerprinted_path(path, digest):
+    base, ext = os.path.splitext(path)
+    return '%s.%s%s' % (base, digest[:FINGERPRINT_LENGTH], ext)
+
+
+def fingerprint(paths, source_dir, patterns, known=None):
+    """Finds the content-hashed name of the `paths` that match the
+    `patterns`. Returns the `{path: hashed path}` dict and the hashes, as
+    `{path: [size, mtime, hash]}`.
+    """
+    known = known or {}
+    matcher = get_matcher(patterns)
+    assets = {}
+    hashes = {}
+    for path in paths:
+        if not matcher.fullmatch(path):
+            continue
+        result = get_cached_hash(os.path.join(source_dir, path),
+                                 known.get(path))
+        hashes[path] = result
+        assets[path] = get_fingerprinted_path(path, result[2])
+    return assets, hashes
+
+
+def gzip_data(data):
+    # No file name nor timestamp, so the result is deterministic.
+    buf = io.BytesIO()
+    f = gzip.GzipFile(filename='', mode='wb', compresslevel=GZIP_LEVEL,
+                      fileobj=buf, mtime=0)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return buf.getvalue()
+
+
+def precompress_file(path, known=None, st=None):
+    """Writes a gzipped copy of `path`, next to it, unless the content
+    hasn't changed since the last time. Files that don't get smaller are
+    not compressed.
+    Returns the `[size, mtime, hash]` of the original file.
+    """
+    gzpath = path + GZIP_EXT
+    result = get_cached_hash(path, known, st)
+    if known and known[2] == result[2] and os.path.exists(gzpath):
+        return result
+
+    with io.open(path, 'rb') as f:
+        data = f.read()
+    compressed = gzip_data(data)
+    if len(compressed) < len(data):
+        write_file(gzpath, compressed)
+    elif os.path.exists(gzpath):
+        os.remove(gzpath)
+    return result
+
+
+def precompress(build_dir, known=None, threads=4, exts=COMPRESSIBLE_EXTS):
+    """Precompress every compressible file in the build folder, in parallel.
+    `known` are the results of the last call, by path relative to
+    `build_dir`. Returns the new results.
+    """
+    known = known or {}
+    stats = {}
+    for path, st in walk_files(build_dir):
+        # Clay's own files aren't part of the site
+        if path != MANIFEST_FILENAME and path.endswith(exts):
+            stats[path] = st
+    paths = sorted(stats)
+
+    def compress(path):
+        return precompress_file(
+            os.path.join(build_dir, path), known.get(path), stats[path])
+
+    pool = ThreadPool(threads)
+    try:
+        results = pool.map(compress, paths)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(paths, results))
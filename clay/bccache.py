@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+A persistent cache of the compiled templates.
+"""
+import hashlib
+import io
+import json
+
+from jinja2 import FileSystemBytecodeCache
+
+from .helpers import get_user_cache_dir, make_dirs
+from .writer import write_file
+
+
+def get_default_cache_dir():
+    return get_user_cache_dir('bytecode')
+
+
+def get_versions():
+    # The compiled code depends on the preprocessing of the templates,
+    # that depends on these packages.
+    import jinja2
+    import markdown
+    import pygments
+    from . import __version__
+
+    return {
+        'clay': __version__,
+        'jinja2': jinja2.__version__,
+        'markdown': getattr(markdown, '__version__', None) or
+        getattr(markdown, 'version', None),
+        'pygments': pygments.__version__,
+    }
+
+
+def get_fingerprint(jinja_options):
+    """Returns a hash of everything, besides the source, that changes how a
+    template is compiled: the options of the environment, its extensions,
+    and the version of Clay and of the libraries used by the extensions.
+    """
+    options = dict(jinja_options)
+    options.pop('bytecode_cache', None)
+    options['extensions'] = [
+        ext if isinstance(ext, basestring) else
+        '%s.%s' % (ext.__module__, ext.__name__)
+        for ext in options.get('extensions') or ()
+    ]
+    data = json.dumps([options, get_versions()], sort_keys=True,
+                      default=lambda obj: repr(obj))
+    return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """A `FileSystemBytecodeCache` whose keys include a `fingerprint` of the
+    preprocessing of the templates. Jinja only checks that the source of the
+    template hasn't changed, but the same source compiles to something
+    different with, eg, another version of the Markdown extension.
+
+    The files are written with a temporal name and then renamed, so the
+    cache can be shared by several processes.
+    """
+
+    def __init__(self, directory=None, fingerprint=''):
+        directory = directory or get_default_cache_dir()
+        super(BytecodeCache, self).__init__(directory, '%s.cache')
+        self.fingerprint = fingerprint
+        # Not exact with several threads, just for the stats
+        self.hits = 0
+        self.misses = 0
+
+    def get_cache_key(self, name, filename=None):
+        key = super(BytecodeCache, self).get_cache_key(name, filename)
+        return hashlib.sha1(
+            (self.fingerprint + key).encode('utf8')).hexdigest()
+
+    def load_bytecode(self, bucket):
+        try:
+            super(BytecodeCache, self).load_bytecode(bucket)
+        except Exception:
+            # Corrupted or from an incompatible Python
+            bucket.reset()
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def dump_bytecode(self, bucket):
+        buf = io.BytesIO()
+        bucket.write_bytecode(buf)
+        try:
+            make_dirs(self.directory)
+            write_file(self._get_cache_filename(bucket), buf.getvalue())
+        except (IOError, OSError):
+            pass
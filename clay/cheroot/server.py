@@ -72,7 +72,9 @@ FORWARD_SLASH = ntob('/')
 
 import os
 import re
+import select
 import socket
+import stat
 import sys
 if 'win' in sys.platform and not hasattr(socket, 'IPPROTO_IPV6'):
     socket.IPPROTO_IPV6 = 41
@@ -88,6 +90,15 @@ else:
 
 import time
 
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        # The `pysendfile` package, in Python 2
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
 from .workers import threadpool
 
 from . import errors
@@ -805,6 +816,8 @@ class HTTPRequest(object):
             self.rfile = KnownLengthRFile(self.conn.rfile, cl)
 
         self.server.gateway(self).respond()
+        if self.conn.detached:
+            return
 
         if (self.ready and not self.sent_headers):
             self.sent_headers = True
@@ -856,6 +869,50 @@ class HTTPRequest(object):
         else:
             write(self.conn.wfile, chunk)
 
+    def can_sendfile(self, fileobj):
+        """Return True if `fileobj` can be written with `sendfile`."""
+        if (sendfile is None or self.chunked_write
+                or self.server.ssl_adapter is not None):
+            return False
+        try:
+            fileobj.tell()
+            return stat.S_ISREG(os.fstat(fileobj.fileno()).st_mode)
+        except (AttributeError, IOError, OSError, ValueError):
+            return False
+
+    def sendfile(self, fileobj, count):
+        """Write `count` bytes of `fileobj`, from its current position,
+        to the client, copied by the kernel with `sendfile`.
+
+        Check `can_sendfile` first."""
+        wfile = self.conn.wfile
+        wfile.flush()
+        sock = self.conn.socket
+        infd = fileobj.fileno()
+        offset = fileobj.tell()
+        while count > 0:
+            try:
+                sent = sendfile(sock.fileno(), infd, offset, count)
+            except OSError:
+                e = sys.exc_info()[1]
+                if e.args[0] not in errors.socket_errors_nonblocking:
+                    raise
+                # The socket has a timeout, so it's non-blocking
+                ready = select.select([], [sock], [], sock.gettimeout())[1]
+                if not ready:
+                    raise socket.timeout('timed out')
+                continue
+            if not sent:
+                # The file is shorter than it was: the client will be
+                # waiting for the rest.
+                self.close_connection = True
+                break
+            offset += sent
+            count -= sent
+            if hasattr(wfile, 'bytes_written'):
+                wfile.bytes_written += sent
+        fileobj.seek(offset)
+
     def send_headers(self):
         """Assert, process, and send the HTTP response message-headers.
 
@@ -943,6 +1000,7 @@ class HTTPConnection(object):
     remote_addr = None
     remote_port = None
     ssl_env = None
+    detached = False
     rbufsize = DEFAULT_BUFFER_SIZE
     wbufsize = DEFAULT_BUFFER_SIZE
     RequestHandlerClass = HTTPRequest
@@ -977,7 +1035,7 @@ class HTTPConnection(object):
 
                 request_seen = True
                 req.respond()
-                if req.close_connection:
+                if req.close_connection or self.detached:
                     return
         except socket.error:
             e = sys.exc_info()[1]
@@ -1034,8 +1092,19 @@ class HTTPConnection(object):
 
     linger = False
 
+    def detach(self):
+        """Hand the socket over to the caller, that must close it.
+
+        The response of the current request is discarded, and the worker
+        thread is free to handle another connection."""
+        self.wfile.flush()
+        self.detached = True
+        return self.socket
+
     def close(self):
         """Close the socket underlying this connection."""
+        if self.detached:
+            return
         self.rfile.close()
 
         if not self.linger:
@@ -16,6 +16,30 @@ class WSGIServer(HTTPServer):
         HTTPServer.__init__(self, bind_addr, gateway=gateway, **kwargs)
 
 
+class FileWrapper(object):
+    """The `wsgi.file_wrapper` (PEP 333).
+
+    Iterates over `filelike` in blocks, unless the gateway can send it
+    with `sendfile`."""
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.blksize)
+        if data:
+            return data
+        raise StopIteration
+
+    next = __next__
+
+
 class WSGIGateway(Gateway):
     """A base class to interface HTTPServer with WSGI."""
 
@@ -33,6 +57,12 @@ class WSGIGateway(Gateway):
         """Process the current request."""
         response = self.req.server.wsgi_app(self.env, self.start_response)
         try:
+            if self.req.conn.detached:
+                # The application has taken over the socket
+                return
+            if (isinstance(response, FileWrapper)
+                    and self.sendfile(response.filelike)):
+                return
             for chunk in response:
                 # "The start_response callable must not actually transmit
                 # the response headers. Instead, it must store them for the
@@ -48,6 +78,21 @@ class WSGIGateway(Gateway):
             if hasattr(response, "close"):
                 response.close()
 
+    def sendfile(self, filelike):
+        """Send the response body, the next Content-Length bytes of
+        `filelike`, with `sendfile`. Return False if it can't be used."""
+        rbo = self.remaining_bytes_out
+        if (not self.started_response or rbo is None
+                or not self.req.can_sendfile(filelike)):
+            return False
+        if not self.req.sent_headers:
+            self.req.sent_headers = True
+            self.req.send_headers()
+        if self.req.allow_message_body and rbo:
+            self.req.sendfile(filelike, rbo)
+        self.remaining_bytes_out = 0
+        return True
+
     def start_response(self, status, headers, exc_info=None):
         """WSGI callable to begin the HTTP response."""
         # "The application may call start_response more than once,
@@ -151,6 +196,8 @@ class WSGIGateway_10(WSGIGateway):
             'SERVER_PROTOCOL': tonative(req.request_protocol),
             'SERVER_SOFTWARE': req.server.software,
             'wsgi.errors': sys.stderr,
+            'wsgi.file_wrapper': FileWrapper,
+            'cheroot.detach': req.conn.detach,
             'wsgi.input': req.rfile,
             'wsgi.multiprocess': False,
             'wsgi.multithread': True,
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Templates compiled ahead of time to Python modules (see `clay compile`).
+"""
+import io
+import json
+import os
+
+from jinja2 import ModuleLoader, TemplateNotFound
+
+from .helpers import get_stat, to_unicode
+
+
+COMPILED_DIRNAME = '.clay-compiled'
+INDEX_FILENAME = 'index.json'
+
+
+def load_index(folder, fingerprint):
+    """Returns the size and modification time of the source of each compiled
+    template, or an empty dict if they were compiled with another
+    `fingerprint` (see `bccache.get_fingerprint`).
+    """
+    path = os.path.join(folder, INDEX_FILENAME)
+    try:
+        with io.open(path, 'rt', encoding='utf8') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if data.get('fingerprint') != fingerprint:
+        return {}
+    return data.get('templates') or {}
+
+
+def save_index(folder, fingerprint, templates):
+    data = json.dumps(
+        {'fingerprint': fingerprint, 'templates': templates},
+        sort_keys=True, indent=0)
+    path = os.path.join(folder, INDEX_FILENAME)
+    tmp_path = path + '.tmp'
+    with io.open(tmp_path, 'wt', encoding='utf8') as f:
+        f.write(to_unicode(data))
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+class CompiledLoader(ModuleLoader):
+    """Loads the templates compiled to `folder`, as long as their source,
+    in `source_dir`, hasn't changed since. Otherwise (or if the template
+    wasn't compiled) raises `TemplateNotFound`, so a `ChoiceLoader` can
+    try the next loader.
+    """
+
+    def __init__(self, folder, source_dir, fingerprint):
+        super(CompiledLoader, self).__init__(folder)
+        self.source_dir = source_dir
+        self.templates = load_index(folder, fingerprint)
+
+    def get_source_path(self, name):
+        return os.path.join(self.source_dir, name)
+
+    def get_source(self, environment, template):
+        # Leave it to the next loader
+        raise TemplateNotFound(template)
+
+    def list_templates(self):
+        return sorted(self.templates)
+
+    def load(self, environment, name, globals=None):
+        stat = self.templates.get(name)
+        path = self.get_source_path(name)
+        if stat is None or get_stat(path) != stat:
+            raise TemplateNotFound(name)
+        tmpl = super(CompiledLoader, self).load(environment, name, globals)
+        tmpl._uptodate = lambda: get_stat(path) == stat
+        return tmpl
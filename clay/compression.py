@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Gzip content-encoding for the responses of the development server.
+"""
+from collections import OrderedDict
+import re
+from threading import Lock
+import zlib
+
+from .assets import gzip_data
+
+
+# In bytes
+DEFAULT_CACHE_MAX_SIZE = 32 * 1024 * 1024
+# Smaller responses aren't worth compressing
+MIN_SIZE = 256
+# Larger responses are compressed while streamed, and not cached
+MAX_BUFFERED_SIZE = 8 * 1024 * 1024
+STREAM_LEVEL = 6
+
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/javascript', 'application/json',
+    'application/xml', 'image/svg+xml',
+)
+
+# Appended to the ETag of the compressed variant
+ETAG_SUFFIX = '-gzip'
+
+# Cached for the responses that don't get smaller when compressed
+NOT_COMPRESSED = b''
+
+rx_gzip = re.compile(r'(?:^|,)\s*(gzip|\*)\s*(?:;\s*q\s*=\s*([0-9.]+))?',
+                     re.IGNORECASE)
+rx_etag = re.compile(r'"([^"]*)%s"' % re.escape(ETAG_SUFFIX))
+
+
+def accepts_gzip(header):
+    """Returns `True` if the `Accept-Encoding` header allows gzip."""
+    for match in rx_gzip.finditer(header or ''):
+        try:
+            if float(match.group(2) or 1) > 0:
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+def is_compressible(content_type):
+    content_type = (content_type or '').lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressedCache(object):
+    """The compressed bodies of the responses, by their path and ETag (the
+    ETags of the static files are only unique for each path), or
+    `NOT_COMPRESSED` for the ones that aren't worth it. The least recently
+    used are removed when they exceed `max_size` bytes.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries[key] = data
+            self.hits += 1
+            return data
+
+    def set(self, key, data):
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, old = self._entries.popitem(last=False)
+                self.size -= len(old)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class GzipMiddleware(object):
+    """Compresses the responses of `application` for the clients that
+    accept it.
+
+    The responses with an ETag are compressed once: the result is kept in a
+    `CompressedCache` and the compressed variant gets its own ETag (with a
+    `-gzip` suffix). The ones without it are compressed while streamed.
+
+    A `HEAD` request is answered as a `GET` without the body, so it gets
+    the same headers.
+    """
+
+    def __init__(self, application, cache_max_size=DEFAULT_CACHE_MAX_SIZE):
+        self.application = application
+        self.cache = CompressedCache(cache_max_size)
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD')
+        if method not in ('GET', 'HEAD') or \
+                'HTTP_RANGE' in environ or \
+                not accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING')):
+            return self.application(environ, start_response)
+        if method == 'HEAD':
+            return self._head(environ, start_response)
+        return self._get(environ, start_response)
+
+    def _head(self, environ, start_response):
+        # The body of the `GET` is needed to know the compressed length
+        started = []
+
+        def _start_response(status, headers, exc_info=None):
+            started.append(True)
+            return start_response(status, headers, exc_info)
+
+        app_iter = self._get(
+            dict(environ, REQUEST_METHOD='GET'), _start_response)
+        try:
+            # Some responses only start when iterated
+            if not started:
+                for chunk in app_iter:
+                    if started:
+                        break
+        finally:
+            close(app_iter)
+        return []
+
+    def _get(self, environ, start_response):
+
+        # The client has compressed variants: ask for the originals
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            environ['HTTP_IF_NONE_MATCH'] = rx_etag.sub(r'"\1"', if_none_match)
+
+        response = {}
+
+        def _start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            response['exc_info'] = exc_info
+            # Anything written goes before the iterable
+            return response.setdefault('written', []).append
+
+        app_iter = self.application(environ, _start_response)
+        status = response.get('status')
+        if status is None:
+            # `start_response` will be called while iterating
+            return ClosingIterator(
+                self._passthrough(app_iter, start_response, response),
+                app_iter)
+
+        headers = response['headers']
+        etag = get_header(headers, 'ETag')
+        if status.startswith('304') and etag and if_none_match and \
+                ETAG_SUFFIX in if_none_match:
+            set_header(headers, 'ETag', add_suffix(etag))
+        if not status.startswith('200') or \
+                get_header(headers, 'Content-Encoding') or \
+                not is_compressible(get_header(headers, 'Content-Type')):
+            start_response(status, headers, response['exc_info'])
+            return self._body(response.get('written'), app_iter)
+
+        add_vary(headers)
+        length = get_header(headers, 'Content-Length')
+        length = int(length) if length and length.isdigit() else None
+        if length is not None and length < MIN_SIZE:
+            start_response(status, headers, response['exc_info'])
+            return self._body(response.get('written'), app_iter)
+
+        if etag and length is not None and length <= MAX_BUFFERED_SIZE:
+            key = (environ.get('PATH_INFO', ''), etag)
+            data = self.cache.get(key)
+            if data is None:
+                try:
+                    body = b''.join(
+                        self._prepend(response.get('written'), app_iter))
+                finally:
+                    close(app_iter)
+                data = gzip_data(body)
+                if len(data) >= len(body):
+                    # Not worth it: sent as it was, now and the next time
+                    self.cache.set(key, NOT_COMPRESSED)
+                    start_response(status, headers, response['exc_info'])
+                    return [body]
+                self.cache.set(key, data)
+            elif data == NOT_COMPRESSED:
+                start_response(status, headers, response['exc_info'])
+                return self._body(response.get('written'), app_iter)
+            else:
+                close(app_iter)
+            set_header(headers, 'ETag', add_suffix(etag))
+            set_header(headers, 'Content-Length', str(len(data)))
+            set_header(headers, 'Content-Encoding', 'gzip')
+            start_response(status, headers, response['exc_info'])
+            return [data]
+
+        # Compressed while streamed, with an unknown length
+        headers = [(k, v) for k, v in headers
+                   if k.lower() not in ('content-length', 'etag')]
+        headers.append(('Content-Encoding', 'gzip'))
+        start_response(status, headers, response['exc_info'])
+        return ClosingIterator(
+            self._compress(self._prepend(response.get('written'), app_iter)),
+            app_iter)
+
+    def _passthrough(self, app_iter, start_response, response):
+        started = False
+        for chunk in app_iter:
+            if not started:
+                started = True
+                start_response(response['status'], response['headers'],
+                               response['exc_info'])
+            yield chunk
+        if not started:
+            start_response(response['status'], response['headers'],
+                           response['exc_info'])
+
+    def _body(self, written, app_iter):
+        # Untouched if possible, eg: for the `wsgi.file_wrapper`
+        if not written:
+            return app_iter
+        return ClosingIterator(self._prepend(written, app_iter), app_iter)
+
+    def _prepend(self, written, app_iter):
+        for chunk in written or ():
+            yield chunk
+        for chunk in app_iter:
+            yield chunk
+
+    def _compress(self, chunks):
+        compressor = zlib.compressobj(
+            STREAM_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class ClosingIterator(object):
+    """Iterates `iterable` (made from the `app_iter` of an application)
+    and, when closed, closes both, even if the iteration never started.
+    """
+
+    def __init__(self, iterable, app_iter):
+        self.iterable = iterable
+        self.app_iter = app_iter
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            close(self.iterable)
+        finally:
+            close(self.app_iter)
+
+
+def get_header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def set_header(headers, name, value):
+    lname = name.lower()
+    headers[:] = [(k, v) for k, v in headers if k.lower() != lname]
+    headers.append((name, value))
+
+
+def add_vary(headers):
+    vary = get_header(headers, 'Vary')
+    if vary and 'accept-encoding' in vary.lower():
+        return
+    set_header(headers, 'Vary',
+               vary + ', Accept-Encoding' if vary else 'Accept-Encoding')
+
+
+def add_suffix(etag):
+    if etag.endswith(ETAG_SUFFIX + '"'):
+        return etag
+    if etag.endswith('"'):
+        return etag[:-1] + ETAG_SUFFIX + '"'
+    return etag + ETAG_SUFFIX
+
+
+def close(app_iter):
+    if hasattr(app_iter, 'close'):
+        app_iter.close()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+from jinja2.exceptions import TemplateNotFound, TemplateSyntaxError
+from jinja2.meta import find_referenced_templates
+
+
+def hash_content(content):
+    if not isinstance(content, bytes):
+        content = content.encode('utf8')
+    return hashlib.sha1(content).hexdigest()
+
+
+class DependencyGraph(object):
+    """Finds the templates a page depends on: the ones it `extends`,
+    `include`s or `import`s, recursively.
+
+    The templates are parsed by the Jinja environment, so the source is
+    preprocessed first by the extensions (eg: the `include ... with`
+    rewriting and the Markdown layouts).
+
+    Templates whose size and modification time match the ones in `known`
+    (the `templates` of a previous `BuildManifest`) aren't read again.
+    `stats` is an optional dict of the stat results of the source files,
+    by name, to avoid reading them again.
+    """
+
+    def __init__(self, env, source_dir, known=None, stats=None):
+        self.env = env
+        self.source_dir = source_dir
+        self.known = known or {}
+        self.stats = stats or {}
+        self.templates = {}
+
+    def get_template_info(self, name):
+        info = self.templates.get(name)
+        if info is None:
+            info = self._get_template_info(name)
+            self.templates[name] = info
+        return info
+
+    def _get_template_info(self, name):
+        stat = None
+        st = self.stats.get(name)
+        if st is None:
+            path = os.path.join(self.source_dir, name)
+            if os.path.isfile(path):
+                st = os.stat(path)
+        if st is not None:
+            stat = [st.st_size, st.st_mtime]
+            known = self.known.get(name)
+            if known and known.get('stat') == stat:
+                return known
+
+        try:
+            source, filename, _ = self.env.loader.get_source(self.env, name)
+        except TemplateNotFound:
+            return {'stat': None, 'hash': None, 'refs': []}
+
+        try:
+            ast = self.env.parse(source, name, filename)
+            refs = list(find_referenced_templates(ast))
+        except TemplateSyntaxError:
+            refs = [None]
+        if None in refs:
+            refs = None
+        return {'stat': stat, 'hash': hash_content(source), 'refs': refs}
+
+    def get_dependencies(self, *names):
+        """Returns a dict with the hash of every template needed to render
+        the `names` templates, or `None` if any of them is dynamic.
+        """
+        deps = {}
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in deps:
+                continue
+            info = self.get_template_info(name)
+            if info['refs'] is None:
+                return None
+            deps[name] = info['hash']
+            pending.extend(info['refs'])
+        return deps
@@ -1,12 +1,37 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
 import errno
-from fnmatch import fnmatch
+from fnmatch import fnmatch, translate
+import hashlib
 import io
 import os
+import re
 import shutil
+import stat
 import unicodedata
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        # The `pysendfile` package, in Python 2
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
+# Reading the umask means changing it, so it's done only once, before any
+# other thread can be creating files
+_umask = os.umask(0)
+os.umask(_umask)
+
 
 def to_unicode(txt, encoding='utf8'):
     if not isinstance(txt, basestring):
@@ -26,6 +51,62 @@ def fullmatch(path, pattern):
     return fnmatch(name, pattern) or fnmatch(path, pattern)
 
 
+class PatternMatcher(object):
+    """Matches a path against a list of UNIX-style patterns using a single
+    compiled regular expression.
+
+    If `partial` is true, the patterns also match as prefixes.
+    """
+
+    def __init__(self, patterns, partial=False):
+        self.patterns = [unormalize(to_unicode(p)) for p in patterns]
+        parts = [_translate(p) for p in self.patterns]
+        if partial:
+            parts.extend(re.escape(p) for p in self.patterns)
+        self.rx = None
+        if parts:
+            self.rx = re.compile(
+                u'|'.join(u'(?:%s)' % part for part in parts),
+                re.MULTILINE | re.DOTALL)
+
+    def match(self, path):
+        """Like `fnmatch` with every pattern."""
+        if self.rx is None:
+            return False
+        return self.rx.match(unormalize(path)) is not None
+
+    def fullmatch(self, path):
+        """Like `fullmatch` with every pattern."""
+        if self.rx is None:
+            return False
+        path = unormalize(path)
+        name = os.path.basename(path)
+        return (self.rx.match(name) is not None or
+                self.rx.match(path) is not None)
+
+
+def _translate(pattern):
+    rx = translate(pattern)
+    # Python 2 appends the flags to the end
+    if rx.endswith('(?ms)'):
+        rx = rx[:-len('(?ms)')]
+    return rx
+
+
+_MAXCACHE = 100
+_matchers = {}
+
+
+def get_matcher(patterns, partial=False):
+    key = (tuple(patterns), bool(partial))
+    matcher = _matchers.get(key)
+    if matcher is None:
+        if len(_matchers) >= _MAXCACHE:
+            _matchers.clear()
+        matcher = _matchers[key] = PatternMatcher(patterns, partial)
+    return matcher
+
+
 def make_dirs(*lpath):
     path = os.path.join(*lpath)
     try:
@@ -36,6 +117,19 @@ def make_dirs(*lpath):
     return path
 
 
+def get_file_mode(path=None):
+    """The permissions of the file at `path` or, if it doesn't exist, of a
+    new file created with `open`. For the files written with `mkstemp`,
+    that are only readable by their owner.
+    """
+    if path is not None:
+        try:
+            return stat.S_IMODE(os.stat(path).st_mode)
+        except OSError:
+            pass
+    return 0o666 & ~_umask
+
+
 def create_file(path, content, encoding='utf8'):
     if not isinstance(content, unicode):
         content = unicode(content, encoding)
@@ -43,20 +137,172 @@ def create_file(path, content, encoding='utf8'):
         f.write(content)
 
 
-def copy_if_updated(path_in, path_out):
-    if os.path.exists(path_out):
-        newt = os.path.getmtime(path_in)
-        currt = os.path.getmtime(path_out)
-        if currt >= newt:
+COPY_BUFSIZE = 1024 * 1024
+# Copying the mtime of a file loses some precision
+MTIME_TOLERANCE = 0.001
+
+
+def is_updated(path_in, path_out, check_hash=False, st_in=None):
+    """A copy is up to date if has the same size and is not older than the
+    original or, with `check_hash`, if has the same content.
+    """
+    try:
+        st_out = os.stat(path_out)
+    except OSError:
+        return False
+    st_in = st_in or os.stat(path_in)
+    if (st_in.st_ino, st_in.st_dev) == (st_out.st_ino, st_out.st_dev):
+        return True
+    if st_in.st_size != st_out.st_size:
+        return False
+    if st_out.st_mtime >= st_in.st_mtime - MTIME_TOLERANCE:
+        return True
+    return check_hash and get_file_hash(path_in) == get_file_hash(path_out)
+
+
+def get_file_hash(path):
+    digest = hashlib.sha1()
+    with io.open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFSIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_if_updated(path_in, path_out, hardlink=False, check_hash=False,
+                    st_in=None):
+    """Copy a file if the copy is missing or outdated.
+    With `hardlink`, tries to link the file instead.
+    Returns `True` if the file was copied.
+    """
+    st_in = st_in or os.stat(path_in)
+    if is_updated(path_in, path_out, check_hash, st_in):
+        return False
+    if hardlink and _link(path_in, path_out):
+        return True
+    with io.open(path_in, 'rb') as fsrc:
+        with io.open(path_out, 'wb') as fdst:
+            copy_data(fsrc, fdst, st_in.st_size)
+    shutil.copystat(path_in, path_out)
+    return True
+
+
+def _link(path_in, path_out):
+    if os.path.lexists(path_out):
+        os.remove(path_out)
+    try:
+        os.link(path_in, path_out)
+    except (OSError, AttributeError):
+        # Different filesystems or not supported
+        return False
+    return True
+
+
+def copy_data(fsrc, fdst, size):
+    """Copy the data between two files, in the kernel with `sendfile` if
+    it's available (in Python 2, with the `pysendfile` package) and the
+    platform can send to a file.
+    """
+    if sendfile is not None:
+        try:
+            _sendfile(fsrc.fileno(), fdst.fileno(), size)
             return
-    shutil.copy2(path_in, path_out)
+        except OSError as e:
+            if e.errno not in SENDFILE_ERRORS:
+                raise
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+    shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+
+
+# Not supported between those files
+SENDFILE_ERRORS = tuple(
+    getattr(errno, name) for name in
+    ('EINVAL', 'ENOSYS', 'EXDEV', 'ENOTSUP', 'EOPNOTSUPP', 'ENOTSOCK')
+    if hasattr(errno, name))
+
 
+def _sendfile(infd, outfd, size):
+    offset = 0
+    while offset < size:
+        sent = sendfile(outfd, infd, offset, size - offset)
+        if not sent:
+            break
+        offset += sent
 
-def get_updated_datetime(path):
-    ut = os.path.getmtime(path)
+
+def get_user_cache_dir(*names):
+    root = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'clay', *names)
+
+
+def get_updated_datetime(path, st=None):
+    ut = st.st_mtime if st else os.path.getmtime(path)
     return datetime.fromtimestamp(ut)
 
 
+def get_stat(path):
+    """Returns the `[size, mtime]` of a file, or `None` if it doesn't exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime]
+
+
+def walk_files(root, prune=None):
+    """Like `os.walk`, but yields a `(path, stat)` tuple for each file, with
+    the path relative to `root`. The stat is `None` if it can't be read.
+
+    Folders for which `prune(path)` is true are not entered at all.
+    Uses `scandir` when available, so the folders don't need to be stat'ed.
+    """
+    pending = [root[:0]]
+    while pending:
+        folder = pending.pop()
+        try:
+            entries = list(list_dir(os.path.join(root, folder)))
+        except OSError:
+            continue
+        subs = []
+        for name, is_dir, is_link, get_stat in entries:
+            path = os.path.join(folder, name)
+            if is_dir:
+                # Symlinks to folders are not followed, like `os.walk`
+                if not is_link:
+                    subs.append(path)
+                continue
+            try:
+                st = get_stat()
+            except OSError:
+                st = None
+            yield path, st
+        for path in reversed(subs):
+            if prune is None or not prune(path):
+                pending.append(path)
+
+
+def list_dir(path):
+    """Yields a `(name, is_dir, is_link, get_stat)` tuple for each entry
+    of the folder.
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                is_dir = entry.is_dir()
+                is_link = entry.is_symlink()
+            except OSError:
+                is_dir = is_link = False
+            yield entry.name, is_dir, is_link, entry.stat
+        return
+    for name in os.listdir(path):
+        fullpath = os.path.join(path, name)
+        yield (name, os.path.isdir(fullpath), os.path.islink(fullpath),
+               lambda fullpath=fullpath: os.stat(fullpath))
+
+
 def sort_paths_dirs_last(paths):
     def dirs_last(a, b):
         return cmp(a[0].count('/'), b[0].count('/')) or cmp(a[0], b[0])
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Reloads the pages open in the browser when their sources change, through
+a stream of server-sent events.
+"""
+import errno
+import os
+import re
+import select
+import socket
+from threading import Lock, Thread
+import time
+
+
+EVENTS_URL = '/_clay/events'
+
+# Seconds between the comments sent to keep the idle connections open
+KEEPALIVE_INTERVAL = 15
+SEND_TIMEOUT = 2
+
+RESPONSE_HEAD = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Content-Type: text/event-stream\r\n'
+    b'Cache-Control: no-cache\r\n'
+    b'Connection: keep-alive\r\n'
+    b'\r\n'
+    b'retry: 1000\n\n'
+)
+KEEPALIVE = b':\n\n'
+CHANGED = u'event: changed\ndata: %s\n\n'
+
+CLIENT_SCRIPT = u'''<script>(function () {
+  if (!window.EventSource) return;
+  var path = encodeURIComponent(location.pathname);
+  var source = new EventSource('%s?path=' + path);
+  source.addEventListener('changed', function () { location.reload(); });
+})();</script>
+''' % EVENTS_URL
+
+rx_body_end = re.compile(r'</body\s*>(?![\s\S]*</body\s*>)', re.IGNORECASE)
+
+
+def inject_client(content):
+    """Adds the client script to an HTML page, before its `</body>`.
+    Pages without one (eg: fragments) are returned as they are.
+    """
+    match = rx_body_end.search(content)
+    if not match:
+        return content
+    return content[:match.start()] + CLIENT_SCRIPT + content[match.start():]
+
+
+class _Client(object):
+    __slots__ = ('sock', 'fd', 'path', 'deps', 'last_sent')
+
+    def __init__(self, sock, path, deps):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.path = path
+        self.deps = deps
+        self.last_sent = time.time()
+
+
+class LiveReloadHub(object):
+    """Keeps the event streams of the open pages, each one with the set of
+    source files the page is made from (`None` if unknown).
+
+    The sockets are taken from the server, so the idle connections don't
+    hold a worker thread: a single thread waits on all of them, to notice
+    when they are closed and to keep them alive.
+    """
+
+    def __init__(self, keepalive=KEEPALIVE_INTERVAL):
+        self.keepalive = keepalive
+        self._clients = {}
+        self._lock = Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._closed = False
+        self._thread = Thread(target=self._run, name='clay-livereload')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def add(self, sock, path, deps=None):
+        """Starts the event stream of the page `path` in `sock`."""
+        try:
+            sock.settimeout(SEND_TIMEOUT)
+            sock.sendall(RESPONSE_HEAD)
+        except socket.error:
+            close_socket(sock)
+            return
+        client = _Client(sock, path, set(deps) if deps is not None else None)
+        with self._lock:
+            self._clients[client.fd] = client
+        self._wakeup()
+
+    def notify(self, changes=None):
+        """Tells the pages made from any of the `changes` (paths relative to
+        the source folder) to reload. With `None`, all of them.
+        Returns the number of pages notified.
+        """
+        changes = set(changes) if changes is not None else None
+        with self._lock:
+            clients = list(self._clients.values())
+        notified = 0
+        for client in clients:
+            if not must_reload(client.deps, changes):
+                continue
+            data = (CHANGED % client.path).encode('utf8')
+            if self._send(client, data):
+                notified += 1
+        return notified
+
+    def close(self):
+        self._closed = True
+        self._wakeup()
+        self._thread.join(1)
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            close_socket(client.sock)
+        for fd in (self._wakeup_r, self._wakeup_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _send(self, client, data):
+        try:
+            client.sock.sendall(data)
+            client.last_sent = time.time()
+            return True
+        except socket.error:
+            self._remove(client)
+            return False
+
+    def _remove(self, client):
+        with self._lock:
+            if self._clients.get(client.fd) is client:
+                del self._clients[client.fd]
+        close_socket(client.sock)
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'x')
+        except OSError:
+            pass
+
+    def _run(self):
+        while not self._closed:
+            with self._lock:
+                clients = dict(self._clients)
+            # Until the next keepalive is due, whatever wakes the thread
+            # up before
+            now = time.time()
+            timeout = self.keepalive
+            if clients:
+                next_keepalive = min(
+                    c.last_sent for c in clients.values()) + self.keepalive
+                timeout = max(0, next_keepalive - now)
+            try:
+                readable = select.select(
+                    [self._wakeup_r] + list(clients), [], [], timeout)[0]
+            except (select.error, OSError, ValueError) as e:
+                if getattr(e, 'errno', None) == errno.EINTR or \
+                        (e.args and e.args[0] == errno.EINTR):
+                    continue
+                # A socket closed meanwhile: check them one by one
+                self._drop_closed(clients)
+                continue
+            for fd in readable:
+                if fd == self._wakeup_r:
+                    try:
+                        os.read(self._wakeup_r, 1024)
+                    except OSError:
+                        pass
+                    continue
+                # The browser doesn't send anything else: it's gone
+                client = clients[fd]
+                try:
+                    data = client.sock.recv(1024)
+                except socket.error:
+                    data = b''
+                if not data:
+                    self._remove(client)
+            self._send_keepalives(clients)
+
+    def _send_keepalives(self, clients):
+        limit = time.time() - self.keepalive
+        for client in clients.values():
+            if client.last_sent <= limit and \
+                    self._clients.get(client.fd) is client:
+                self._send(client, KEEPALIVE)
+
+    def _drop_closed(self, clients):
+        for client in clients.values():
+            try:
+                select.select([client.sock], [], [], 0)
+            except (select.error, OSError, ValueError):
+                self._remove(client)
+
+
+def must_reload(deps, changes):
+    if deps is None or changes is None:
+        return True
+    return any(path in deps for path in changes)
+
+
+def close_socket(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        pass
+    try:
+        sock.close()
+    except socket.error:
+        pass
@@ -2,20 +2,52 @@
 from __future__ import print_function
 
 import imp
+import json
 import mimetypes
+import multiprocessing
 import os
 from os.path import (
     isfile, isdir, dirname, join, splitext, basename, exists, relpath, sep)
 import re
+import signal
+from threading import Lock, Thread
+import time
 
+from flask import g, request
+from jinja2 import ModuleLoader
 from jinja2.exceptions import TemplateNotFound
 
+from .archive import ArchiveWriter
+from .assets import precompress, fingerprint, DEFAULT_FINGERPRINT
+from .bccache import (
+    get_default_cache_dir as get_bytecode_cache_dir, get_fingerprint)
+from .compiled import COMPILED_DIRNAME, save_index
+from .depgraph import DependencyGraph, hash_content
 from .helpers import (
-    to_unicode, unormalize, fullmatch, make_dirs, create_file,
-    copy_if_updated, get_updated_datetime, sort_paths_dirs_last)
+    to_unicode, get_matcher, make_dirs, copy_if_updated,
+    get_updated_datetime, sort_paths_dirs_last, walk_files, get_stat)
+from .livereload import EVENTS_URL, LiveReloadHub, inject_client
+from .manifest import BuildManifest, MANIFEST_FILENAME, get_settings_key
+from .pipeline import Pipeline, Stage
+from .profiler import BuildProfile, measure, PROFILE_FILENAME, DEFAULT_TOP
+from .rendercache import (
+    RenderCache, get_default_cache_dir, make_key,
+    DEFAULT_MAX_SIZE as DEFAULT_CACHE_MAX_SIZE)
+from .renders import RenderStore
+from .responsecache import (
+    ResponseCache, CACHEABLE_METHODS, make_key as make_response_key,
+    DEFAULT_MAX_SIZE as DEFAULT_RESPONSE_CACHE_MAX_SIZE)
+from .sharding import check_shards, get_partition_key, partition
+from .sourceindex import SourceIndex
+from .stats import (
+    STATS_URL, PROMETHEUS_CONTENT_TYPE, RequestStats, add_hit_rate,
+    get_server_stats, to_prometheus)
+from .writer import (
+    OutputWriter, StaticCopier, write_file, DEFAULT_COPY_THREADS)
 from .server import Server, DEFAULT_HOST, DEFAULT_PORT
+from .watcher import (
+    get_watcher, DEFAULT_DELAY, InotifyWatcher, PollingWatcher)
 from .wsgiapp import WSGIApplication
-from functools import reduce
 
 
 SOURCE_DIRNAME = 'source'
@@ -27,11 +59,24 @@ RX_TMPL = re.compile(r'\.tmpl$')
 DEFAULT_INCLUDE = []
 DEFAULT_FILTER = ['.*']
 
+# Pseudo-dependency of every page in a build with fingerprinted assets
+ASSETS_DEPENDENCY = ':assets'
+
+HTTP_OK = 200
 HTTP_NOT_FOUND = 404
 
+COPY_THREADS_PER_JOB = 2
+RENDER_CHUNKSIZE = 4
+COMPILE_CHUNKSIZE = 8
+
 SOURCE_NOT_FOUND = u"""We couldn't found a "%s" dir.
 Check if you're in the correct folder""" % SOURCE_DIRNAME
 
+SHARDS_MISMATCH = u"""Can't merge: %s.
+Merge all the shards of the same build, made with the same `--costs`"""
+
+WATCHING = u'\n -- Watching for changes. Quit with Ctrl+C --\n'
+
 rx_abs_url = re.compile(
     r'\s(src|href|data-[a-z0-9_-]+)\s*=\s*[\'"](\/(?:[a-z0-9_-][^\'"]*)?)[\'"]',
     re.UNICODE | re.IGNORECASE)
@@ -39,7 +84,24 @@ rx_abs_url = re.compile(
 
 class Clay(object):
 
-    _cached_pages_list = None
+    # Pages found by the current build
+    _build_pages = None
+    _sources = None
+    _sources_watcher = None
+    _response_cache = None
+    # Pushes the changes to the pages open in the browser, while running
+    livereload = None
+    # Latency of the requests of the development server, if `STATS`
+    request_stats = None
+    manifest = None
+    renders = None
+    writer = None
+    copier = None
+    profile = None
+    archive = None
+    render_cache = None
+    # Stat results of the source files, taken once per build
+    _source_stats = None
 
     def __init__(self, root, settings=None):
         if isfile(root):
@@ -50,19 +112,49 @@ class Clay(object):
         self.load_settings_from_file()
         self.source_dir = to_unicode(join(root, SOURCE_DIRNAME))
         self.build_dir = to_unicode(join(root, BUILD_DIRNAME))
+        self._relative_urls = {}
+        self.assets = {}
+        # What the development server knows of the templates, to find
+        # the dependencies of the responses without parsing them again
+        self._dev_templates = {}
+        # `/_clay/stats` is only served with `STATS = True`
+        if self.settings.get('STATS'):
+            self.request_stats = RequestStats()
         self.app = self.make_app()
         self.server = Server(self)
 
     def make_app(self):
-        app = WSGIApplication(self.source_dir)
+        app = WSGIApplication(
+            self.source_dir, self.get_bytecode_cache_dir(),
+            self.get_compiled_dir())
+        app.config['STATIC_MANIFEST'] = self.assets
         self.set_urls(app)
         return app
 
+    def get_bytecode_cache_dir(self):
+        # The compiled templates are kept between runs, unless
+        # `BYTECODE_CACHE` is `False`. It can also be the path of the folder.
+        folder = self.settings.get('BYTECODE_CACHE', True)
+        if not folder:
+            return None
+        if folder is True:
+            return get_bytecode_cache_dir()
+        return join(dirname(self.source_dir), os.path.expanduser(folder))
+
+    def get_compiled_dir(self):
+        # Where `compile` writes the templates as Python modules
+        return join(dirname(self.source_dir), COMPILED_DIRNAME)
+
     def set_urls(self, app):
         app.add_url_rule('/', 'page', self.render_page)
         app.add_url_rule('/<path:path>', 'page', self.render_page)
         app.add_url_rule('/_index.html', 'index', self.show__index)
         app.add_url_rule('/_index.txt', 'index_txt', self.show__index_txt)
+        app.add_url_rule(EVENTS_URL, 'events', self.show_events)
+        if self.request_stats is not None:
+            app.add_url_rule(STATS_URL, 'stats', self.show_stats)
+            app.before_request(self.start_request_timer)
+            app.teardown_request(self.observe_request)
 
     def load_settings_from_file(self):
         if isfile(self.settings_path):
@@ -95,7 +187,7 @@ class Clay(object):
 
     def normalize_path(self, path):
         path = path or 'index.html'
-        if isdir(self.get_full_source_path(path)):
+        if self.get_sources().isdir(path):
             path = '/'.join([path, 'index.html'])
         return path
 
@@ -109,6 +201,14 @@ class Clay(object):
 
     def get_relative_url(self, relpath, currurl):
         depth = relpath.count('/')
+        key = (depth, currurl)
+        url = self._relative_urls.get(key)
+        if url is None:
+            url = self._get_relative_url(depth, currurl)
+            self._relative_urls[key] = url
+        return url
+
+    def _get_relative_url(self, depth, currurl):
         url = (r'../' * depth) + currurl.lstrip('/')
         if not url:
             return 'index.html'
@@ -118,11 +218,12 @@ class Clay(object):
         return url
 
     def make_absolute_urls_relative(self, content, relpath):
-        for attr, url in rx_abs_url.findall(content):
+        def replace(match):
+            attr, url = match.groups()
             newurl = self.get_relative_url(relpath, url)
-            repl = r' %s="%s"' % (attr, newurl)
-            content = re.sub(rx_abs_url, repl, content, count=1)
-        return content
+            return u' %s="%s"' % (attr, newurl)
+
+        return rx_abs_url.sub(replace, content)
 
     def is_html_fragment(self, content):
         head = content[:500].strip().lower()
@@ -131,35 +232,221 @@ class Clay(object):
     def must_be_included(self, path):
         patterns = (self.settings.get('INCLUDE', DEFAULT_INCLUDE)
                     or DEFAULT_INCLUDE)
-        patterns = [unormalize(to_unicode(p)) for p in patterns]
-        return reduce(lambda r, pattern: r or
-                      fullmatch(path, pattern), patterns, False)
+        return get_matcher(patterns).fullmatch(path)
 
     def must_be_filtered(self, path):
         patterns = (self.settings.get('FILTER', DEFAULT_FILTER)
                     or DEFAULT_FILTER)
-        patterns = [unormalize(to_unicode(p)) for p in patterns]
-        return reduce(lambda r, pattern: r or
-                      fullmatch(path, pattern), patterns, False)
+        return get_matcher(patterns).fullmatch(path)
 
     def must_filter_fragment(self, content):
         return (bool(self.settings.get('FILTER_PARTIALS', True))
                 and self.is_html_fragment(content))
 
+    def is_page_fragment(self, path):
+        # During a build, use the result of the page rendering (or of the
+        # previous build, if the page hasn't changed) instead of
+        # rendering it again.
+        is_fragment = None
+        if self.renders is not None:
+            is_fragment = self.renders.is_fragment(path)
+            page = self.manifest and self.manifest.pages.get(path)
+            if is_fragment is None and page:
+                is_fragment = page.get('fragment')
+        if is_fragment is not None:
+            return is_fragment
+
+        content = self.render(path, self.settings)
+        is_fragment = self.is_html_fragment(content)
+        # Only asked while making the index, after the pages are rendered,
+        # so the content wouldn't be used
+        if self.renders is not None:
+            self.renders.set_fragment(path, is_fragment)
+        return is_fragment
+
     def get_pages_list(self, pattern=None):
-        if self._cached_pages_list:
-            return self._cached_pages_list
-        if pattern:
-            pattern = unormalize(to_unicode(pattern))
-        pages = []
-        for folder, subs, files in os.walk(self.source_dir):
-            rel = self.get_relpath(folder)
-            for filename in files:
-                path = join(rel, filename)
-                if not pattern or fullmatch(path, pattern):
-                    pages.append(path)
-        self._cached_pages_list = pages
-        return pages
+        if self._build_pages is not None:
+            return list(self._build_pages)
+        return self.get_sources().list_files(pattern)
+
+    def iter_pages(self, pattern=None):
+        matcher = get_matcher([pattern]) if pattern else None
+        patterns = self.get_pruned_patterns()
+        prune = get_matcher(patterns).match if patterns else None
+        for path, st in walk_files(self.source_dir, prune):
+            if not matcher or matcher.fullmatch(path):
+                if self._source_stats is not None:
+                    self._source_stats[path] = st
+                yield path
+
+    def get_pruned_patterns(self):
+        # The patterns of the folders whose content is entirely filtered,
+        # so they can be skipped: when a pattern ending in `*` matches the
+        # folder path, it also matches all of its contents.
+        # The INCLUDE patterns could match any of them though.
+        if self.settings.get('INCLUDE'):
+            return []
+        patterns = (self.settings.get('FILTER', DEFAULT_FILTER)
+                    or DEFAULT_FILTER)
+        return [p for p in patterns if p.endswith('*')]
+
+    def get_sources(self):
+        prune = tuple(self.get_pruned_patterns())
+        sources = self._sources
+        if sources is None or sources.prune != prune:
+            sources = self._sources = SourceIndex(self.source_dir, prune)
+            sources.watched = self._sources_watcher is not None
+        return sources
+
+    def get_response_cache(self):
+        # The responses of the development server are cached in memory,
+        # unless `RESPONSE_CACHE` is `False`.
+        if not self.settings.get('RESPONSE_CACHE', True):
+            return None
+        cache = self._response_cache
+        if cache is None:
+            max_size = self.settings.get(
+                'RESPONSE_CACHE_MAX_SIZE', DEFAULT_RESPONSE_CACHE_MAX_SIZE)
+            cache = self._response_cache = ResponseCache(
+                self.source_dir, max_size)
+            cache.watched = self._sources_watcher is not None
+        return cache
+
+    def watch_sources(self):
+        # Keeps the index of the sources up to date with the changes
+        # reported by inotify, in a background thread, so the folders
+        # don't need to be checked on every request.
+        # The same thread tells the pages open in the browser to reload.
+        try:
+            watcher = InotifyWatcher(self.source_dir)
+        except (OSError, AttributeError):
+            if self.livereload is None:
+                return None
+            # Only needed by the live reload
+            watcher = PollingWatcher(self.source_dir)
+        else:
+            self._sources_watcher = watcher
+            self._sources = None
+            self._response_cache = None
+
+        def run():
+            try:
+                while True:
+                    changes = watcher.wait()
+                    if changes is not None:
+                        changes = set(to_unicode(path) for path in changes)
+                    if self._sources_watcher is watcher:
+                        self.get_sources().invalidate(changes)
+                        cache = self.get_response_cache()
+                        if cache is not None:
+                            cache.invalidate(changes)
+                    self.notify_livereload(changes)
+            except Exception:
+                # Closed or failed: go back to checking the folders
+                self._sources_watcher = None
+                self._sources = None
+                self._response_cache = None
+
+        thread = Thread(target=run, name='clay-sources-watcher')
+        thread.daemon = True
+        thread.start()
+        return watcher
+
+    def notify_livereload(self, changes):
+        hub = self.livereload
+        if hub is None:
+            return
+        # A static file (eg: a stylesheet) can be used by any page
+        if changes is not None and \
+                any(not path.endswith(TMPL_EXTS) for path in changes):
+            changes = None
+        hub.notify(changes)
+
+    def show_events(self):
+        # The stream of server-sent events of a page open in the browser.
+        # The socket is taken from the server, so the connection doesn't
+        # hold a worker thread while idle.
+        detach = request.environ.get('cheroot.detach')
+        if self.livereload is None or detach is None:
+            return self.show_notfound(request.path)
+        path = self.normalize_path(
+            to_unicode(request.args.get('path', '')).strip('/'))
+        deps = self.get_response_dependencies(self.get_page_templates(path))
+        self.livereload.add(detach(), path, deps)
+        return self.app.response('', mimetype='text/event-stream')
+
+    def start_request_timer(self):
+        g.clay_request_start = time.time()
+
+    def observe_request(self, exc=None):
+        start = getattr(g, 'clay_request_start', None)
+        if start is None:
+            return
+        rule = request.url_rule
+        route = rule.rule if rule is not None else '<notfound>'
+        self.request_stats.observe(route, time.time() - start)
+
+    def get_stats(self):
+        """The statistics of the development server: the ones of Cheroot,
+        the latency of each route, the hits of the caches and the number of
+        templates compiled.
+        """
+        wsgi_server = getattr(self.server, 'server', None)
+        compressor = self.server.compressor
+        caches = {
+            'response': self._response_cache,
+            'compressed': compressor.cache if compressor is not None else None,
+            'bytecode': self.app.jinja_options.get('bytecode_cache'),
+        }
+        access_log = self.server.access_log
+        hub = self.livereload
+        return {
+            'server': (get_server_stats(wsgi_server.stats)
+                       if wsgi_server is not None else None),
+            'routes': self.request_stats.get_stats(),
+            'caches': dict(
+                (name, add_hit_rate(cache.get_stats())
+                 if cache is not None else None)
+                for name, cache in caches.items()
+            ),
+            'templates': {'compiled': self.app.jinja_env.compiled},
+            'access_log': (access_log.get_stats()
+                           if access_log is not None else None),
+            'live_reload': {'clients': len(hub)} if hub is not None else None,
+        }
+
+    def show_stats(self):
+        # JSON, or the Prometheus text format with `?format=prometheus` or
+        # when the client asks for plain text (as Prometheus does)
+        stats = self.get_stats()
+        fmt = request.args.get('format')
+        if fmt is None:
+            accept = request.headers.get('Accept', '')
+            if 'text/plain' in accept and 'application/json' not in accept:
+                fmt = 'prometheus'
+        if fmt == 'prometheus':
+            content = to_prometheus(
+                stats, self.request_stats.get_histograms())
+            return self.app.response(
+                content, mimetype=PROMETHEUS_CONTENT_TYPE)
+        content = json.dumps(stats, sort_keys=True, indent=2)
+        return self.app.response(content, mimetype='application/json')
+
+    def get_page_templates(self, path):
+        # The templates that can change the response to `path`
+        names = [path]
+        fn, ext = splitext(path)
+        if ext == '.html':
+            names.append(fn + '.md')
+        if not any(self.get_sources().isfile(name) for name in names):
+            names.append('_notfound.html')
+        return names
+
+    def get_source_stat(self, path):
+        st = None
+        if self._source_stats is not None:
+            st = self._source_stats.get(path)
+        return st or os.stat(self.get_full_source_path(path))
 
     def get_pages_index(self):
         index = []
@@ -171,47 +458,114 @@ class Clay(object):
             if not self.must_be_included(path):
                 if self.must_be_filtered(path):
                     continue
-                content = self.render(path, self.settings)
-                if self.must_filter_fragment(content):
+                if (bool(self.settings.get('FILTER_PARTIALS', True)) and
+                        self.is_page_fragment(path)):
                     continue
 
             fullpath = self.get_full_source_path(path)
-            updated_at = get_updated_datetime(fullpath)
+            updated_at = get_updated_datetime(
+                fullpath, self.get_source_stat(path))
             index.append((path, updated_at))
         return sort_paths_dirs_last(index)
 
     def send_file(self, path):
         fp = self.get_full_source_path(path)
         try:
-            return self.app.send_file(fp)
-        except IOError:
-            return self.show_notfound(path)
+            st = os.stat(fp)
+            etag = make_file_etag(st)
+            # Answered without opening the file
+            if not self.app.is_modified(etag, st.st_mtime):
+                return self.app.not_modified(etag, st.st_mtime)
+            ranges = self.app.get_ranges(st.st_size, etag, st.st_mtime)
+            if ranges is not None:
+                return self.app.send_file_ranges(
+                    fp, st.st_size, ranges, etag, st.st_mtime)
+            resp = self.app.send_file(fp, add_etags=False)
+        except (IOError, OSError):
+            return self.show_notfound(path, None, [path])
+        resp.set_etag(etag)
+        return resp
 
     def render_page(self, path=None):
         path = self.normalize_path(path)
-
+        # The static files are sent as they are, without the cache
         if not path.endswith(TMPL_EXTS):
             return self.send_file(path)
 
+        cache_key = self.get_response_key()
+        if cache_key is not None:
+            cached = self.get_response_cache().get(cache_key)
+            if cached is not None:
+                return self.app.response(*cached)
+
+        # The templates that can change the response
+        names = [path]
         try:
             content = None
             fn, ext = splitext(path)
             if ext == '.html':
+                names.append(fn + '.md')
                 mdpath = join(self.source_dir, fn + '.md')
-                if isfile(mdpath):
+                if self.get_sources().isfile(fn + '.md'):
                     content = self.render(mdpath, self.settings)
 
             if content is None:
                 content = self.render(path, self.settings)
 
         except TemplateNotFound as e:
-            return self.show_notfound(e)
+            return self.show_notfound(e, cache_key, names)
 
         mimetype = self.guess_mimetype(self.get_real_fn(path))
-        return self.app.response(content, mimetype=mimetype)
+        return self.make_response(content, 200, mimetype, cache_key, names)
+
+    def get_response_key(self):
+        # Keyed by the path as requested, not the template it maps to:
+        # `active()` and the relative URLs depend on it, so `/` and
+        # `/index.html` may render differently.
+        if request.method not in CACHEABLE_METHODS or \
+                self.get_response_cache() is None:
+            return None
+        return make_response_key(request.path, request.values)
 
-    def _make__index(self, path):
-        index = self.get_pages_index()
+    def make_response(self, content, status, mimetype, cache_key=None,
+                      names=()):
+        # Caches the response, if there's a `cache_key`, until any of the
+        # templates `names` or its dependencies changes.
+        # The pages found have an ETag made from their content and, when
+        # their dependencies are known, the time of the last change.
+        if self.livereload is not None and mimetype == 'text/html' and \
+                not isinstance(content, bytes):
+            content = inject_client(content)
+        data = content
+        if not isinstance(data, bytes):
+            data = data.encode('utf8')
+        etag = hash_content(data) if status == HTTP_OK else None
+        last_modified = None
+        if cache_key is not None:
+            deps = self.get_response_dependencies(names)
+            if deps is not None:
+                if etag is not None:
+                    last_modified = get_last_modified(deps)
+                self.get_response_cache().set(
+                    cache_key, (data, status, mimetype, etag, last_modified),
+                    deps, len(data))
+        return self.app.response(data, status, mimetype, etag, last_modified)
+
+    def get_response_dependencies(self, names):
+        # Returns the `[size, mtime]` of the templates `names` and all
+        # of their dependencies, or `None` if any of them is dynamic.
+        graph = DependencyGraph(
+            self.app.jinja_env, self.source_dir, self._dev_templates)
+        deps = graph.get_dependencies(*names)
+        self._dev_templates.update(graph.templates)
+        if deps is None:
+            return None
+        return dict(
+            (name, graph.get_template_info(name)['stat']) for name in deps)
+
+    def _make__index(self, path, index=None):
+        if index is None:
+            index = self.get_pages_index()
         context = self.settings.copy()
         context['index'] = index
         return self.render(path, context)
@@ -221,77 +575,691 @@ class Clay(object):
         content = self._make__index(path)
         return self.app.response(content, mimetype='text/plain')
 
-    def build__index_txt(self):
+    def build__index_txt(self, index=None):
         path = '_index.txt'
         self.print_build_message(path)
-        content = self._make__index(path)
+        content = self._make__index(path, index)
         bp = self.get_full_build_path(path)
-        create_file(bp, content)
+        self.write_output(bp, content)
 
     def show__index(self):
         path = '_index.html'
         content = self._make__index(path)
         return self.app.response(content, mimetype='text/html')
 
-    def build__index(self):
+    def build__index(self, index=None):
         path = '_index.html'
         self.print_build_message(path)
-        content = self._make__index(path)
+        content = self._make__index(path, index)
         bp = self.get_full_build_path(path)
-        create_file(bp, content)
+        self.write_output(bp, content)
 
     def print_build_message(self, path):
         print(' ', to_unicode(self.remove_template_ext(path)))
 
     def build_page(self, path):
         path = to_unicode(path)
-        sp = self.get_full_source_path(path)
-        bp = self.get_full_build_path(path)
-        make_dirs(dirname(bp))
-        if not path.endswith(TMPL_EXTS):
-            if self.must_be_filtered(path):
-                return
-            self.print_build_message(path)
-            return copy_if_updated(sp, bp)
-
-        must_be_included = self.must_be_included(path)
-        if self.must_be_filtered(path) and not must_be_included:
+        self.settings['BUILD'] = True
+        make_dirs(dirname(self.get_full_build_path(path)))
+        task = self.make_build_task(path)
+        if task is None:
             return
+        task = self.rewrite_build_task(self.render_build_task(task))
+        return self.write_build_task(task)
 
-        self.settings['BUILD'] = True
-        content = self.render(path, self.settings)
-        if self.must_filter_fragment(content) and not must_be_included:
+    def make_build_task(self, path, deps=None):
+        if path.endswith(TMPL_EXTS):
+            if self.must_be_filtered(path) and not self.must_be_included(path):
+                return None
+        elif self.must_be_filtered(path):
+            return None
+        task = BuildTask(path, deps)
+        if self.profile is not None and task.is_template:
+            task.timings = {}
+        if self.render_cache is not None and task.is_template:
+            task.cache_key = make_key(
+                path, deps, self.manifest.settings_key, self.manifest.version)
+        return task
+
+    def render_build_task(self, task):
+        with measure(task.timings, 'render'):
+            return self._render_task(task)
+
+    def _render_task(self, task):
+        path = task.path
+        if not task.is_template:
+            task.bp = self.get_full_build_path(self.assets.get(path, path))
+            return task
+
+        content = None
+        if task.cache_key:
+            content = self.render_cache.get(task.cache_key)
+            task.cached = content is not None
+        if content is None:
+            content = self.render(path, self.settings)
+            if task.cache_key:
+                self.render_cache.set(task.cache_key, content)
+        task.is_fragment = self.is_html_fragment(content)
+        if self.must_filter_fragment(content) and \
+                not self.must_be_included(path):
+            return task
+
+        task.bp = self.remove_template_ext(self.get_full_build_path(path))
+        task.content = content
+        return task
+
+    def rewrite_build_task(self, task):
+        if task.content is not None and task.bp.endswith('.html'):
+            with measure(task.timings, 'rewrite'):
+                task.content = self.make_absolute_urls_relative(
+                    task.content, task.path)
+        return task
+
+    def write_build_task(self, task):
+        if task.is_template and self.renders is not None:
+            self.renders.set_fragment(task.path, task.is_fragment)
+        if task.bp is None:
+            return None
+        if self.archive is None:
+            make_dirs(dirname(task.bp))
+        self.print_build_message(task.path)
+        if task.is_template:
+            self.write_output(task.bp, task.content)
+            return task.bp
+        sp = self.get_full_source_path(task.path)
+        st = self.get_source_stat(task.path)
+        self.copy_static(sp, task.bp, st)
+        # A fingerprinted file is also copied with its own name, for the
+        # references that don't use `static()` (eg: `url()` in the CSS)
+        bp = self.get_full_build_path(task.path)
+        if bp != task.bp:
+            self.copy_static(sp, bp, st)
+        return task.bp
+
+    def copy_static(self, sp, bp, st=None):
+        if self.copier is not None:
+            return self.copier.copy(sp, bp, st)
+        copy_if_updated(sp, bp, st_in=st, **self.get_copy_options())
+
+    def get_copy_options(self):
+        return {
+            'hardlink': bool(self.settings.get('HARDLINK_STATIC')),
+            'check_hash': bool(self.settings.get('CHECK_STATIC_HASH')),
+        }
+
+    def write_output(self, bp, content):
+        if self.writer is not None:
+            return self.writer.write(bp, content)
+        write_file(bp, content.encode('utf8'))
+
+    def load_manifest(self, force=False):
+        from . import __version__
+
+        path = self.get_full_build_path(MANIFEST_FILENAME)
+        settings_key = get_settings_key(self.settings)
+        if force:
+            return BuildManifest(path, __version__, settings_key)
+        return BuildManifest.load(path, __version__, settings_key)
+
+    def get_md_pair(self, path):
+        # `foo.md` and `foo.html` are both built to `foo.html` and the
+        # server renders `foo.md` when asked for `foo.html`
+        fn, ext = splitext(path)
+        if ext == '.html':
+            pair = fn + '.md'
+        elif ext == '.md':
+            pair = fn + '.html'
+        else:
+            return None
+        if isfile(self.get_full_source_path(pair)):
+            return pair
+        return None
+
+    def get_page_dependencies(self, path, graph):
+        names = [path]
+        pair = self.get_md_pair(path)
+        if pair:
+            names.append(pair)
+        return graph.get_dependencies(*names)
+
+    def fingerprint_static(self, pages):
+        patterns = self.settings.get('FINGERPRINT')
+        if not patterns:
+            self.assets.clear()
             return
+        paths = [path for path in pages if not path.endswith(TMPL_EXTS)
+                 and not self.must_be_filtered(path)]
+        assets, hashes = fingerprint(
+            paths, self.source_dir, patterns, self.manifest.assets)
+        # Shared with the application config
+        self.assets.clear()
+        self.assets.update(assets)
+        self.manifest.assets = hashes
 
-        self.print_build_message(path)
-        bp = self.remove_template_ext(bp)
-        if bp.endswith('.html'):
-            content = self.make_absolute_urls_relative(content, path)
-        create_file(bp, content)
+    def must_rebuild_page(self, path, deps):
+        if deps is None:
+            return True
+        page = self.manifest.pages.get(path)
+        if page is None or page['deps'] != deps:
+            return True
+        output = page.get('output')
+        return bool(output) and not isfile(self.get_full_build_path(output))
 
     def run(self, host=None, port=None):
         if not exists(self.source_dir):
             print(SOURCE_NOT_FOUND)
             return None, None
-        return self.server.run(host, port)
+        # Unless `LIVE_RELOAD` is `False`, the pages open in the browser
+        # reload when their sources change
+        if self.settings.get('LIVE_RELOAD', True):
+            self.livereload = LiveReloadHub()
+        watcher = self.watch_sources()
+        try:
+            return self.server.run(host, port)
+        finally:
+            if watcher:
+                watcher.close()
+            hub, self.livereload = self.livereload, None
+            if hub is not None:
+                hub.close()
 
-    def build(self, pattern=None):
-        self._cached_pages_list = None
-        pages = self.get_pages_list(pattern)
+    def build(self, pattern=None, jobs=1, force=False, gzip=False,
+              fingerprint=False, stats=False, profile=False, archive=None,
+              shard=None, costs=None, paths=None, pool=None):
+        # With `paths`, only those pages are built, but the index
+        # includes the pages found by the last build.
+        # With `jobs > 1`, the pages are rendered by the worker processes
+        # of a `BuildPool`: the given `pool` or a new one for this build.
+        # With `archive`, the build is written to that tar or zip file
+        # instead of the build folder, and is never incremental.
+        # With `shard=(i, n)`, only the i-th of n slices of the pages is
+        # built, and the index is left for `merge`. The pages are split by
+        # hash or, if given, balanced by their `costs` (the same for every
+        # shard of the build).
+        if gzip:
+            self.settings['GZIP'] = True
+        if fingerprint and not self.settings.get('FINGERPRINT'):
+            self.settings['FINGERPRINT'] = DEFAULT_FINGERPRINT
+        # Before starting the workers, so they and this process (that
+        # makes the index) render with the same settings
+        self.settings['BUILD'] = True
         print('Building...\n')
+        if not archive:
+            make_dirs(self.build_dir)
+        self._relative_urls = {}
+        self._source_stats = {}
+        if paths is None or self.manifest is None or archive:
+            self.manifest = self.load_manifest(force or bool(archive))
+        self.manifest.shard = None
+
+        if paths is None:
+            pages = self.iter_pages(pattern)
+            if archive:
+                # Always in the same order
+                pages = sorted(pages)
+            if self.settings.get('FINGERPRINT') or shard:
+                # All the assets must be known before rendering any page
+                pages = list(pages)
+            self.fingerprint_static(pages)
+            if shard:
+                pages = self.get_shard_pages(pages, shard[0], shard[1], costs)
+                self.manifest.shard = list(shard) + [get_partition_key(costs)]
+        else:
+            pages = list(paths)
+            self.fingerprint_static(self.get_pages_list(pattern))
+
+        self.render_cache = self.get_render_cache()
+
+        # Start the worker processes before any other thread
+        own_pool = pool is None and jobs > 1
+        if own_pool:
+            pool = BuildPool(jobs)
+        workers = pool.get(self) if pool is not None else None
+
+        self.renders = RenderStore()
+        self.profile = BuildProfile() if profile else None
+        threads = self.settings.get('COPY_THREADS', DEFAULT_COPY_THREADS)
+        if jobs > 1:
+            threads = max(threads, jobs * COPY_THREADS_PER_JOB)
+        if archive:
+            self.archive = ArchiveWriter(
+                archive, self.build_dir, bool(self.settings.get('GZIP')))
+            self.writer = self.copier = self.archive
+        else:
+            self.writer = OutputWriter(
+                self.build_dir, self.manifest.outputs,
+                timings=self.profile and self.profile.writes)
+            self.copier = StaticCopier(threads, **self.get_copy_options())
+        try:
+            pipeline = self._build(
+                pattern, pages, workers, paths is not None, not shard)
+            if own_pool:
+                pool.close()
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            self.renders = None
+            copier, self.copier = self.copier, None
+            writer, self.writer = self.writer, None
+            self.archive = None
+            if copier is not writer:
+                copier.close()
+            writer.close()
+            self._source_stats = None
+        if not archive:
+            if self.settings.get('GZIP'):
+                self.manifest.compressed = precompress(
+                    self.build_dir, self.manifest.compressed, threads)
+            self.manifest.save()
+        render_cache, self.render_cache = self.render_cache, None
+        # Pruning scans the whole cache, so it's left for the full builds
+        # and not done after every rebuild of `watch`
+        if render_cache and paths is None:
+            render_cache.prune()
+        print('\nDone.')
+        if stats:
+            print(pipeline.format_stats())
+            if render_cache:
+                print(u'  render cache: %d hits, %d misses' % (
+                    render_cache.hits, render_cache.misses))
+        if profile:
+            self.save_profile()
+
+    def get_render_cache(self):
+        # `RENDER_CACHE` can be `True`, to use the default folder,
+        # or the path of the folder.
+        folder = self.settings.get('RENDER_CACHE')
+        if not folder:
+            return None
+        if folder is True:
+            folder = get_default_cache_dir()
+        folder = join(dirname(self.source_dir), os.path.expanduser(folder))
+        max_size = self.settings.get(
+            'RENDER_CACHE_MAX_SIZE', DEFAULT_CACHE_MAX_SIZE)
+        return RenderCache(folder, max_size)
+
+    def save_profile(self):
+        profile, self.profile = self.profile, None
+        profile.finish()
+        path = join(dirname(self.build_dir), PROFILE_FILENAME)
+        profile.save(path)
+        top = self.settings.get('PROFILE_TOP', DEFAULT_TOP)
+        print(u'')
+        print(profile.format_table(top))
+        print(u'\nProfile saved to %s' % path)
+
+    def _build(self, pattern, pages, pool=None, partial=False,
+               with_index=True):
+        # The pages stream through the stages of a pipeline:
+        # discovery -> filter -> render -> rewrite -> write.
+        graph = DependencyGraph(
+            self.app.jinja_env, self.source_dir, self.manifest.templates,
+            self._source_stats)
+        assets_hash = None
+        if self.assets:
+            assets_hash = hash_content(
+                json.dumps(self.assets, sort_keys=True))
+
+        discovered = []
+        dependencies = {}
+        outputs = {}
+        lock = Lock()
+
+        def filter_page(path):
+            path = to_unicode(path)
+            discovered.append(path)
+            deps = None
+            if path.endswith(TMPL_EXTS):
+                deps = self.get_page_dependencies(path, graph)
+                if deps is not None and assets_hash:
+                    deps[ASSETS_DEPENDENCY] = assets_hash
+                if not self.must_rebuild_page(path, deps):
+                    return None
+                dependencies[path] = deps
+            return self.make_build_task(path, deps)
+
+        def write(task):
+            if task.cache_key:
+                with lock:
+                    if task.cached:
+                        self.render_cache.hits += 1
+                    else:
+                        self.render_cache.misses += 1
+            output = outputs[task.path] = self.write_build_task(task)
+            if self.profile is not None:
+                if output:
+                    output = relpath(output, self.build_dir)
+                self.profile.add_task(task, output)
+            return task
+
+        # Threads of each stage, by name, in `PIPELINE_THREADS`
+        threads = self.settings.get('PIPELINE_THREADS') or {}
+
+        def get_workers(name):
+            return max(1, int(threads.get(name, 1)))
+
+        if pool:
+            render = Stage('render', imap=lambda tasks: pool.imap(
+                _render_build_task, tasks, RENDER_CHUNKSIZE))
+        else:
+            render = Stage('render', self.render_build_task,
+                           workers=get_workers('render'))
+        # The files are added to an archive in the order of the pages
+        write_workers = 1 if self.archive is not None else get_workers('write')
+        pipeline = Pipeline(pages, [
+            Stage('filter', filter_page, workers=get_workers('filter')),
+            render,
+            Stage('rewrite', self.rewrite_build_task,
+                  workers=get_workers('rewrite')),
+            Stage('write', write, workers=write_workers),
+        ])
+        pipeline.run()
+
+        for path, deps in dependencies.items():
+            output = outputs.get(path)
+            if output:
+                output = relpath(output, self.build_dir)
+            is_fragment = self.renders.is_fragment(path)
+            self.manifest.set_page(path, deps, output, is_fragment)
+        if not pattern and not partial:
+            self.manifest.remove_missing_pages(discovered)
+        self.manifest.templates.update(graph.templates)
+
+        if with_index:
+            self.build_indexes(None if partial else discovered)
+        return pipeline
+
+    def build_indexes(self, pages=None):
+        # `pages` are the ones found by the build, if it was complete
+        self._build_pages = pages
+        try:
+            index = self.get_pages_index()
+        finally:
+            self._build_pages = None
+        self.build__index(index)
+        self.build__index_txt(index)
+
+    def get_shard_pages(self, pages, index, total, costs=None):
+        # The pages that make the same output file are always in the same
+        # shard. With the `costs` of the pages, the shards are balanced by
+        # the time spent building each one.
+        groups = {}
         for path in pages:
-            self.build_page(path)
-        self.build__index()
-        self.build__index_txt()
+            groups.setdefault(self.remove_template_ext(path), []).append(path)
+        shards = partition(groups, total, costs)
+        return [path for path in pages if shards[path] == index]
+
+    def merge(self, shards):
+        # Copies the build folders of the `shards` of a build into the
+        # build folder, and makes the index of all the pages.
+        manifest = self.load_manifest(force=True)
+        settings_key = manifest.settings_key
+        manifests = [
+            BuildManifest.load(join(folder, MANIFEST_FILENAME),
+                               manifest.version, settings_key)
+            for folder in shards]
+        try:
+            check_shards([m.shard for m in manifests])
+        except ValueError as e:
+            print(SHARDS_MISMATCH % (e, ))
+            return
+        print('Merging...\n')
+        make_dirs(self.build_dir)
+        self.manifest = manifest
+        threads = self.settings.get('COPY_THREADS', DEFAULT_COPY_THREADS)
+        self.copier = StaticCopier(threads, **self.get_copy_options())
+        try:
+            for folder, shard_manifest in zip(shards, manifests):
+                print(' ', to_unicode(folder))
+                self.manifest.update(shard_manifest)
+                for path, st in walk_files(folder):
+                    if path == MANIFEST_FILENAME:
+                        continue
+                    bp = self.get_full_build_path(path)
+                    make_dirs(dirname(bp))
+                    self.copier.copy(join(folder, path), bp, st)
+        finally:
+            copier, self.copier = self.copier, None
+            copier.close()
+
+        # The manifest tells which pages are fragments
+        self.renders = RenderStore()
+        try:
+            self.build_indexes()
+        finally:
+            self.renders = None
+        self.manifest.save()
         print('\nDone.')
 
-    def show_notfound(self, path):
+    def compile(self, jobs=0):
+        # Compiles every template to a Python module, used instead of the
+        # source while the source doesn't change. `jobs=0` uses a process
+        # for each CPU.
+        if not exists(self.source_dir):
+            print(SOURCE_NOT_FOUND)
+            return
+        print('Compiling...\n')
+        folder = self.get_compiled_dir()
+        make_dirs(folder)
+        names = sorted(
+            path.replace(sep, '/') for path, st in walk_files(self.source_dir)
+            if path.endswith(TMPL_EXTS))
+        jobs = jobs or multiprocessing.cpu_count()
+        pool = None
+        if jobs > 1 and len(names) > 1:
+            pool = multiprocessing.Pool(jobs, _init_build_worker, (self,))
+        try:
+            if pool:
+                results = pool.imap_unordered(
+                    _compile_template, names, COMPILE_CHUNKSIZE)
+            else:
+                results = (self.compile_template(name) for name in names)
+            templates = self._save_compiled(folder, results)
+            if pool:
+                pool.close()
+        except BaseException:
+            if pool:
+                pool.terminate()
+            raise
+        finally:
+            if pool:
+                pool.join()
+        save_index(folder, get_fingerprint(self.app.jinja_options), templates)
+        print('\nDone. %d of %d templates compiled.' % (
+            len(templates), len(names)))
+
+    def compile_template(self, name):
+        # Returns the name, the code, the stat of the source before reading
+        # it, and the error if the template couldn't be compiled.
+        env = self.app.jinja_env
+        stat = get_stat(self.get_full_source_path(name))
+        try:
+            source, filename, uptodate = env.loader.get_source(env, name)
+            code = env.compile(
+                source, name, filename, raw=True, defer_init=True)
+        except Exception as e:
+            return name, None, stat, u'%s: %s' % (e.__class__.__name__, e)
+        return name, code, stat, None
+
+    def _save_compiled(self, folder, results):
+        templates = {}
+        modules = set()
+        for name, code, stat, error in results:
+            if error is not None:
+                print(u'  %s\n    %s' % (to_unicode(name), to_unicode(error)))
+                continue
+            print(' ', to_unicode(name))
+            filename = ModuleLoader.get_module_filename(name)
+            if not isinstance(code, bytes):
+                code = code.encode('utf8')
+            write_file(join(folder, filename), code)
+            modules.add(filename)
+            templates[name] = stat
+        # The modules of templates that don't exist anymore
+        for filename in os.listdir(folder):
+            if filename.endswith('.py') and filename not in modules:
+                os.remove(join(folder, filename))
+        return templates
+
+    def get_affected_pages(self, changes, pattern=None):
+        # Returns the pages that must be built again after the `changes`
+        # (paths of the source files created, updated or deleted), among
+        # the ones matching the `pattern`.
+        changes = set(to_unicode(path) for path in changes)
+        sources = self.get_sources()
+        sources.invalidate(changes)
+        # All of them, to tell the deleted files from the not matching ones
+        pages = sources.list_files()
+        known = set(pages)
+        changed = set()
+        for path in changes:
+            if path in known:
+                changed.add(path)
+                pair = self.get_md_pair(path)
+                if pair:
+                    changed.add(pair)
+            else:
+                self.manifest.pages.pop(path, None)
+
+        for path, page in self.manifest.pages.items():
+            deps = page['deps']
+            if deps is None or any(name in changes for name in deps):
+                changed.add(path)
+        matcher = get_matcher([pattern]) if pattern else None
+        return [path for path in pages if path in changed and
+                (not matcher or matcher.fullmatch(path))]
+
+    def rebuild(self, changes, pattern=None, **options):
+        # Builds again only the pages affected by the `changes`.
+        # A full (incremental) build is made if the changes are unknown
+        # or if they can affect the fingerprinted assets.
+        partial = (
+            changes is not None and self.manifest is not None and
+            not (self.settings.get('FINGERPRINT') and
+                 any(not path.endswith(TMPL_EXTS) for path in changes))
+        )
+        if not partial:
+            return self.build(pattern, **options)
+        paths = self.get_affected_pages(changes, pattern)
+        return self.build(pattern, paths=paths, **options)
+
+    def watch(self, pattern=None, delay=DEFAULT_DELAY, **options):
+        if not exists(self.source_dir):
+            print(SOURCE_NOT_FOUND)
+            return
+        # The worker processes are kept between the builds
+        if options.get('jobs', 1) > 1:
+            options['pool'] = BuildPool(options['jobs'])
+        watcher = get_watcher(self.source_dir)
+        try:
+            self.build(pattern, **options)
+            while True:
+                print(WATCHING)
+                changes = watcher.wait(delay)
+                self.rebuild(changes, pattern, **options)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+            if options.get('pool') is not None:
+                options['pool'].terminate()
+
+    def show_notfound(self, path, cache_key=None, names=()):
         context = self.settings.copy()
         context['path'] = path
         res = self.render('_notfound.html', context)
-        return self.app.response(res, status=HTTP_NOT_FOUND, mimetype='text/html')
+        return self.make_response(
+            res, HTTP_NOT_FOUND, 'text/html', cache_key,
+            list(names) + ['_notfound.html'])
 
     def get_test_client(self):
         host = self.settings.get('HOST', DEFAULT_HOST)
         port = self.settings.get('PORT', DEFAULT_PORT)
         return self.app.get_test_client(host, port)
+
+
+class BuildTask(object):
+
+    def __init__(self, path, deps=None):
+        self.path = path
+        self.deps = deps
+        self.is_template = path.endswith(TMPL_EXTS)
+        self.bp = None
+        self.content = None
+        self.is_fragment = None
+        # Key in the render cache and if the content came from it
+        self.cache_key = None
+        self.cached = False
+        # Dict of `[wall, cpu]` times by step, when profiling
+        self.timings = None
+
+
+class BuildPool(object):
+    """The worker processes that render the pages of a build.
+
+    They are started with a copy of the state of the `Clay` instance, so
+    they are kept for the next builds (eg: the rebuilds of `watch`) until
+    its settings or fingerprinted assets change.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self._pool = None
+        self._key = None
+
+    def get(self, clay):
+        """Returns the `multiprocessing.Pool` for a build of `clay`."""
+        key = (get_settings_key(clay.settings),
+               json.dumps(clay.assets, sort_keys=True))
+        if self._pool is not None and key != self._key:
+            self.close()
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                self.jobs, _init_build_worker, (clay,))
+            self._key = key
+        return self._pool
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def terminate(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+_build_worker = None
+
+
+def _init_build_worker(clay):
+    global _build_worker
+    # The parent process takes care of the Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    clay.app = clay.make_app()
+    _build_worker = clay
+
+
+def _render_build_task(task):
+    if task is None:
+        return None
+    return _build_worker.render_build_task(task)
+
+
+def make_file_etag(st):
+    # Strong, since the same size and mtime are assumed to be the same file
+    return '%x-%x' % (st.st_size, int(st.st_mtime * 1000000))
+
+
+def get_last_modified(deps):
+    mtimes = [stat[1] for stat in deps.values() if stat is not None]
+    return max(mtimes) if mtimes else None
+
+
+def _compile_template(name):
+    return _build_worker.compile_template(name)
@@ -6,7 +6,9 @@ from os.path import dirname, join, realpath, sep, abspath
 import baker
 from voodoo import render_skeleton
 
+from .archive import get_archive_format
 from .main import Clay, DEFAULT_HOST, DEFAULT_PORT
+from .sharding import parse_shard, load_costs
 
 
 SKELETON = join(dirname(realpath(__file__)), 'skeleton')
@@ -16,6 +18,27 @@ SKELETON_HELP = """
     Now go to %s, and do `clay run` to start the server.
 """
 
+UNKNOWN_ARCHIVE = u"""Unknown archive format: %s
+Use a .zip, .tar, .tar.gz or .tgz file"""
+
+INVALID_SHARD = u"""Invalid shard: %s
+Use `--shard i/n` to build the i-th of n parts of the site (eg: 2/4)"""
+
+INVALID_COSTS = u"""Can't read the costs from %s
+Use the `clay-profile.json` of a `clay build --profile`,
+the same for every shard"""
+
+COSTS_WITHOUT_SHARD = u'`--costs` can only be used with `--shard`'
+
+WATCH_NOT_SUPPORTED = u"""`--watch` can't be used with `--archive` or
+`--shard`. Watch a complete build into the build folder instead"""
+
+NO_RENDER_CACHE = u"""The render cache is disabled.
+Set `RENDER_CACHE = True` (or the path of a folder) in the settings
+to use it"""
+
+UNKNOWN_CACHE_ACTION = u'Unknown action: %s. Use `stats`, `prune` or `clear`'
+
 
 manager = baker.Baker()
 
@@ -55,12 +78,93 @@ def run(host=DEFAULT_HOST, port=DEFAULT_PORT, path='.'):
 
 
 @manager.command
-def build(pattern=None, path='.'):
+def build(pattern=None, path='.', jobs=1, force=False, gzip=False,
+          fingerprint=False, stats=False, profile=False, watch=False,
+          archive=None, shard=None, costs=None):
     """Generates a static copy of the sources
     """
+    if watch and (archive or shard):
+        print(WATCH_NOT_SUPPORTED)
+        return
+    if archive and not get_archive_format(archive):
+        print(UNKNOWN_ARCHIVE % (archive,))
+        return
+    if shard:
+        try:
+            shard = parse_shard(shard)
+        except ValueError:
+            print(INVALID_SHARD % (shard,))
+            return
+    if costs:
+        if not shard:
+            print(COSTS_WITHOUT_SHARD)
+            return
+        try:
+            costs = load_costs(costs)
+        except (IOError, ValueError):
+            print(INVALID_COSTS % (costs,))
+            return
+    path = abspath(path)
+    c = Clay(path)
+    options = dict(jobs=jobs, force=force, gzip=gzip,
+                   fingerprint=fingerprint, stats=stats, profile=profile)
+    if archive or shard:
+        return c.build(pattern, archive=archive, shard=shard, costs=costs,
+                       **options)
+    if watch:
+        return c.watch(pattern, **options)
+    c.build(pattern, **options)
+
+
+@manager.command
+def merge(path='.', *shards):
+    """Combines the build folders of a sharded build and makes the index
+    """
+    path = abspath(path)
+    c = Clay(path)
+    c.merge([abspath(folder) for folder in shards])
+
+
+@manager.command
+def compile(path='.', jobs=0):
+    """Compiles the templates to Python modules, used until their source
+    changes. Uses a process for each CPU, or `--jobs`
+    """
+    path = abspath(path)
+    c = Clay(path)
+    c.compile(jobs)
+
+
+@manager.command
+def cache(action='stats', path='.', size=0):
+    """Shows the size of the render cache (`stats`), removes the least
+    recently used renders until it's smaller than its max. size or
+    `--size` bytes (`prune`), or empties it (`clear`)
+    """
     path = abspath(path)
     c = Clay(path)
-    c.build(pattern)
+    render_cache = c.get_render_cache()
+    if render_cache is None:
+        print(NO_RENDER_CACHE)
+        return
+    if action == 'prune':
+        removed, freed = render_cache.prune(size or None)
+        print(u'Removed %d renders (%s)' % (removed, format_size(freed)))
+    elif action == 'clear':
+        render_cache.clear()
+        print(u'Removed everything in %s' % render_cache.folder)
+    elif action == 'stats':
+        stats = render_cache.get_stats()
+        print(u'Render cache: %s' % stats['folder'])
+        print(u'  %d renders, %s (max. %s)' % (
+            stats['entries'], format_size(stats['size']),
+            format_size(stats['max_size'])))
+    else:
+        print(UNKNOWN_CACHE_ACTION % (action,))
+
+
+def format_size(size):
+    return u'%.1f MB' % (size / (1024.0 * 1024.0))
 
 
 @manager.command
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+
+from .helpers import to_unicode
+
+
+MANIFEST_FILENAME = '.clay-manifest.json'
+
+# Keys of the settings that don't change the rendered pages
+VOLATILE_SETTINGS = ('BUILD', 'GZIP', 'COPY_THREADS', 'HARDLINK_STATIC',
+                     'CHECK_STATIC_HASH', 'PROFILE_TOP', 'RENDER_CACHE',
+                     'RENDER_CACHE_MAX_SIZE', 'BYTECODE_CACHE',
+                     'RESPONSE_CACHE', 'RESPONSE_CACHE_MAX_SIZE',
+                     'COMPRESS_RESPONSES', 'COMPRESS_CACHE_MAX_SIZE',
+                     'LIVE_RELOAD', 'ACCESS_LOG', 'ACCESS_LOG_FORMAT',
+                     'ACCESS_LOG_QUEUE_SIZE', 'ACCESS_LOG_MAX_SIZE',
+                     'ACCESS_LOG_BACKUPS', 'STATS', 'PIPELINE_THREADS')
+
+
+def get_settings_key(settings):
+    """Returns a stable representation of the settings. Values that can't be
+    serialized (modules, functions, etc.) only contribute with their name
+    and type.
+    """
+    data = dict(
+        (key, value) for key, value in settings.items()
+        if not key.startswith('_') and key not in VOLATILE_SETTINGS
+    )
+    return json.dumps(data, sort_keys=True,
+                      default=lambda obj: type(obj).__name__)
+
+
+class BuildManifest(object):
+    """The state of the last build, stored as JSON inside the build folder.
+
+    - `templates`: for each template name, the stat and hash of its source
+      and the templates it references directly (`None` if it uses dynamic
+      inheritance or inclusion).
+    - `pages`: for each built page, the hashes of every template it depends
+      on, its output path (relative to the build folder) and if it was
+      an HTML fragment.
+    - `outputs`: for each file written, its hash, size and modification
+      time, by path relative to the build folder.
+    - `assets`: the size, modification time and hash of the fingerprinted
+      static files.
+    - `compressed`: the size, modification time and hash of the files
+      when they were precompressed, by path relative to the build folder.
+    - `shard`: in the build of a shard, its `[index, total, partition key]`.
+    """
+
+    def __init__(self, path, version=None, settings_key=None):
+        self.path = path
+        self.version = version
+        self.settings_key = settings_key
+        self.templates = {}
+        self.pages = {}
+        self.outputs = {}
+        self.assets = {}
+        self.compressed = {}
+        self.shard = None
+
+    @classmethod
+    def load(cls, path, version, settings_key):
+        manifest = cls(path, version, settings_key)
+        if not os.path.isfile(path):
+            return manifest
+        try:
+            with io.open(path, 'rt', encoding='utf8') as f:
+                data = json.load(f)
+        except ValueError:
+            return manifest
+        # A different version or settings invalidates the whole build
+        if (data.get('version') != version or
+                data.get('settings') != settings_key):
+            return manifest
+        manifest.templates = data.get('templates') or {}
+        manifest.pages = data.get('pages') or {}
+        manifest.outputs = data.get('outputs') or {}
+        manifest.assets = data.get('assets') or {}
+        manifest.compressed = data.get('compressed') or {}
+        manifest.shard = data.get('shard')
+        return manifest
+
+    def save(self):
+        data = {
+            'version': self.version,
+            'settings': self.settings_key,
+            'templates': self.templates,
+            'pages': self.pages,
+            'outputs': self.outputs,
+            'assets': self.assets,
+            'compressed': self.compressed,
+            'shard': self.shard,
+        }
+        content = json.dumps(data, sort_keys=True, indent=0)
+        tmp_path = self.path + '.tmp'
+        with io.open(tmp_path, 'wt', encoding='utf8') as f:
+            f.write(to_unicode(content))
+        os.rename(tmp_path, self.path)
+
+    def update(self, other):
+        """Adds the state of another build (eg: a shard of this one)."""
+        self.templates.update(other.templates)
+        self.pages.update(other.pages)
+        self.outputs.update(other.outputs)
+        self.assets.update(other.assets)
+        self.compressed.update(other.compressed)
+
+    def set_page(self, path, deps, output=None, fragment=None):
+        self.pages[path] = {
+            'deps': deps, 'output': output, 'fragment': fragment}
+
+    def remove_missing_pages(self, pages):
+        pages = set(pages)
+        for path in list(self.pages):
+            if path not in pages:
+                del self.pages[path]
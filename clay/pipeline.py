@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+from Queue import Queue
+from threading import BoundedSemaphore, Lock, Thread
+import time
+
+
+DEFAULT_QUEUE_SIZE = 64
+
+_END = object()
+
+
+class Stage(object):
+    """A step of a `Pipeline`.
+
+    `func` is called with each item and returns the item for the next stage,
+    or `None` to drop it. Items are processed by `workers` threads, but are
+    passed to the next stage in their original order.
+
+    Instead of `func`, a stage can have an `imap` function: it receives an
+    iterator of items and must return an iterator with one result for each
+    one, in the same order (eg: the `imap` of a pool of processes).
+    Dropped items are passed to it as `None`.
+    """
+
+    def __init__(self, name, func=None, imap=None, workers=1):
+        assert func or imap
+        self.name = name
+        self.func = func
+        self.imap = imap
+        self.workers = 1 if imap else workers
+        self.count = 0
+        self.busy = 0.0
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def throughput(self):
+        elapsed = self.elapsed
+        return self.count / elapsed if elapsed else 0.0
+
+    def format_stats(self):
+        return u'  %-10s %8d items %9.3fs %10.1f items/s' % (
+            self.name, self.count, self.elapsed, self.throughput)
+
+
+class Pipeline(object):
+    """Streams the items of `source` through the `stages`, connected by
+    queues of at most `maxsize` items, so a slow stage doesn't make the
+    others accumulate all the work in memory.
+
+    The source is consumed by its own thread and counts as the first stage,
+    named `source_name`.
+    """
+
+    def __init__(self, source, stages, source_name='discovery',
+                 maxsize=DEFAULT_QUEUE_SIZE):
+        self.source = source
+        self.source_stage = Stage(source_name, func=lambda item: item)
+        self.stages = stages
+        self.maxsize = maxsize
+        self.error = None
+
+    @property
+    def all_stages(self):
+        return [self.source_stage] + list(self.stages)
+
+    def format_stats(self):
+        return u'\n'.join(stage.format_stats() for stage in self.all_stages)
+
+    def run(self):
+        queues = [Queue(self.maxsize) for stage in self.stages]
+        queues.append(None)
+        threads = [Thread(target=self._feed, args=(queues[0], ),
+                          name='clay-' + self.source_stage.name)]
+        for i, stage in enumerate(self.stages):
+            threads.extend(self._start_stage(stage, queues[i], queues[i + 1]))
+        threads[0].start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+
+    def _feed(self, outq):
+        stage = self.source_stage
+        stage.started_at = time.time()
+        seq = 0
+        try:
+            for item in self.source:
+                if self.error is not None:
+                    break
+                stage.count += 1
+                outq.put((seq, item))
+                seq += 1
+        except Exception as e:
+            self._fail(e)
+        stage.finished_at = time.time()
+        outq.put(_END)
+
+    def _start_stage(self, stage, inq, outq):
+        if stage.imap:
+            targets = [(self._run_imap, (stage, inq, outq))]
+        else:
+            state = {'next': 0, 'pending': {}, 'alive': stage.workers}
+            lock = Lock()
+            targets = [(self._run_func, (stage, inq, outq, state, lock))
+                       for i in range(stage.workers)]
+        threads = []
+        for i, (target, args) in enumerate(targets):
+            thread = Thread(target=target, args=args,
+                            name='clay-%s-%s' % (stage.name, i))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _put(self, outq, item):
+        if outq is not None:
+            outq.put(item)
+
+    def _run_func(self, stage, inq, outq, state, lock):
+        while True:
+            entry = inq.get()
+            if entry is _END:
+                # Let the other workers of this stage know
+                inq.put(_END)
+                break
+            seq, item = entry
+            if stage.started_at is None:
+                stage.started_at = time.time()
+            result = None
+            if item is not None and self.error is None:
+                start = time.time()
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    self._fail(e)
+                with lock:
+                    stage.count += 1
+                    stage.busy += time.time() - start
+            with lock:
+                # Keep the original order
+                state['pending'][seq] = result
+                while state['next'] in state['pending']:
+                    nextseq = state['next']
+                    self._put(outq, (nextseq, state['pending'].pop(nextseq)))
+                    state['next'] += 1
+
+        with lock:
+            state['alive'] -= 1
+            if state['alive']:
+                return
+        stage.finished_at = time.time()
+        self._put(outq, _END)
+
+    def _run_imap(self, stage, inq, outq):
+        # `imap` could consume the items faster than the results are used,
+        # so there are at most `maxsize` items being processed.
+        slots = BoundedSemaphore(self.maxsize)
+
+        def items():
+            while True:
+                entry = inq.get()
+                if entry is _END:
+                    return
+                if stage.started_at is None:
+                    stage.started_at = time.time()
+                slots.acquire()
+                yield entry[1] if self.error is None else None
+
+        results = stage.imap(items())
+        seq = 0
+        while True:
+            try:
+                result = next(results)
+            except StopIteration:
+                break
+            except Exception as e:
+                self._fail(e)
+                result = None
+            if result is not None:
+                stage.count += 1
+            self._put(outq, (seq, result))
+            slots.release()
+            seq += 1
+        stage.finished_at = time.time()
+        self._put(outq, _END)
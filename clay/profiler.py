@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Per-page profiling of the build.
+
+The render step is measured where it runs (in the worker processes when
+building with `--jobs`) and travels back with the page. The rewrite step
+always runs, and is measured, in the threads of the build pipeline, and the
+write step in the thread of the `OutputWriter`, both in the main process.
+"""
+from contextlib import contextmanager
+import io
+import json
+import time
+
+
+PROFILE_FILENAME = 'clay-profile.json'
+DEFAULT_TOP = 20
+STEPS = ('render', 'rewrite', 'write')
+
+# CPU time of the current thread when available (python 3.7+),
+# of the whole process otherwise.
+thread_time = getattr(time, 'thread_time', None) or time.clock
+
+
+@contextmanager
+def measure(timings, step):
+    """Stores the `[wall, cpu]` seconds spent inside the block in
+    `timings[step]`. Does nothing if `timings` is `None`.
+    """
+    if timings is None:
+        yield
+        return
+    wall, cpu = time.time(), thread_time()
+    try:
+        yield
+    finally:
+        timings[step] = [time.time() - wall, thread_time() - cpu]
+
+
+class BuildProfile(object):
+    """Collects the time spent building each page, the size of its output
+    and the templates it uses.
+    """
+
+    def __init__(self):
+        self.pages = {}
+        # `[wall, cpu, size]` of each file written, by full path.
+        # Filled by the `OutputWriter`.
+        self.writes = {}
+        self._outputs = {}
+
+    def add_task(self, task, output=None):
+        if not task.is_template or task.timings is None:
+            return
+        templates = None
+        if task.deps is not None:
+            templates = sorted(
+                name for name in task.deps if not name.startswith(':'))
+        self.pages[task.path] = {
+            'path': task.path,
+            'output': output,
+            'templates': templates,
+            'size': 0,
+            'fragment': bool(task.is_fragment),
+        }
+        for step in STEPS:
+            self.set_timing(task.path, step, task.timings.get(step))
+        if task.bp:
+            self._outputs[task.bp] = task.path
+
+    def set_timing(self, path, step, timing):
+        wall, cpu = (timing or (0.0, 0.0))[:2]
+        page = self.pages[path]
+        page[step] = {'wall': wall, 'cpu': cpu}
+        page['total'] = sum(page[s]['wall'] for s in STEPS if s in page)
+
+    def finish(self):
+        """Merges the times of the writes, once the writer is closed."""
+        for bp, (wall, cpu, size) in self.writes.items():
+            path = self._outputs.get(bp)
+            if path is None:
+                continue
+            self.set_timing(path, 'write', (wall, cpu))
+            self.pages[path]['size'] = size
+
+    def get_sorted_pages(self, key='total'):
+        return sorted(
+            self.pages.values(), key=lambda page: (-page[key], page['path']))
+
+    def get_templates(self):
+        """Returns the number of pages that use each template and the total
+        time spent rendering them. Pages with unknown templates are not
+        included.
+        """
+        templates = {}
+        for page in self.pages.values():
+            for name in page['templates'] or ():
+                info = templates.setdefault(
+                    name, {'pages': 0, 'render': 0.0, 'size': 0})
+                info['pages'] += 1
+                info['render'] += page['render']['wall']
+                info['size'] += page['size']
+        return templates
+
+    def to_dict(self):
+        return {
+            'created': int(time.time()),
+            'pages': self.get_sorted_pages(),
+            'templates': self.get_templates(),
+        }
+
+    def save(self, path):
+        data = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+        if not isinstance(data, type(u'')):
+            data = data.decode('utf8')
+        with io.open(path, 'w', encoding='utf8') as f:
+            f.write(data)
+
+    def format_table(self, top=DEFAULT_TOP):
+        lines = [u'  %-40s %10s %10s %10s %10s %10s' % (
+            u'page', u'render', u'rewrite', u'write', u'total', u'bytes')]
+        for page in self.get_sorted_pages()[:top]:
+            lines.append(u'  %-40s %8.1fms %8.1fms %8.1fms %8.1fms %10d' % (
+                page['path'],
+                page['render']['wall'] * 1000,
+                page['rewrite']['wall'] * 1000,
+                page['write']['wall'] * 1000,
+                page['total'] * 1000,
+                page['size'],
+            ))
+
+        templates = sorted(
+            self.get_templates().items(),
+            key=lambda item: (-item[1]['render'], item[0]))
+        if templates:
+            lines.append(u'')
+            lines.append(u'  %-40s %10s %10s' % (
+                u'template', u'pages', u'render'))
+            for name, info in templates[:top]:
+                lines.append(u'  %-40s %10d %8.1fms' % (
+                    name, info['pages'], info['render'] * 1000))
+        return u'\n'.join(lines)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+A cache of rendered pages shared between builds (and projects), addressed by
+the content of everything used to render them.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+
+from .helpers import get_user_cache_dir, make_dirs, walk_files
+from .writer import write_file
+
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+
+def get_default_cache_dir():
+    return get_user_cache_dir('renders')
+
+
+def make_key(path, deps, settings_key, version):
+    """The key of a page rendered from the templates with the `deps` hashes,
+    with the settings represented by `settings_key` and that version of Clay.
+    Pages with unknown dependencies can't be cached, so returns `None`.
+    """
+    if deps is None:
+        return None
+    data = json.dumps(
+        [path, deps, settings_key, version], sort_keys=True)
+    return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+
+class RenderCache(object):
+    """Stores the rendered pages in `folder`, one file for each key.
+
+    Every hit updates the modification time of the file, and `prune`
+    removes the least recently used ones until the cache is smaller than
+    `max_size` bytes.
+
+    Can be used from several processes at the same time: the files are
+    written with a temporal name and then renamed.
+    """
+
+    def __init__(self, folder, max_size=DEFAULT_MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        # Counted by the build, since the renders can happen
+        # in other processes
+        self.hits = 0
+        self.misses = 0
+
+    def get_path(self, key):
+        return os.path.join(self.folder, key[:2], key[2:])
+
+    def get(self, key):
+        path = self.get_path(key)
+        try:
+            with io.open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return data.decode('utf8')
+
+    def set(self, key, content):
+        path = self.get_path(key)
+        try:
+            make_dirs(os.path.dirname(path))
+            write_file(path, content.encode('utf8'))
+        except (IOError, OSError):
+            # A cache that can't be written is just a slower cache
+            pass
+
+    def iter_entries(self):
+        """Yields a `(path, size, mtime)` tuple for each render."""
+        if not os.path.isdir(self.folder):
+            return
+        for path, st in walk_files(self.folder):
+            if st is not None and not os.path.basename(path).startswith('.'):
+                yield os.path.join(self.folder, path), st.st_size, st.st_mtime
+
+    def get_stats(self):
+        entries = 0
+        size = 0
+        for path, fsize, mtime in self.iter_entries():
+            entries += 1
+            size += fsize
+        return {
+            'folder': self.folder,
+            'entries': entries,
+            'size': size,
+            'max_size': self.max_size,
+        }
+
+    def prune(self, max_size=None):
+        """Removes the least recently used renders until the cache is
+        smaller than `max_size`. Returns the number of renders removed and
+        the bytes freed.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = sorted(self.iter_entries(), key=lambda e: e[2])
+        size = sum(e[1] for e in entries)
+        removed = freed = 0
+        for path, fsize, mtime in entries:
+            if size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= fsize
+            removed += 1
+            freed += fsize
+        return removed, freed
+
+    def clear(self):
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder, ignore_errors=True)
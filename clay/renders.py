@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+
+class RenderStore(object):
+    """Remembers, for every page rendered during a build, if the result was
+    an HTML fragment, so no page is rendered again just to know it (eg: to
+    make the `_index`).
+    """
+
+    def __init__(self):
+        self.fragments = {}
+
+    def is_fragment(self, path):
+        return self.fragments.get(path)
+
+    def set_fragment(self, path, is_fragment):
+        self.fragments[path] = is_fragment
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory cache of the pages rendered by the development server.
+"""
+from collections import OrderedDict
+import os
+from threading import Lock
+import time
+
+from .helpers import get_stat
+from .sourceindex import RACY_INTERVAL
+
+
+# In bytes
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+CACHEABLE_METHODS = ('GET', 'HEAD')
+
+
+def make_key(path, values):
+    """The key of the response to the request `path` (as sent by the
+    client) with the query `values` (a `MultiDict`), that are part of the
+    context of the templates.
+    """
+    return (path, tuple(sorted(values.items(multi=True))))
+
+
+class _Entry(object):
+    __slots__ = ('response', 'deps', 'size')
+
+    def __init__(self, response, deps, size):
+        self.response = response
+        self.deps = deps
+        self.size = size
+
+
+class ResponseCache(object):
+    """Keeps the rendered responses, with the `[size, mtime]` of every
+    source file used to make them (or `None` for the missing ones).
+
+    An entry is discarded when any of those files changes: it is checked on
+    every hit or, if the changes are reported by a watcher (see
+    `invalidate`), set `watched` to skip those checks.
+
+    When the responses exceed `max_size` bytes, the least recently used
+    ones are removed.
+    """
+
+    def __init__(self, root, max_size=DEFAULT_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.watched = False
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached response or `None`."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and not self.watched and \
+                not self._is_fresh(entry):
+            self.discard(key, entry)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if key in self._entries:
+                # Most recently used last
+                del self._entries[key]
+                self._entries[key] = entry
+            self.hits += 1
+            return entry.response
+
+    def set(self, key, response, deps, size):
+        """Stores a `response` of `size` bytes, made from the `deps` source
+        files. Does nothing if any of them changed too recently to tell if
+        it could change again without its mtime changing.
+        """
+        if size > self.max_size:
+            return
+        limit = time.time() - RACY_INTERVAL
+        if any(stat is not None and stat[1] > limit
+               for stat in deps.values()):
+            return
+        entry = _Entry(response, deps, size)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = entry
+            self.size += size
+            while self.size > self.max_size:
+                _, old = self._entries.popitem(last=False)
+                self.size -= old.size
+
+    def discard(self, key, entry=None):
+        with self._lock:
+            current = self._entries.get(key)
+            if current is None or (entry is not None and current is not entry):
+                return
+            del self._entries[key]
+            self.size -= current.size
+
+    def invalidate(self, changes=None):
+        """Discards the responses made from any of the `changes` (paths
+        relative to `root`). With `None`, all of them.
+        """
+        with self._lock:
+            if changes is None:
+                self._entries.clear()
+                self.size = 0
+                return
+            changes = set(changes)
+            for key, entry in list(self._entries.items()):
+                if any(name in changes for name in entry.deps):
+                    del self._entries[key]
+                    self.size -= entry.size
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _is_fresh(self, entry):
+        for name, stat in entry.deps.items():
+            if get_stat(os.path.join(self.root, name)) != stat:
+                return False
+        return True
@@ -2,10 +2,15 @@
 from __future__ import print_function
 
 from datetime import datetime
+import os
 import socket
 import sys
+import time
 
+from .accesslog import AccessLog, DEFAULT_FORMAT, DEFAULT_QUEUE_SIZE, \
+    DEFAULT_MAX_SIZE, DEFAULT_BACKUPS
 from .cheroot import wsgi
+from .compression import GzipMiddleware, DEFAULT_CACHE_MAX_SIZE
 
 
 ALL_HOSTS = '0.0.0.0'
@@ -25,15 +30,54 @@ class Server(object):
 
     def __init__(self, clay):
         self.clay = clay
-        app = RequestLogger(clay.app)
+        self.access_log = None
+        app = clay.app
+        # Compressed for the clients that accept it, unless
+        # `COMPRESS_RESPONSES` is `False`
+        self.compressor = None
+        if clay.settings.get('COMPRESS_RESPONSES', True):
+            app = self.compressor = GzipMiddleware(app, clay.settings.get(
+                'COMPRESS_CACHE_MAX_SIZE', DEFAULT_CACHE_MAX_SIZE))
+        # Outside the compression, so it logs the bytes actually sent
+        app = RequestLogger(app, access_log=self.get_access_log())
         self.dispatcher = wsgi.WSGIPathInfoDispatcher({'/': app})
 
+    def get_access_log(self):
+        """The requests are logged to the standard output or, if
+        `ACCESS_LOG` is a path, to that file, by a background thread.
+        With `ACCESS_LOG = False` they are printed synchronously, without
+        their status, size and duration.
+        """
+        settings = self.clay.settings
+        path = settings.get('ACCESS_LOG', True)
+        if path is False:
+            return None
+        if path is True:
+            path = None
+        elif path:
+            # Relative to the project
+            path = os.path.join(os.path.dirname(self.clay.source_dir), path)
+        if self.access_log is None:
+            self.access_log = AccessLog(
+                path=path,
+                fmt=settings.get('ACCESS_LOG_FORMAT', DEFAULT_FORMAT),
+                queue_size=settings.get(
+                    'ACCESS_LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+                max_size=settings.get('ACCESS_LOG_MAX_SIZE', DEFAULT_MAX_SIZE),
+                backups=settings.get('ACCESS_LOG_BACKUPS', DEFAULT_BACKUPS),
+            )
+        return self.access_log
+
     def run(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
         port = port or self.clay.settings.get('port', DEFAULT_PORT)
         host = host or self.clay.settings.get('host', DEFAULT_HOST)
         max_port = port + MAX_PORT_DELTA
         print(WELCOME)
-        return self._testrun(host, port, max_port)
+        try:
+            return self._testrun(host, port, max_port)
+        finally:
+            if self.access_log is not None:
+                self.access_log.close()
 
     def _testrun(self, host, current_port, max_port):
         self.print_help_msg(host, current_port)
@@ -54,7 +98,11 @@ class Server(object):
         self.start()
 
     def _get_wsgi_server(self, host, port):
-        return wsgi.WSGIServer((host, port), wsgi_app=self.dispatcher)
+        server = wsgi.WSGIServer((host, port), wsgi_app=self.dispatcher)
+        # Served in `/_clay/stats`
+        if self.clay.settings.get('STATS'):
+            server.stats['Enabled'] = True
+        return server
 
     def start(self):
         self.server.safe_start()
@@ -72,9 +120,14 @@ class Server(object):
 
 
 class RequestLogger(object):
+    """Logs every request. With an `access_log` (see `AccessLog`), once the
+    response is sent, with its status, size and duration. Otherwise it's
+    printed right away.
+    """
 
-    def __init__(self, application, **kw):
+    def __init__(self, application, access_log=None, **kw):
         self.application = application
+        self.access_log = access_log
 
     def log_request(self, environ, now=None):
         now = now or datetime.now()
@@ -89,6 +142,8 @@ class RequestLogger(object):
         print(msg)
 
     def __call__(self, environ, start_response):
+        if self.access_log is not None:
+            return self._call_logged(environ, start_response)
         self.log_request(environ)
         try:
             return self.application(environ, start_response)
@@ -96,6 +151,74 @@ class RequestLogger(object):
             start_response(HTTPMSG, [('Content-type', 'text/plain')], sys.exc_info())
             raise
 
+    def _call_logged(self, environ, start_response):
+        now = datetime.now()
+        start = time.time()
+        response = {'status': None, 'length': None, 'size': 0}
+
+        def _start_response(status, headers, exc_info=None):
+            response['status'] = status
+            for key, value in headers:
+                if key.lower() == 'content-length' and value.isdigit():
+                    response['length'] = int(value)
+            write = start_response(status, headers, exc_info)
+
+            def _write(data):
+                response['size'] += len(data)
+                return write(data)
+            return _write
+
+        def log(size=None):
+            self.access_log.log(
+                environ, now, response['status'],
+                response['size'] if size is None else size,
+                time.time() - start)
+
+        try:
+            app_iter = self.application(environ, _start_response)
+        except Exception:
+            start_response(
+                HTTPMSG, [('Content-type', 'text/plain')], sys.exc_info())
+            response['status'] = HTTPMSG
+            log()
+            raise
+
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and isinstance(app_iter, file_wrapper):
+            # Left as it is, so the server can still use `sendfile`
+            close = getattr(app_iter, 'close', None)
+
+            def _close():
+                try:
+                    if close is not None:
+                        close()
+                finally:
+                    log(response['length'])
+            app_iter.close = _close
+            return app_iter
+        return LoggedIterable(app_iter, response, log)
+
+
+class LoggedIterable(object):
+    """Counts the bytes of the response and logs it when it's closed."""
+
+    def __init__(self, app_iter, response, log):
+        self.app_iter = app_iter
+        self.response = response
+        self.log = log
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            self.response['size'] += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.log()
+
 
 def get_local_ip():
     try:
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Splits the pages of a build in disjoint shards, so several machines can
+build a site at the same time.
+"""
+import hashlib
+import io
+import json
+import re
+
+
+RX_SHARD = re.compile(r'^\s*(\d+)\s*/\s*(\d+)\s*$')
+
+
+def parse_shard(value):
+    """Parses a `'i/n'` string (with `1 <= i <= n`) into an `(i, n)` tuple.
+    Raises `ValueError` if it isn't valid.
+    """
+    match = RX_SHARD.match(value or '')
+    if match:
+        index, total = int(match.group(1)), int(match.group(2))
+        if 1 <= index <= total:
+            return index, total
+    raise ValueError('Invalid shard: %r' % (value, ))
+
+
+def get_stable_shard(key, total):
+    # Unlike `hash()`, the same in every machine and Python version
+    if not isinstance(key, bytes):
+        key = key.encode('utf8')
+    return int(hashlib.sha1(key).hexdigest()[:8], 16) % total + 1
+
+
+def load_costs(path):
+    """Returns the total time spent building each page, from a report made
+    by `clay build --profile`. Every shard of a build must use the same one.
+    Raises `IOError` if the file can't be read or `ValueError` if it isn't
+    a valid report.
+    """
+    with io.open(path, 'rt', encoding='utf8') as f:
+        data = json.load(f)
+    try:
+        return dict(
+            (page['path'], float(page['total'])) for page in data['pages'])
+    except (KeyError, TypeError):
+        raise ValueError('Invalid profile: %r' % (path, ))
+
+
+def get_partition_key(costs=None):
+    """Identifies how the pages are split: by hash or, with `costs`, by
+    those costs. Only the shards with the same key are disjoint.
+    """
+    if not costs:
+        return 'hash'
+    data = json.dumps(sorted(costs.items())).encode('utf8')
+    return 'costs:' + hashlib.sha1(data).hexdigest()
+
+
+def check_shards(shards):
+    """Checks that the `(index, total, partition key)` of every shard of a
+    build are the ones of a complete and disjoint set.
+    Raises `ValueError` if they aren't.
+    """
+    if not shards or any(not shard for shard in shards):
+        raise ValueError('Not a shard')
+    totals = set(shard[1] for shard in shards)
+    keys = set(shard[2] for shard in shards)
+    if len(totals) > 1 or len(keys) > 1:
+        raise ValueError('Shards of different builds')
+    indexes = sorted(shard[0] for shard in shards)
+    if indexes != list(range(1, totals.pop() + 1)):
+        raise ValueError('Missing or repeated shards: %s' % (indexes, ))
+
+
+def partition(groups, total, costs=None):
+    """Assigns each group of pages to a shard, from 1 to `total`.
+
+    `groups` is a dict of lists of pages by a key. Pages in the same group
+    (eg: `foo.md` and `foo.html`, that make the same output) always go
+    to the same shard.
+
+    Without `costs`, the shard is given by a hash of the key, so adding or
+    removing pages doesn't move the others. With the `costs` of the pages
+    (in seconds), the most expensive groups are assigned first to the least
+    loaded shard. Pages without a known cost count as the average one.
+
+    Returns a dict with the shard of each page.
+    """
+    shards = {}
+    if not costs:
+        for key, pages in groups.items():
+            shard = get_stable_shard(key, total)
+            for path in pages:
+                shards[path] = shard
+        return shards
+
+    default = sum(costs.values()) / len(costs)
+
+    def get_cost(pages):
+        return sum(costs.get(path, default) for path in pages)
+
+    weighted = sorted(
+        (-get_cost(pages), key, pages) for key, pages in groups.items())
+    loads = [0.0] * total
+    for cost, key, pages in weighted:
+        index = loads.index(min(loads))
+        loads[index] -= cost
+        for path in pages:
+            shards[path] = index + 1
+    return shards
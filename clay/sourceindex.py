@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory index of the source files, used by the development server to
+list the pages and to tell if a path exists without asking the disk.
+"""
+import os
+from threading import RLock
+import time
+
+from .helpers import get_matcher, list_dir
+
+
+# A folder modified this recently (in seconds) when listed could change again
+# without its mtime changing, so is listed again in the next check.
+RACY_INTERVAL = 1.0
+
+_MISSING = object()
+# Inside a skipped folder: the disk must be checked
+_UNKNOWN = object()
+
+
+class _Folder(object):
+    # `entries` maps each name to a `_Folder`, or to `None` for the files.
+    # `mtime` is `None` if the folder must be listed again.
+    __slots__ = ('mtime', 'entries')
+
+    def __init__(self):
+        self.mtime = None
+        self.entries = {}
+
+
+_PRUNED = _Folder()
+
+
+class SourceIndex(object):
+    """A tree of the files inside `root`, built on the first use.
+
+    Before answering, the mtime of the folders involved is checked
+    and the ones that changed are listed again. If the changes are reported
+    by a watcher instead (see `invalidate`), set `watched` to skip those
+    checks.
+
+    The folders matched by the `prune` patterns, and the symlinks to
+    folders, are not indexed: the paths inside them are looked up on disk.
+    """
+
+    def __init__(self, root, prune=()):
+        self.root = root
+        self.prune = tuple(prune)
+        self._prune = get_matcher(self.prune).match if self.prune else None
+        self.watched = False
+        self._tree = None
+        self._lock = RLock()
+
+    def isfile(self, path):
+        node = self._find(path)
+        if node is _UNKNOWN:
+            return os.path.isfile(os.path.join(self.root, path))
+        return node is None
+
+    def isdir(self, path):
+        node = self._find(path)
+        if node is _UNKNOWN:
+            return os.path.isdir(os.path.join(self.root, path))
+        return isinstance(node, _Folder)
+
+    def exists(self, path):
+        node = self._find(path)
+        if node is _UNKNOWN:
+            return os.path.exists(os.path.join(self.root, path))
+        return node is not _MISSING
+
+    def list_files(self, pattern=None):
+        """Returns the relative path of every file, sorted by folder.
+        If `pattern` is given, only the matching ones.
+        """
+        matcher = get_matcher([pattern]) if pattern else None
+        files = []
+        with self._lock:
+            tree = self._get_tree()
+            pending = [(u'', tree)]
+            while pending:
+                rel, folder = pending.pop()
+                if not self._check(rel, folder):
+                    continue
+                subs = []
+                for name in sorted(folder.entries):
+                    node = folder.entries[name]
+                    path = os.path.join(rel, name)
+                    if node is None:
+                        if not matcher or matcher.fullmatch(path):
+                            files.append(path)
+                    elif node is not _PRUNED:
+                        subs.append((path, node))
+                pending.extend(reversed(subs))
+        return files
+
+    def invalidate(self, changes=None):
+        """Marks the folders of the `changes` (paths relative to `root`)
+        to be listed again. With `None`, everything is.
+        """
+        with self._lock:
+            if changes is None or self._tree is None:
+                self._tree = None
+                return
+            for path in changes:
+                parts = split_path(path)
+                if not parts:
+                    continue
+                folder = self._tree
+                for name in parts[:-1]:
+                    node = folder.entries.get(name)
+                    if not isinstance(node, _Folder) or node is _PRUNED:
+                        break
+                    folder = node
+                folder.mtime = None
+
+    def _get_tree(self):
+        if self._tree is None:
+            self._tree = _Folder()
+        return self._tree
+
+    def _find(self, path):
+        parts = split_path(path)
+        if parts is None:
+            return _MISSING
+        with self._lock:
+            node = self._get_tree()
+            rel = u''
+            for name in parts:
+                if node is _PRUNED:
+                    return _UNKNOWN
+                if not isinstance(node, _Folder) or \
+                        not self._check(rel, node):
+                    return _MISSING
+                node = node.entries.get(name, _MISSING)
+                rel = os.path.join(rel, name)
+            if node is not _PRUNED and isinstance(node, _Folder) and \
+                    not self._check(rel, node):
+                return _MISSING
+            return node
+
+    def _check(self, rel, folder):
+        # Lists the folder again if it has changed.
+        # Returns `False` if the folder doesn't exist anymore.
+        if self.watched and folder.mtime is not None:
+            return True
+        try:
+            st = os.stat(os.path.join(self.root, rel))
+        except OSError:
+            folder.entries = {}
+            return False
+        if folder.mtime is None or folder.mtime != st.st_mtime:
+            self._list(rel, folder, st.st_mtime)
+        return True
+
+    def _list(self, rel, folder, mtime):
+        now = time.time()
+        entries = {}
+        try:
+            items = list(list_dir(os.path.join(self.root, rel)))
+        except OSError:
+            items = []
+        for name, is_dir, is_link, get_stat in items:
+            if not is_dir:
+                entries[name] = None
+                continue
+            path = os.path.join(rel, name)
+            # The symlinks to folders aren't followed
+            if is_link or (self._prune and self._prune(path)):
+                entries[name] = _PRUNED
+                continue
+            node = folder.entries.get(name)
+            if not isinstance(node, _Folder) or node is _PRUNED:
+                node = _Folder()
+            entries[name] = node
+        folder.entries = entries
+        if self.watched or now - mtime >= RACY_INTERVAL:
+            folder.mtime = mtime
+        else:
+            folder.mtime = None
+
+
+def split_path(path):
+    """Splits a relative path in its parts. Returns `None` if it points
+    outside the root.
+    """
+    path = path.replace(os.sep, '/')
+    parts = [part for part in path.split('/') if part and part != '.']
+    if '..' in parts:
+        return None
+    return parts
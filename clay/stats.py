@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics of the development server, served in `/_clay/stats` as JSON or
+in the Prometheus text format.
+"""
+from bisect import bisect_left
+from threading import Lock
+
+
+STATS_URL = '/_clay/stats'
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Cheroot's statistics, by name in the Prometheus format
+SERVER_METRICS = (
+    ('Accepts', 'clay_server_accepts_total', 'counter',
+     'Connections accepted.'),
+    ('Socket Errors', 'clay_server_socket_errors_total', 'counter',
+     'Errors accepting connections.'),
+    ('Requests', 'clay_server_requests_total', 'counter',
+     'Requests served.'),
+    ('Bytes Read', 'clay_server_read_bytes_total', 'counter',
+     'Bytes read from the clients.'),
+    ('Bytes Written', 'clay_server_written_bytes_total', 'counter',
+     'Bytes written to the clients.'),
+    ('Work Time', 'clay_server_work_seconds_total', 'counter',
+     'Time the worker threads spent serving connections.'),
+    ('Queue', 'clay_server_queue', 'gauge',
+     'Connections waiting for a worker thread.'),
+    ('Threads', 'clay_server_threads', 'gauge',
+     'Worker threads.'),
+    ('Threads Idle', 'clay_server_threads_idle', 'gauge',
+     'Idle worker threads.'),
+    ('Run time', 'clay_server_uptime_seconds', 'gauge',
+     'Time since the server started.'),
+)
+
+CACHE_METRICS = (
+    ('hits', 'clay_cache_hits_total', 'counter', 'Cache hits.'),
+    ('misses', 'clay_cache_misses_total', 'counter', 'Cache misses.'),
+    ('entries', 'clay_cache_entries', 'gauge', 'Entries in the cache.'),
+    ('size', 'clay_cache_bytes', 'gauge', 'Size of the cache.'),
+)
+
+
+class LatencyHistogram(object):
+    """Counts the durations observed in buckets of fixed `bounds`, and
+    estimates their quantiles from them, like Prometheus does.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # The last one is for the durations over every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, duration):
+        self.counts[bisect_left(self.bounds, duration)] += 1
+        self.count += 1
+        self.sum += duration
+
+    def get_cumulative(self):
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def quantile(self, q):
+        """Returns the estimated `q`-quantile (0 < q < 1), interpolating
+        inside the bucket where it falls, or `None` if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower = 0.0
+        below = 0
+        for i, total in enumerate(self.get_cumulative()):
+            if total >= rank:
+                if i == len(self.bounds):
+                    # Over every bound: the best estimate is the last one
+                    return self.bounds[-1]
+                upper = self.bounds[i]
+                in_bucket = total - below
+                return lower + (upper - lower) * (rank - below) / in_bucket
+            if i < len(self.bounds):
+                lower = self.bounds[i]
+            below = total
+        return self.bounds[-1]
+
+    def to_dict(self):
+        data = {'count': self.count, 'sum': self.sum}
+        for q in QUANTILES:
+            data[quantile_name(q)] = self.quantile(q)
+        return data
+
+
+class RequestStats(object):
+    """The latency histograms of the requests, by route (the URL rule that
+    matched, so pages don't get a histogram each).
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.routes = {}
+        self._lock = Lock()
+
+    def observe(self, route, duration):
+        with self._lock:
+            histogram = self.routes.get(route)
+            if histogram is None:
+                histogram = self.routes[route] = LatencyHistogram(self.bounds)
+            histogram.observe(duration)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(
+                (route, histogram.to_dict())
+                for route, histogram in self.routes.items()
+            )
+
+    def get_histograms(self):
+        """A copy of every `(route, bounds, cumulative counts, sum)`."""
+        with self._lock:
+            return sorted(
+                (route, h.bounds, h.get_cumulative(), h.sum)
+                for route, h in self.routes.items()
+            )
+
+
+def quantile_name(q):
+    return 'p%s' % ('%g' % (q * 100)).replace('.', '_')
+
+
+def get_server_stats(stats):
+    """Evaluates the `stats` of a Cheroot server, where most of the values
+    are functions of the dict they are in.
+    """
+    data = {}
+    for key, value in stats.items():
+        if key == 'Worker Threads':
+            data[key] = dict(
+                (name, get_server_stats(thread))
+                for name, thread in value.items()
+            )
+            continue
+        if callable(value):
+            try:
+                value = value(stats)
+            except Exception:
+                # Eg: a division by zero before the server starts, or a
+                # thread that has just finished its connection
+                value = None
+        data[key] = value
+    return data
+
+
+def add_hit_rate(stats):
+    stats = dict(stats)
+    total = stats.get('hits', 0) + stats.get('misses', 0)
+    stats['hit_rate'] = float(stats.get('hits', 0)) / total if total else None
+    return stats
+
+
+def to_prometheus(data, histograms=()):
+    """Formats the stats returned by `Clay.get_stats` and the latency
+    `histograms` of `RequestStats.get_histograms` as Prometheus metrics.
+    """
+    lines = []
+
+    def metric(name, kind, help, samples):
+        samples = [(labels, value) for labels, value in samples
+                   if value is not None]
+        if not samples:
+            return
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            lines.append('%s%s %s' % (name, format_labels(labels),
+                                      format_value(value)))
+
+    server = data.get('server') or {}
+    for key, name, kind, help in SERVER_METRICS:
+        metric(name, kind, help, [((), server.get(key))])
+
+    if histograms:
+        name = 'clay_request_duration_seconds'
+        lines.append('# HELP %s Time to make the response, by route.' % name)
+        lines.append('# TYPE %s histogram' % name)
+        for route, bounds, cumulative, total in histograms:
+            les = [format_value(b) for b in bounds] + ['+Inf']
+            for le, count in zip(les, cumulative):
+                lines.append('%s_bucket%s %s' % (
+                    name, format_labels((('route', route), ('le', le))),
+                    count))
+            labels = format_labels((('route', route),))
+            lines.append('%s_sum%s %s' % (name, labels, format_value(total)))
+            lines.append('%s_count%s %s' % (name, labels, cumulative[-1]))
+
+    routes = data.get('routes') or {}
+    metric('clay_request_duration_quantile_seconds', 'gauge',
+           'Estimated quantiles of the time to make the response.', [
+               ((('route', route), ('quantile', '%g' % q)),
+                routes[route][quantile_name(q)])
+               for route in sorted(routes) for q in QUANTILES
+           ])
+
+    caches = data.get('caches') or {}
+    names = sorted(name for name in caches if caches[name] is not None)
+    for key, name, kind, help in CACHE_METRICS:
+        metric(name, kind, help, [
+            ((('cache', cache),), caches[cache].get(key)) for cache in names
+        ])
+
+    templates = data.get('templates') or {}
+    metric('clay_templates_compiled_total', 'counter',
+           'Templates compiled from their source.',
+           [((), templates.get('compiled'))])
+
+    access_log = data.get('access_log') or {}
+    metric('clay_access_log_dropped_total', 'counter',
+           'Requests not logged because the queue was full.',
+           [((), access_log.get('dropped'))])
+
+    live_reload = data.get('live_reload') or {}
+    metric('clay_live_reload_clients', 'gauge',
+           'Pages waiting for changes.', [((), live_reload.get('clients'))])
+
+    return u'\n'.join(lines) + u'\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, value.replace('\\', '\\\\').replace('"', '\\"')
+                     .replace('\n', '\\n'))
+        for key, value in labels)
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, long)):
+        return str(value)
+    return repr(float(value))
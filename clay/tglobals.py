@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
-from fnmatch import fnmatch
 from os.path import dirname
 
-from flask import request
+from flask import current_app, request
+
+from .helpers import get_matcher
+
+
+MAX_ACTIVE_CACHE = 10000
+
+# (request path, url patterns, partial) => result
+_active_cache = {}
 
 
 def _norm_url(url):
@@ -16,16 +23,28 @@ def _norm_url(url):
 
 
 def active(*url_patterns, **kwargs):
-    partial = kwargs.get('partial')
+    partial = bool(kwargs.get('partial'))
 
-    path = request.path.rstrip('/')
-    resp = u''
     # for backward compatibility
     if len(url_patterns) == 1 and isinstance(url_patterns[0], (list, tuple)):
         url_patterns = url_patterns[0]
     #
-    for url in url_patterns:
-        url = _norm_url(url)
-        if fnmatch(path, url) or (partial and path.startswith(url)):
-            return 'active'
+    key = (request.path, tuple(url_patterns), partial)
+    resp = _active_cache.get(key)
+    if resp is None:
+        urls = [_norm_url(url) for url in url_patterns]
+        path = request.path.rstrip('/')
+        resp = u'active' if get_matcher(urls, partial).match(path) else u''
+        if len(_active_cache) >= MAX_ACTIVE_CACHE:
+            _active_cache.clear()
+        _active_cache[key] = resp
     return resp
+
+
+def static(path):
+    """Returns the URL of a static file. In a build with fingerprinting
+    enabled, that's the URL of its content-hashed copy.
+    """
+    path = path.lstrip('/')
+    assets = current_app.config.get('STATIC_MANIFEST') or {}
+    return '/' + assets.get(path, path)
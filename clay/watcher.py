@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Watchers of the changes in a folder.
+
+Uses inotify on Linux (through ctypes), and stats the files
+every `interval` seconds in the other platforms.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+
+# Seconds without changes before reporting them
+DEFAULT_DELAY = 0.2
+DEFAULT_INTERVAL = 1.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF)
+
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+FS_ENCODING = sys.getfilesystemencoding() or 'utf8'
+
+
+class BaseWatcher(object):
+    """Base class of the watchers, that define `get_changes(timeout)`:
+    the changes since the last call, waiting at most `timeout` seconds for
+    them. The changes are reported as a set of paths relative to `root`,
+    or `None` if it's unknown what has changed.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def wait(self, delay=DEFAULT_DELAY, timeout=None):
+        """Waits for changes and collects them until there's `delay`
+        seconds without a new one, so a burst of saves is reported at once.
+        Returns an empty set if nothing changed before `timeout`.
+        """
+        changes = self.get_changes(timeout)
+        if changes == set():
+            return changes
+        while True:
+            more = self.get_changes(delay)
+            if more == set():
+                return changes
+            if more is None or changes is None:
+                changes = None
+            else:
+                changes |= more
+
+    def close(self):
+        pass
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+
+class PollingWatcher(BaseWatcher):
+
+    def __init__(self, root, interval=DEFAULT_INTERVAL):
+        super(PollingWatcher, self).__init__(root)
+        self.interval = interval
+        self._snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        snapshot = {}
+        for folder, subs, files in os.walk(self.root):
+            for filename in files:
+                path = os.path.join(folder, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_size, st.st_mtime)
+        return snapshot
+
+    def get_changes(self, timeout=None):
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            snapshot = self.take_snapshot()
+            old, self._snapshot = self._snapshot, snapshot
+            changes = set(
+                self.relpath(path)
+                for path in set(old) | set(snapshot)
+                if old.get(path) != snapshot.get(path)
+            )
+            if changes:
+                return changes
+            wait = self.interval
+            if end is not None:
+                wait = min(wait, end - time.time())
+                if wait <= 0:
+                    return changes
+            time.sleep(wait)
+
+
+class InotifyWatcher(BaseWatcher):
+
+    def __init__(self, root):
+        super(InotifyWatcher, self).__init__(root)
+        self._libc = get_libc()
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise_errno()
+        self._watches = {}
+        self.add_watches(root)
+
+    def add_watches(self, folder):
+        """Watches a folder and all its subfolders. Returns the files
+        already inside them.
+        """
+        found = set()
+        for path, subs, files in os.walk(folder):
+            self._add_watch(path)
+            for filename in files:
+                found.add(self.relpath(os.path.join(path, filename)))
+        return found
+
+    def _add_watch(self, path):
+        bpath = path
+        if not isinstance(bpath, bytes):
+            bpath = path.encode(FS_ENCODING)
+        wd = self._libc.inotify_add_watch(self.fd, bpath, WATCH_MASK)
+        if wd < 0:
+            raise_errno()
+        self._watches[wd] = path
+
+    def get_changes(self, timeout=None):
+        try:
+            readable = select.select([self.fd], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return set()
+            raise
+        if not readable:
+            return set()
+        return self.read_events(os.read(self.fd, READ_SIZE))
+
+    def read_events(self, data):
+        changes = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            folder = self._watches.get(wd)
+            if folder is None:
+                continue
+            if not name:
+                # The watched folder itself was removed or moved
+                continue
+            if isinstance(folder, bytes):
+                path = os.path.join(folder, name)
+            else:
+                path = os.path.join(folder, name.decode(FS_ENCODING))
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                    changes |= self.add_watches(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    # Unknown files are gone
+                    return None
+                continue
+            changes.add(self.relpath(path))
+        return changes
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def get_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def raise_errno():
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code))
+
+
+def get_watcher(root, interval=DEFAULT_INTERVAL):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(root, interval)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+from Queue import Queue
+from tempfile import mkstemp
+from threading import Lock, Thread
+
+from .helpers import copy_if_updated, get_file_mode
+from .profiler import measure
+
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_COPY_THREADS = 4
+
+
+def write_file(path, data, known=None):
+    """Writes `data` (bytes) to `path`, unless the file already has that
+    content. `known` is a `[hash, size, mtime]` list of the last content
+    written to the file, used to skip reading it.
+
+    The file is written to a temporal file first and then renamed, so it's
+    never left half-written.
+
+    Returns a `(written, [hash, size, mtime])` tuple.
+    """
+    digest = hashlib.sha1(data).hexdigest()
+    if os.path.isfile(path):
+        st = os.stat(path)
+        if st.st_size == len(data):
+            current = [digest, st.st_size, st.st_mtime]
+            if known == current:
+                return False, current
+            with open(path, 'rb') as f:
+                if hashlib.sha1(f.read()).hexdigest() == digest:
+                    return False, current
+
+    folder, filename = os.path.split(path)
+    fd, tmp_path = mkstemp(prefix='.' + filename, dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, get_file_mode(path))
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return True, [digest, len(data), os.path.getmtime(path)]
+
+
+class OutputWriter(object):
+    """Writes the files of the build in a background thread, so the rendering
+    doesn't wait for the disk.
+
+    `outputs` is a dict of the files written by a previous build (as
+    returned by `write_file`), by path relative to `build_dir`. Is updated
+    with every file written.
+
+    If a `timings` dict is given, the `[wall, cpu, size]` of each write is
+    stored in it by full path.
+    """
+
+    def __init__(self, build_dir, outputs=None, encoding='utf8',
+                 maxsize=DEFAULT_QUEUE_SIZE, timings=None):
+        self.build_dir = build_dir
+        self.outputs = outputs if outputs is not None else {}
+        self.timings = timings
+        self.encoding = encoding
+        self.written = 0
+        self.skipped = 0
+        self._error = None
+        self._queue = Queue(maxsize)
+        self._thread = Thread(target=self._run, name='clay-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, path, content):
+        self._check_error()
+        if not isinstance(content, bytes):
+            content = content.encode(self.encoding)
+        self._queue.put((path, content))
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._check_error()
+
+    def _check_error(self):
+        if self._error:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error:
+                continue
+            try:
+                self._write(*item)
+            except Exception as e:
+                self._error = e
+
+    def _write(self, path, data):
+        key = os.path.relpath(path, self.build_dir)
+        timing = None if self.timings is None else {}
+        with measure(timing, 'write'):
+            written, self.outputs[key] = write_file(
+                path, data, self.outputs.get(key))
+        if timing is not None:
+            self.timings[path] = timing['write'] + [len(data)]
+        if written:
+            self.written += 1
+        else:
+            self.skipped += 1
+
+
+class StaticCopier(object):
+    """Copies the static files of the build using a pool of threads.
+    At most `maxsize` copies are waiting at any time.
+    """
+
+    def __init__(self, threads=DEFAULT_COPY_THREADS, hardlink=False,
+                 check_hash=False, maxsize=DEFAULT_QUEUE_SIZE):
+        self.hardlink = hardlink
+        self.check_hash = check_hash
+        self.copied = 0
+        self.skipped = 0
+        self._error = None
+        self._lock = Lock()
+        self._queue = Queue(maxsize)
+        self._threads = []
+        for i in range(threads):
+            thread = Thread(target=self._run, name='clay-copier-%s' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def copy(self, path_in, path_out, st_in=None):
+        self._check_error()
+        self._queue.put((path_in, path_out, st_in))
+
+    def close(self):
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._check_error()
+
+    def _check_error(self):
+        if self._error:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error:
+                continue
+            try:
+                self._copy(*item)
+            except Exception as e:
+                self._error = e
+
+    def _copy(self, path_in, path_out, st_in=None):
+        copied = copy_if_updated(
+            path_in, path_out, self.hardlink, self.check_hash, st_in)
+        with self._lock:
+            if copied:
+                self.copied += 1
+            else:
+                self.skipped += 1
@@ -1,22 +1,42 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
-from os.path import basename
+import io
+import mimetypes
+from os.path import basename, isfile, join
+from threading import Lock
+from uuid import uuid4
 
 from flask import (Flask, request, has_request_context, render_template,
                    make_response, send_file)
+from flask.templating import Environment as FlaskEnvironment
 from jinja2 import ChoiceLoader, FileSystemLoader, PackageLoader
+from werkzeug.http import (
+    is_resource_modified, parse_if_range_header, parse_range_header)
+from werkzeug.wsgi import wrap_file
 
+from .bccache import BytecodeCache, get_fingerprint
+from .compiled import CompiledLoader, INDEX_FILENAME
 from .jinja_includewith import IncludeWith
 from .markdown_ext import MarkdownExtension
-from .tglobals import active
+from .tglobals import active, static
 
 
 APP_NAME = 'clay'
 
+HTTP_OK = 200
+HTTP_PARTIAL_CONTENT = 206
+HTTP_NOT_MODIFIED = 304
+HTTP_RANGE_NOT_SATISFIABLE = 416
+
+# More ranges than this in a request get the whole file
+MAX_RANGES = 16
+RANGE_BUFSIZE = 64 * 1024
+
 TEMPLATE_GLOBALS = {
     'CLAY_URL': 'http://lucuma.github.com/Clay',
     'active': active,
     'now': datetime.utcnow(),
+    'static': static,
     'dir': dir,
     'enumerate': enumerate,
     'map': map,
@@ -24,16 +44,45 @@ TEMPLATE_GLOBALS = {
 }
 
 
+class Environment(FlaskEnvironment):
+    """Counts the templates compiled from their source (not loaded from
+    the bytecode cache or from `clay compile`) in `compiled`.
+    """
+
+    def __init__(self, app, **options):
+        super(Environment, self).__init__(app, **options)
+        self.compiled = 0
+        self._compiled_lock = Lock()
+
+    def compile(self, *args, **kwargs):
+        with self._compiled_lock:
+            self.compiled += 1
+        return super(Environment, self).compile(*args, **kwargs)
+
+
 class WSGIApplication(Flask):
 
-    def __init__(self, source_dir):
+    jinja_environment = Environment
+
+    def __init__(self, source_dir, bytecode_cache_dir=None,
+                 compiled_dir=None):
         super(WSGIApplication, self).__init__(
             APP_NAME, template_folder=source_dir, static_folder=None)
-        self.jinja_loader = get_jinja_loader(source_dir)
         self.jinja_options = get_jinja_options()
+        fingerprint = get_fingerprint(self.jinja_options)
+        self.jinja_loader = get_jinja_loader(
+            source_dir, compiled_dir, fingerprint)
+        if bytecode_cache_dir:
+            self.jinja_options['bytecode_cache'] = BytecodeCache(
+                bytecode_cache_dir, fingerprint)
         self.context_processor(lambda: TEMPLATE_GLOBALS)
         self.debug = True
 
+    def create_global_jinja_loader(self):
+        # There are no blueprints, and Flask's loader only knows how to
+        # get the source of the templates, not how to load compiled ones.
+        return self.jinja_loader
+
     def get_test_client(self, host, port):
         self.testing = True
         self.config['SERVER_NAME'] = '%s:%s' % (host, port)
@@ -49,20 +98,178 @@ class WSGIApplication(Flask):
                 base_url='http://%s:%s' % (host, port)):
             return render_template(path, **context)
 
-    def response(self, content, status=200, mimetype='text/plain'):
+    def response(self, content, status=HTTP_OK, mimetype='text/plain',
+                 etag=None, last_modified=None):
+        if status == HTTP_OK and not self.is_modified(etag, last_modified):
+            return self.not_modified(etag, last_modified)
         resp = make_response(content, status)
         resp.mimetype = mimetype
+        set_validators(resp, etag, last_modified)
+        return resp
+
+    def is_modified(self, etag=None, last_modified=None):
+        """Returns `False` if the client already has the version of the
+        resource with that `etag` or `last_modified` timestamp.
+        """
+        if etag is None and last_modified is None:
+            return True
+        if request.method not in ('GET', 'HEAD'):
+            return True
+        if last_modified is not None:
+            last_modified = datetime.utcfromtimestamp(int(last_modified))
+        return is_resource_modified(
+            request.environ, etag, last_modified=last_modified)
+
+    def not_modified(self, etag=None, last_modified=None):
+        resp = self.response_class(status=HTTP_NOT_MODIFIED)
+        set_validators(resp, etag, last_modified)
         return resp
 
     def send_file(self, *args, **kwargs):
-        return send_file(*args, **kwargs)
+        resp = send_file(*args, **kwargs)
+        resp.accept_ranges = 'bytes'
+        return resp
+
+    def get_ranges(self, size, etag=None, last_modified=None):
+        """Returns the `(start, stop)` byte ranges of a file of `size` bytes
+        asked by the request, an empty list if none of them is in the file,
+        or `None` to send the whole file.
+        """
+        header = request.environ.get('HTTP_RANGE')
+        if not header or request.method not in ('GET', 'HEAD'):
+            return None
+        # The ranges are of the version of the file in `If-Range`
+        if_range = parse_if_range_header(request.environ.get('HTTP_IF_RANGE'))
+        if if_range.etag is not None and if_range.etag != etag:
+            return None
+        if if_range.date is not None and (
+                last_modified is None or if_range.date <
+                datetime.utcfromtimestamp(int(last_modified))):
+            return None
+        rng = parse_range_header(header)
+        if rng is None or rng.units != 'bytes' or \
+                len(rng.ranges) > MAX_RANGES:
+            return None
+        ranges = []
+        for start, stop in rng.ranges:
+            if start < 0:
+                start, stop = max(size + start, 0), size
+            else:
+                stop = size if stop is None else min(stop, size)
+            if start < stop:
+                ranges.append((start, stop))
+        return ranges
+
+    def send_file_ranges(self, path, size, ranges, etag=None,
+                         last_modified=None):
+        """Returns a `206 Partial Content` response with the `ranges` (see
+        `get_ranges`) of the file, or a `416` if there are none.
+        """
+        if not ranges:
+            resp = self.response_class(status=HTTP_RANGE_NOT_SATISFIABLE)
+            resp.headers['Content-Range'] = 'bytes */%d' % size
+            return resp
+
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        f = io.open(path, 'rb')
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            data = wrap_file(
+                request.environ, FileRange(f, start, stop - start))
+            resp = self.response_class(
+                data, status=HTTP_PARTIAL_CONTENT, mimetype=mimetype,
+                direct_passthrough=True)
+            resp.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                start, stop - 1, size)
+            resp.content_length = stop - start
+        else:
+            boundary = uuid4().hex
+            parts = []
+            for i, (start, stop) in enumerate(ranges):
+                head = '%s--%s\r\nContent-Type: %s\r\n' \
+                    'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                        '\r\n' if i else '', boundary, mimetype,
+                        start, stop - 1, size)
+                parts.append((head.encode('latin1'), start, stop))
+            tail = ('\r\n--%s--\r\n' % boundary).encode('latin1')
+            resp = self.response_class(
+                iter_byteranges(f, parts, tail), status=HTTP_PARTIAL_CONTENT,
+                content_type='multipart/byteranges; boundary=' + boundary,
+                direct_passthrough=True)
+            resp.content_length = len(tail) + sum(
+                len(head) + stop - start for head, start, stop in parts)
+        resp.accept_ranges = 'bytes'
+        set_validators(resp, etag, last_modified)
+        return resp
+
+
+class FileRange(object):
+    """The `length` bytes of an open file from `start`, to be sent with the
+    `wsgi.file_wrapper`, that can use `sendfile` since it has a `fileno`.
+    """
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.file = f
+        self.remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, offset):
+        self.remaining -= offset - self.file.tell()
+        self.file.seek(offset)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def iter_byteranges(f, parts, tail):
+    # The body of a `multipart/byteranges` response
+    try:
+        for head, start, stop in parts:
+            yield head
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                data = f.read(min(remaining, RANGE_BUFSIZE))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+        yield tail
+    finally:
+        f.close()
+
+
+def set_validators(resp, etag=None, last_modified=None):
+    if etag is not None:
+        resp.set_etag(etag)
+    if last_modified is not None:
+        resp.last_modified = int(last_modified)
 
 
-def get_jinja_loader(source_dir):
-    return ChoiceLoader([
+def get_jinja_loader(source_dir, compiled_dir=None, fingerprint=None):
+    loaders = [
         FileSystemLoader(source_dir),
         PackageLoader('clay', basename(source_dir)),
-    ])
+    ]
+    # The templates compiled by `clay compile`, if any, go first
+    if compiled_dir and isfile(join(compiled_dir, INDEX_FILENAME)):
+        loaders.insert(0, CompiledLoader(
+            compiled_dir, source_dir,
+            fingerprint or get_fingerprint(get_jinja_options())))
+    return ChoiceLoader(loaders)
 
 
 def get_jinja_options():
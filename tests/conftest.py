@@ -2,12 +2,27 @@
 """
 Directory-specific fixtures, hooks, etc. for py.test
 """
+import os
+
 from clay import Clay
 import pytest
 
 from .helpers import TESTS
 
 
+@pytest.fixture(scope='session', autouse=True)
+def user_cache_dir(tmpdir_factory):
+    # The caches that default to the user's folder (eg: the compiled
+    # templates in ~/.cache/clay/bytecode) are kept out of it
+    old = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = str(tmpdir_factory.mktemp('cache'))
+    yield os.environ['XDG_CACHE_HOME']
+    if old is None:
+        del os.environ['XDG_CACHE_HOME']
+    else:
+        os.environ['XDG_CACHE_HOME'] = old
+
+
 @pytest.fixture()
 def c():
     return Clay(TESTS, {'foo': 'bar'})
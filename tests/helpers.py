@@ -6,7 +6,10 @@ import shutil
 from StringIO import StringIO
 import sys
 from tempfile import mkdtemp
+import threading
+import time
 
+from clay.cheroot import wsgi
 from clay.helpers import make_dirs, create_file
 
 
@@ -48,6 +51,12 @@ def remove_dir(path):
         shutil.rmtree(path, ignore_errors=True)
 
 
+def get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
 def execute_and_read_stdout(f):
     old_stdout = sys.stdout
     sys.stdout = mystdout = StringIO()
@@ -57,6 +66,29 @@ def execute_and_read_stdout(f):
     return mystdout.read()
 
 
+def serve(app, **kwargs):
+    server = wsgi.WSGIServer(('127.0.0.1', 0), wsgi_app=app, **kwargs)
+    thread = threading.Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    while not server.ready:
+        time.sleep(0.01)
+    return server
+
+
+def get_large_content():
+    return u''.join(unichr(ord('a') + i % 26) for i in range(100000))
+
+
+def read_until(sock, end):
+    data = b''
+    while not data.endswith(end):
+        chunk = sock.recv(1024)
+        assert chunk, data
+        data += chunk
+    return data
+
+
 def setup_function(f=None):
     make_dirs(SOURCE_DIR)
     make_dirs(BUILD_DIR)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+import os
+from threading import Event
+
+from clay.accesslog import AccessLog, LogRecord, RotatingFile, format_record
+
+from .helpers import *
+
+
+ENVIRON = {
+    'REMOTE_ADDR': '192.168.0.25',
+    'REQUEST_URI': '/lalala',
+    'REQUEST_METHOD': 'GET',
+}
+
+
+def test_format_record():
+    now = datetime(2017, 3, 4, 12, 30, 5)
+    record = LogRecord(ENVIRON, now, '200 OK', 1234, 0.0123)
+    assert format_record(record) == \
+        u' 12:30:05 | 192.168.0.25  /lalala  (GET)  200  1234  12.3ms'
+
+    fmt = u'%(method)s %(uri)s %(status)s %(referer)s'
+    record = LogRecord(ENVIRON, now)
+    assert format_record(record, fmt) == u'GET /lalala - -'
+
+
+def test_write_to_file():
+    path = get_build_path('access.log')
+    log = AccessLog(path, fmt=u'%(uri)s %(status)s %(bytes)s')
+    log.log(ENVIRON, datetime.now(), '404 Not Found', 10, 0.1)
+    log.log(ENVIRON, datetime.now(), '200 OK', 20, 0.1)
+    log.close()
+    assert read_content(path) == u'/lalala 404 10\n/lalala 200 20\n'
+    assert log.logged == 2
+
+
+def test_record_keeps_only_the_logged_fields():
+    environ = dict(ENVIRON, **{'wsgi.input': object()})
+    record = LogRecord(environ, datetime.now())
+    assert record.environ == ENVIRON
+
+
+def test_skip_bad_records():
+    path = get_build_path('bad.log')
+    log = AccessLog(path, fmt=u'%(uri)s %(user_agent)s')
+    log.log(ENVIRON, datetime.now())
+    log.log(dict(ENVIRON, HTTP_USER_AGENT=b'\xff'), datetime.now())
+    log.log(dict(ENVIRON, REQUEST_URI='/b'), datetime.now())
+    log.close()
+    assert read_content(path) == u'/lalala -\n/b -\n'
+    assert log.logged == 2
+
+
+def test_rotate_file():
+    path = get_build_path('rotated.log')
+    f = RotatingFile(path, max_size=10, backups=2)
+    for data in (b'aaaaaa\n', b'bbbbbb\n', b'cccccc\n', b'dddddd\n'):
+        f.write(data)
+    f.close()
+    assert read_content(path) == u'dddddd\n'
+    assert read_content(path + '.1') == u'cccccc\n'
+    assert read_content(path + '.2') == u'bbbbbb\n'
+    assert not os.path.exists(path + '.3')
+
+
+def test_drop_when_full(monkeypatch):
+    path = get_build_path('dropped.log')
+    log = AccessLog(path, fmt=u'%(status)s', queue_size=2)
+    # Keep the thread busy with the first record
+    writing = Event()
+    resume = Event()
+    _write = log._write
+
+    def write(lines):
+        writing.set()
+        resume.wait(5)
+        _write(lines)
+
+    monkeypatch.setattr(log, '_write', write)
+    log.log(ENVIRON, datetime.now(), '200 OK')
+    writing.wait(5)
+    for status in ('201', '202', '203', '204'):
+        log.log(ENVIRON, datetime.now(), status)
+    assert log.dropped == 2
+    resume.set()
+    log.close()
+    lines = read_content(path).splitlines()
+    assert lines[:3] == [u'200', u'201', u'202']
+    assert lines[3] == u' -- 2 requests not logged (the log queue was full)'
+    assert log.get_stats()['logged'] == 3
@@ -2,6 +2,7 @@
 import os
 
 from clay import Clay
+from clay.manifest import MANIFEST_FILENAME, get_settings_key
 
 from .helpers import *
 
@@ -55,10 +56,40 @@ def test_build_file_without_process(c):
 def test_do_not_copy_if_build_is_newer(c):
     name = 'test.txt'
     sp, bp = create_test_file(name)
+    create_file(bp, 'build!')
     t = os.path.getmtime(sp)
     os.utime(bp, (-1, t + 1))
     c.build_page(name)
-    assert read_content(bp) == 'build'
+    assert read_content(bp) == 'build!'
+
+
+def test_copy_if_build_has_a_different_size(c):
+    name = 'test.txt'
+    sp, bp = create_test_file(name)
+    t = os.path.getmtime(sp)
+    os.utime(bp, (-1, t + 1))
+    c.build_page(name)
+    assert read_content(bp) == 'source'
+
+
+def test_do_not_copy_if_same_content(c):
+    c.settings['CHECK_STATIC_HASH'] = True
+    name = 'test.txt'
+    sp, bp = create_test_file(name)
+    create_file(bp, 'source')
+    t = os.path.getmtime(bp)
+    os.utime(sp, (-1, t + 1))
+    c.build_page(name)
+    assert os.path.getmtime(bp) == t
+
+
+def test_hardlink_static_files(c):
+    c.settings['HARDLINK_STATIC'] = True
+    name = 'test.txt'
+    sp, bp = get_file_paths(name)
+    create_file(sp, 'source')
+    c.build_page(name)
+    assert os.stat(sp).st_ino == os.stat(bp).st_ino
 
 
 def test_copy_if_source_is_newer(c):
@@ -435,3 +466,504 @@ def test_build_variable(c):
     c.build_page(name)
     result = read_content(bp)
     assert result.strip() == 'foobar'
+
+
+def test_build_parallel(c):
+    c.settings['FILTER_PARTIALS'] = False
+    make_dirs(SOURCE_DIR, 'sub')
+
+    sp1, bp1 = get_file_paths('a.txt')
+    sp2 = get_source_path('b.txt.tmpl')
+    bp2 = get_build_path('b.txt')
+    sp3, bp3 = get_file_paths('sub/c.html')
+    sp4, bp4 = get_file_paths('d.html')
+
+    create_file(sp1, u'foo')
+    create_file(sp2, u'bar{% if BUILD %}!{% endif %}')
+    create_file(sp3, u'<a href="/d.html">d</a>')
+    create_file(sp4, HTML)
+
+    serial = execute_and_read_stdout(c.build)
+    remove_dir(BUILD_DIR)
+    parallel = execute_and_read_stdout(lambda: c.build(jobs=2))
+
+    assert parallel == serial
+    assert read_content(bp1) == 'foo'
+    assert read_content(bp2) == 'bar!'
+    assert read_content(bp3) == '<a href="../d.html">d</a>'
+    assert read_content(bp4) == HTML
+
+
+def test_build_pipeline_threads(c):
+    c.settings['FILTER_PARTIALS'] = False
+    make_dirs(SOURCE_DIR, 'sub')
+    names = ['sub/p%s.html' % i for i in range(20)]
+    for name in names:
+        create_file(get_source_path(name), u'<a href="/p.html">{{ 1 + 1 }}</a>')
+    serial = execute_and_read_stdout(c.build)
+    remove_dir(BUILD_DIR)
+
+    c.settings['PIPELINE_THREADS'] = {
+        'filter': 2, 'render': 4, 'rewrite': 2, 'write': 3}
+    threaded = execute_and_read_stdout(lambda: c.build(force=True))
+    assert sorted(threaded.splitlines()) == sorted(serial.splitlines())
+    for name in names:
+        assert read_content(get_build_path(name)) == u'<a href="../p.html">2</a>'
+
+
+def test_build_parallel_index_settings(c):
+    create_file(get_source_path('a.html'), HTML)
+    create_file(get_source_path('_index.txt'),
+                u'{% if BUILD %}build{% endif %}')
+    execute_and_read_stdout(lambda: c.build(jobs=2))
+    assert read_content(get_build_path('_index.txt')) == u'build'
+
+
+def test_incremental_build(c):
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('base.html'), u'<b>{% block c %}{% endblock %}</b>')
+    create_file(get_source_path('a.html'),
+                u'{% extends "base.html" %}{% block c %}a{% endblock %}')
+    create_file(get_source_path('b.md'), u'layout: base.html\nc: b')
+    create_file(get_source_path('c.html'), u'c')
+    execute_and_read_stdout(c.build)
+
+    msg = execute_and_read_stdout(c.build)
+    assert 'a.html' not in msg
+    assert 'b.html' not in msg
+    assert 'c.html' not in msg
+
+    create_file(get_source_path('c.html'), u'cc')
+    msg = execute_and_read_stdout(c.build)
+    assert 'a.html' not in msg
+    assert 'b.html' not in msg
+    assert 'c.html' in msg
+    assert read_content(get_build_path('c.html')) == 'cc'
+
+    create_file(get_source_path('base.html'), u'<i>{% block c %}{% endblock %}</i>')
+    msg = execute_and_read_stdout(c.build)
+    assert 'a.html' in msg
+    assert 'b.html' in msg
+    assert 'c.html' not in msg
+    assert read_content(get_build_path('a.html')) == '<i>a</i>'
+    assert read_content(get_build_path('b.html')) == '<i>b</i>'
+
+
+def test_incremental_build_follows_include_with(c):
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('a.html'),
+                u'{% include "b.txt" with x=1 %}')
+    create_file(get_source_path('b.txt'), u'{{ x }}')
+    execute_and_read_stdout(c.build)
+
+    create_file(get_source_path('b.txt'), u'{{ x + 1 }}')
+    msg = execute_and_read_stdout(c.build)
+    assert 'a.html' in msg
+    assert read_content(get_build_path('a.html')) == '2'
+
+
+def test_incremental_build_rebuilds_missing_output(c):
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('a.html'), u'a')
+    execute_and_read_stdout(c.build)
+
+    remove_file(get_build_path('a.html'))
+    msg = execute_and_read_stdout(c.build)
+    assert 'a.html' in msg
+    assert exists(get_build_path('a.html'))
+
+
+def test_force_build(c):
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('a.html'), u'a')
+    execute_and_read_stdout(c.build)
+
+    msg = execute_and_read_stdout(lambda: c.build(force=True))
+    assert 'a.html' in msg
+
+
+def test_translate_absolute_to_relative_in_one_pass(c):
+    make_dirs(SOURCE_DIR, 'foo')
+    make_dirs(SOURCE_DIR, 'bar')
+    content = (u'<a href="/bar">1</a><a\nhref = \'/bar\'>2</a>'
+               u'<a href="/foo/x.html">3</a><a href="/">4</a>'
+               u'<img data-big="/foo/x.html" src="/foo/x.html">')
+
+    assert c.make_absolute_urls_relative(content, 'foo/a.html') == (
+        u'<a href="../bar">1</a><a href="../bar">2</a>'
+        u'<a href="../foo/x.html">3</a><a href="../index.html">4</a>'
+        u'<img data-big="../foo/x.html" src="../foo/x.html">')
+    assert c.make_absolute_urls_relative(content, 'a.html') == (
+        u'<a href="bar/index.html">1</a><a href="bar/index.html">2</a>'
+        u'<a href="foo/x.html">3</a><a href="index.html">4</a>'
+        u'<img data-big="foo/x.html" src="foo/x.html">')
+
+
+def test_build_renders_each_page_once(c):
+    make_dirs(SOURCE_DIR, 'sub')
+    create_file(get_source_path('a.html'), HTML)
+    create_file(get_source_path('sub/b.html'), HTML)
+    create_file(get_source_path('fragment.html'), u'lalala')
+
+    rendered = []
+    _render = c.render
+
+    def render(path, context):
+        rendered.append(path)
+        return _render(path, context)
+
+    c.render = render
+    execute_and_read_stdout(c.build)
+    assert sorted(rendered) == [
+        '_index.html', '_index.txt', 'a.html', 'fragment.html', 'sub/b.html']
+
+    del rendered[:]
+    execute_and_read_stdout(c.build)
+    assert sorted(rendered) == ['_index.html', '_index.txt']
+    page = read_content(get_build_path('_index.html'))
+    assert 'href="a.html"' in page
+    assert 'href="sub/b.html"' in page
+    assert 'href="fragment.html"' not in page
+
+
+def test_build_does_not_touch_unchanged_files(c):
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('a.html'), u'foo')
+    create_file(get_source_path('b.html'), u'bar')
+    execute_and_read_stdout(c.build)
+    bpa = get_build_path('a.html')
+    bpb = get_build_path('b.html')
+    os.utime(bpa, (1, 1))
+    os.utime(bpb, (1, 1))
+
+    create_file(get_source_path('b.html'), u'barbar')
+    execute_and_read_stdout(lambda: c.build(force=True))
+    assert os.path.getmtime(bpa) == 1
+    assert os.path.getmtime(bpb) != 1
+    assert read_content(bpb) == 'barbar'
+
+
+def test_build_gzip(c):
+    import gzip
+
+    content = HTML.replace('<body>', '<body>' + u'lorem ipsum ' * 100)
+    create_file(get_source_path('a.html'), content)
+    create_file(get_source_path('b.css'), u'body{}')
+    create_file(get_source_path('c.png'), u'lorem ipsum ' * 100)
+    execute_and_read_stdout(lambda: c.build(gzip=True))
+
+    gzpath = get_build_path('a.html.gz')
+    assert gzip.open(gzpath).read() == content
+    assert not exists(get_build_path('b.css.gz'))
+    assert not exists(get_build_path('c.png.gz'))
+    assert not exists(get_build_path(MANIFEST_FILENAME + '.gz'))
+
+    os.utime(gzpath, (1, 1))
+    execute_and_read_stdout(lambda: c.build(gzip=True))
+    assert os.path.getmtime(gzpath) == 1
+
+    # Doesn't change the pages, so it doesn't invalidate the last build
+    assert get_settings_key({'GZIP': True, 'COPY_THREADS': 8}) == \
+        get_settings_key({})
+
+
+def test_build_fingerprint(c):
+    make_dirs(SOURCE_DIR, 'static')
+    make_dirs(SOURCE_DIR, 'sub')
+    create_file(get_source_path('static/main.css'), u'body{}')
+    create_file(get_source_path('sub/index.html'), HTML.replace(
+        '<title>', '<link href="{{ static(\'/static/main.css\') }}"><title>'))
+
+    execute_and_read_stdout(lambda: c.build(fingerprint=True))
+    hashed = c.assets['static/main.css']
+    assert hashed.startswith('static/main.')
+    assert read_content(get_build_path(hashed)) == 'body{}'
+    # Also with its own name, for the references without `static()`
+    assert read_content(get_build_path('static/main.css')) == 'body{}'
+    page = read_content(get_build_path('sub/index.html'))
+    assert '<link href="../%s">' % hashed in page
+
+    create_file(get_source_path('static/main.css'), u'body{color:red}')
+    execute_and_read_stdout(c.build)
+    assert c.assets['static/main.css'] != hashed
+    page = read_content(get_build_path('sub/index.html'))
+    assert '<link href="../%s">' % c.assets['static/main.css'] in page
+
+
+def test_static_without_fingerprint(t):
+    create_file(get_source_path('index.html'), u'{{ static("main.css") }}')
+    assert t.get('/index.html').data == '/main.css'
+
+
+def test_build_stats(c):
+    create_file(get_source_path('a.html'), HTML)
+    msg = execute_and_read_stdout(lambda: c.build(stats=True))
+    for name in ('discovery', 'filter', 'render', 'rewrite', 'write'):
+        assert name in msg
+
+
+def test_build_profile(c):
+    import json
+    from clay.profiler import PROFILE_FILENAME
+
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('base.html'), u'<b>{% block c %}{% endblock %}</b>')
+    create_file(get_source_path('a.html'),
+                u'{% extends "base.html" %}{% block c %}a{% endblock %}')
+    create_file(get_source_path('c.css'), u'c')
+    path = join(TESTS, PROFILE_FILENAME)
+    try:
+        msg = execute_and_read_stdout(lambda: c.build(profile=True))
+        assert 'template' in msg
+        with open(path) as f:
+            report = json.load(f)
+    finally:
+        remove_file(path)
+
+    pages = dict((page['path'], page) for page in report['pages'])
+    assert sorted(pages) == ['a.html', 'base.html']
+    a = pages['a.html']
+    assert a['templates'] == ['a.html', 'base.html']
+    assert a['size'] == len('<b>a</b>')
+    assert a['output'] == 'a.html'
+    for step in ('render', 'rewrite', 'write'):
+        assert a[step]['wall'] >= 0
+    assert report['templates']['base.html']['pages'] == 2
+
+
+def test_rebuild_only_affected_pages(c):
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('base.html'), u'<b>{% block c %}{% endblock %}</b>')
+    create_file(get_source_path('a.html'),
+                u'{% extends "base.html" %}{% block c %}a{% endblock %}')
+    create_file(get_source_path('c.html'), u'c')
+    execute_and_read_stdout(c.build)
+
+    create_file(get_source_path('base.html'), u'<i>{% block c %}{% endblock %}</i>')
+    msg = execute_and_read_stdout(lambda: c.rebuild(set(['base.html'])))
+    assert 'a.html' in msg
+    assert 'c.html' not in msg
+    assert read_content(get_build_path('a.html')) == '<i>a</i>'
+
+
+def test_rebuild_with_pattern(c):
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('base.html'), u'<b>{% block c %}{% endblock %}</b>')
+    for name in ('a.html', 'b.html'):
+        create_file(get_source_path(name),
+                    u'{% extends "base.html" %}{% block c %}x{% endblock %}')
+    execute_and_read_stdout(c.build)
+
+    create_file(get_source_path('base.html'), u'<i>{% block c %}{% endblock %}</i>')
+    msg = execute_and_read_stdout(
+        lambda: c.rebuild(set(['base.html', 'b.html']), 'a*'))
+    assert 'a.html' in msg
+    assert 'b.html' not in msg
+    # Not deleted, just not matching
+    assert 'b.html' in c.manifest.pages
+
+
+def test_rebuild_keeps_the_worker_processes(c):
+    from clay.main import BuildPool
+
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('a.html'), u'a{{ 1 + 1 }}')
+    pool = BuildPool(2)
+    try:
+        execute_and_read_stdout(lambda: c.build(jobs=2, pool=pool))
+        workers = pool.get(c)
+        create_file(get_source_path('a.html'), u'a{{ 2 + 2 }}')
+        execute_and_read_stdout(
+            lambda: c.rebuild(set(['a.html']), jobs=2, pool=pool))
+        assert read_content(get_build_path('a.html')) == u'a4'
+        assert pool.get(c) is workers
+        # The workers must know the new settings
+        c.settings['FOO'] = 1
+        assert pool.get(c) is not workers
+    finally:
+        pool.terminate()
+
+
+def test_rebuild_updates_the_index(c):
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('a.html'), u'a')
+    create_file(get_source_path('b.html'), u'b')
+    execute_and_read_stdout(c.build)
+
+    create_file(get_source_path('d.html'), u'd')
+    remove_file(get_source_path('b.html'))
+    msg = execute_and_read_stdout(
+        lambda: c.rebuild(set(['b.html', 'd.html'])))
+    assert 'd.html' in msg
+    assert 'a.html' not in msg
+    index = read_content(get_build_path('_index.txt'))
+    assert 'd.html' in index
+    assert 'b.html' not in index
+
+
+def test_rebuild_unknown_changes(c):
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('a.html'), u'a')
+    execute_and_read_stdout(c.build)
+    create_file(get_source_path('a.html'), u'aa')
+    msg = execute_and_read_stdout(lambda: c.rebuild(None))
+    assert 'a.html' in msg
+
+
+def test_build_to_archive(c):
+    import tarfile
+    import zipfile
+
+    c.settings['FILTER_PARTIALS'] = False
+    make_dirs(SOURCE_DIR, 'foo')
+    create_file(get_source_path('foo/a.html'), u'<a href="/b.html">b</a>')
+    create_file(get_source_path('b.html'), u'b')
+    create_file(get_source_path('c.css'), u'c')
+    remove_dir(BUILD_DIR)
+
+    tgz = join(TESTS, 'site.tar.gz')
+    zpath = join(TESTS, 'site.zip')
+    try:
+        execute_and_read_stdout(lambda: c.build(archive=tgz))
+        with open(tgz, 'rb') as f:
+            first = f.read()
+        assert os.stat(tgz).st_mode & 0o777 == 0o666 & ~get_umask()
+        execute_and_read_stdout(lambda: c.build(archive=tgz))
+        with open(tgz, 'rb') as f:
+            assert f.read() == first
+
+        with tarfile.open(tgz) as tar:
+            names = tar.getnames()
+            assert tar.extractfile('foo/a.html').read() == \
+                '<a href="../b.html">b</a>'
+        assert sorted(names) == [
+            '_index.html', '_index.txt', 'b.html', 'c.css', 'foo/a.html']
+        assert names[-2:] == ['_index.html', '_index.txt']
+
+        execute_and_read_stdout(lambda: c.build(archive=zpath, gzip=True))
+        with zipfile.ZipFile(zpath) as zf:
+            assert zf.read('b.html') == 'b'
+            assert zf.read('c.css') == 'c'
+            info = zf.getinfo('b.html')
+            assert info.date_time == (1980, 1, 1, 0, 0, 0)
+    finally:
+        remove_file(tgz)
+        remove_file(zpath)
+    assert not exists(BUILD_DIR)
+
+
+def test_sharded_build_and_merge(c):
+    import shutil
+
+    names = ['p%s.html' % i for i in range(12)]
+    for name in names:
+        create_file(get_source_path(name), HTML)
+    create_file(get_source_path('frag.html'), u'fragment')
+    create_file(get_source_path('s.css'), u's')
+
+    folders = []
+    try:
+        for i in (1, 2, 3):
+            execute_and_read_stdout(lambda: c.build(shard=(i, 3)))
+            assert not exists(get_build_path('_index.html'))
+            folder = join(TESTS, 'shard%s' % i)
+            shutil.move(BUILD_DIR, folder)
+            folders.append(folder)
+
+        built = sum([os.listdir(f) for f in folders], [])
+        built = [name for name in built if name != '.clay-manifest.json']
+        assert sorted(built) == sorted(names + ['s.css'])
+
+        # All the shards of the same build are needed
+        msg = execute_and_read_stdout(lambda: c.merge(folders[:2]))
+        assert "Can't merge" in msg
+        assert not exists(BUILD_DIR)
+
+        execute_and_read_stdout(lambda: c.merge(folders))
+        for name in names + ['s.css']:
+            assert exists(get_build_path(name))
+        index = read_content(get_build_path('_index.txt'))
+        for name in names:
+            assert name in index
+        assert 'frag.html' not in index
+    finally:
+        for folder in folders:
+            remove_dir(folder)
+
+
+def test_merge_shards_with_different_costs(c):
+    import shutil
+
+    for i in range(6):
+        create_file(get_source_path('p%s.html' % i), HTML)
+    costs = {u'p0.html': 5.0, u'p1.html': 1.0}
+
+    folders = []
+    try:
+        for i, shard_costs in ((1, costs), (2, None)):
+            execute_and_read_stdout(
+                lambda: c.build(shard=(i, 2), costs=shard_costs))
+            folder = join(TESTS, 'shard%s' % i)
+            shutil.move(BUILD_DIR, folder)
+            folders.append(folder)
+
+        msg = execute_and_read_stdout(lambda: c.merge(folders))
+        assert "Can't merge: Shards of different builds" in msg
+        assert not exists(BUILD_DIR)
+    finally:
+        for folder in folders:
+            remove_dir(folder)
+
+
+def test_render_cache_is_shared_between_builds(c):
+    folder = join(TESTS, 'cache')
+    c.settings['RENDER_CACHE'] = folder
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('a.html'), u'a{{ 1 + 1 }}')
+    renders = []
+    render = c.render
+
+    def counting_render(path, context):
+        if not path.startswith('_index'):
+            renders.append(path)
+        return render(path, context)
+
+    c.render = counting_render
+    try:
+        execute_and_read_stdout(c.build)
+        assert renders == ['a.html']
+
+        # Without the previous build
+        remove_dir(BUILD_DIR)
+        msg = execute_and_read_stdout(lambda: c.build(stats=True))
+        assert renders == ['a.html']
+        assert read_content(get_build_path('a.html')) == 'a2'
+        assert '1 hits, 0 misses' in msg
+
+        create_file(get_source_path('a.html'), u'a{{ 1 + 2 }}')
+        execute_and_read_stdout(c.build)
+        assert renders == ['a.html', 'a.html']
+        assert read_content(get_build_path('a.html')) == 'a3'
+    finally:
+        remove_dir(folder)
+
+
+def test_render_cache_pruned_on_full_builds(c, monkeypatch):
+    from clay.rendercache import RenderCache
+
+    folder = join(TESTS, 'cache')
+    c.settings['RENDER_CACHE'] = folder
+    c.settings['FILTER_PARTIALS'] = False
+    create_file(get_source_path('a.html'), u'a')
+    pruned = []
+    monkeypatch.setattr(
+        RenderCache, 'prune', lambda self, max_size=None: pruned.append(1))
+    try:
+        execute_and_read_stdout(c.build)
+        assert len(pruned) == 1
+        create_file(get_source_path('a.html'), u'b')
+        execute_and_read_stdout(lambda: c.rebuild(set(['a.html'])))
+        assert read_content(get_build_path('a.html')) == u'b'
+        assert len(pruned) == 1
+    finally:
+        remove_dir(folder)
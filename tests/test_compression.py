@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import os
+
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from clay.compression import GzipMiddleware, accepts_gzip
+
+from .helpers import *
+
+
+CSS = u'a { color: red }\n' * 100
+GZIP = {'Accept-Encoding': 'gzip, deflate'}
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+
+def get_client(c):
+    app = GzipMiddleware(c.app)
+    return app, Client(app, BaseResponse)
+
+
+def test_accepts_gzip():
+    assert accepts_gzip('gzip, deflate')
+    assert accepts_gzip('deflate, GZIP;q=0.5')
+    assert accepts_gzip('*')
+    assert not accepts_gzip('gzip;q=0')
+    assert not accepts_gzip('deflate')
+    assert not accepts_gzip(None)
+
+
+def test_compress_static_file(c):
+    create_page('a.css', CSS)
+    app, client = get_client(c)
+    resp = client.get('/a.css', headers=GZIP)
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    assert int(resp.headers['Content-Length']) == len(resp.data)
+    assert gunzip(resp.data) == CSS.encode('utf8')
+    etag = resp.headers['ETag']
+    assert etag.endswith('-gzip"')
+
+    # Compressed only once
+    resp = client.get('/a.css', headers=GZIP)
+    assert gunzip(resp.data) == CSS.encode('utf8')
+    assert app.cache.hits == 1
+
+    resp = client.get('/a.css', headers=dict(GZIP, **{'If-None-Match': etag}))
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == etag
+
+
+def test_same_etag_in_other_path(c):
+    css2 = CSS.replace(u'red', u'tan')
+    create_page('a1.css', CSS)
+    create_page('a2.css', css2)
+    # Same size and mtime, so the same ETag
+    os.utime(get_source_path('a1.css'), (1, 1))
+    os.utime(get_source_path('a2.css'), (1, 1))
+    app, client = get_client(c)
+    resp1 = client.get('/a1.css', headers=GZIP)
+    resp2 = client.get('/a2.css', headers=GZIP)
+    assert resp1.headers['ETag'] == resp2.headers['ETag']
+    assert gunzip(resp1.data) == CSS.encode('utf8')
+    assert gunzip(resp2.data) == css2.encode('utf8')
+
+
+def test_not_compressed(c):
+    create_page('a.css', CSS)
+    create_page('b.css', u'a {}')
+    create_page('c.png', CSS)
+    app, client = get_client(c)
+    resp = client.get('/a.css')
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.data == CSS.encode('utf8')
+    for path in ('/b.css', '/c.png'):
+        resp = client.get(path, headers=GZIP)
+        assert 'Content-Encoding' not in resp.headers
+    resp = client.get('/a.css', headers=dict(GZIP, Range='bytes=0-9'))
+    assert resp.status_code == 206
+    assert 'Content-Encoding' not in resp.headers
+
+
+def test_not_worth_compressing(c):
+    content = os.urandom(1024)
+    with open(get_source_path('a.txt'), 'wb') as f:
+        f.write(content)
+    app, client = get_client(c)
+    for i in range(2):
+        resp = client.get('/a.txt', headers=GZIP)
+        assert 'Content-Encoding' not in resp.headers
+        assert resp.data == content
+    assert (app.cache.hits, app.cache.misses) == (1, 1)
+
+
+def test_compress_stream():
+    def application(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return iter([b'abc' * 100, b'def' * 100])
+
+    client = Client(GzipMiddleware(application), BaseResponse)
+    resp = client.get('/', headers=GZIP)
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in resp.headers
+    assert gunzip(resp.data) == b'abc' * 100 + b'def' * 100
+
+
+def test_head_like_get(c):
+    create_page('a.css', CSS)
+    app, client = get_client(c)
+    get = client.get('/a.css', headers=GZIP)
+    head = client.head('/a.css', headers=GZIP)
+    assert head.status_code == 200
+    assert head.data == b''
+    for name in ('Content-Encoding', 'Content-Length', 'ETag', 'Vary'):
+        assert head.headers[name] == get.headers[name]
+
+
+def test_close_stream():
+    closed = []
+
+    class Body(object):
+        def __iter__(self):
+            return iter([b'abc' * 100])
+
+        def close(self):
+            closed.append(True)
+
+    def application(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return Body()
+
+    client = Client(GzipMiddleware(application), BaseResponse)
+    resp = client.get('/', headers=GZIP, buffered=True)
+    assert gunzip(resp.data) == b'abc' * 100
+    assert closed == [True]
+    resp = client.head('/', headers=GZIP, buffered=True)
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.data == b''
+    assert closed == [True, True]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+
+from clay.helpers import (
+    PatternMatcher, fullmatch, get_matcher, copy_if_updated, walk_files)
+
+from .helpers import *
+
+
+PATHS = [u'a.html', u'b/aa.html', u'b/z.html', u'.DS_Store', u'foo/.git/x',
+         u'mañana.txt', u'b/sub/c.txt']
+PATTERNS = [u'b/a*', u'.*', u'*.txt', u'ma?ana.*']
+
+
+def test_matcher_is_like_fullmatch():
+    matcher = PatternMatcher(PATTERNS)
+    for path in PATHS:
+        expected = any(fullmatch(path, p) for p in PATTERNS)
+        assert matcher.fullmatch(path) == expected
+
+
+def test_empty_matcher():
+    matcher = PatternMatcher([])
+    assert not matcher.match(u'foo')
+    assert not matcher.fullmatch(u'foo')
+
+
+def test_matcher_partial():
+    matcher = PatternMatcher([u'/foo/b'], partial=True)
+    assert matcher.match(u'/foo/bar.html')
+    assert not matcher.match(u'/fo')
+
+
+def test_get_matcher_is_cached():
+    assert get_matcher([u'*.html']) is get_matcher((u'*.html', ))
+    assert get_matcher([u'*.html']) is not get_matcher([u'*.html'], True)
+
+
+def test_copy_if_updated():
+    sp = get_source_path('a.bin')
+    bp = get_build_path('a.bin')
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    with open(sp, 'wb') as f:
+        f.write(data)
+
+    assert copy_if_updated(sp, bp)
+    with open(bp, 'rb') as f:
+        assert f.read() == data
+    assert abs(os.path.getmtime(bp) - os.path.getmtime(sp)) < 0.001
+    assert not copy_if_updated(sp, bp)
+
+
+def test_copy_with_sendfile(monkeypatch):
+    from clay import helpers
+    calls = []
+
+    def sendfile(outfd, infd, offset, count):
+        calls.append((offset, count))
+        os.lseek(infd, offset, os.SEEK_SET)
+        return os.write(outfd, os.read(infd, min(count, 1024 * 1024)))
+
+    monkeypatch.setattr(helpers, 'sendfile', sendfile)
+    sp = get_source_path('a.bin')
+    bp = get_build_path('a.bin')
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    with open(sp, 'wb') as f:
+        f.write(data)
+    assert copy_if_updated(sp, bp)
+    with open(bp, 'rb') as f:
+        assert f.read() == data
+    assert calls[0] == (0, len(data))
+    assert len(calls) == 4
+
+
+def test_copy_without_sendfile(monkeypatch):
+    from clay import helpers
+
+    def sendfile(outfd, infd, offset, count):
+        os.write(outfd, b'partial')
+        raise OSError(errno.EINVAL, 'Invalid argument')
+
+    monkeypatch.setattr(helpers, 'sendfile', sendfile)
+    sp = get_source_path('a.txt')
+    bp = get_build_path('a.txt')
+    create_file(sp, u'abc')
+    assert copy_if_updated(sp, bp)
+    with open(bp, 'rb') as f:
+        assert f.read() == b'abc'
+
+
+def test_walk_files():
+    make_dirs(SOURCE_DIR, 'a/b')
+    make_dirs(SOURCE_DIR, 'skip')
+    create_file(get_source_path('x.txt'), u'x')
+    create_file(get_source_path('a/b/y.txt'), u'yy')
+    create_file(get_source_path('skip/z.txt'), u'z')
+    os.symlink(get_source_path('a'), get_source_path('link'))
+
+    found = dict(walk_files(SOURCE_DIR, lambda path: path == 'skip'))
+    assert sorted(found) == sorted(['x.txt', os.path.join('a', 'b', 'y.txt')])
+    assert found['x.txt'].st_size == 1
+    assert found[os.path.join('a', 'b', 'y.txt')].st_size == 2
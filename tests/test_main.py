@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import time
+
 from clay import Clay
 
 from .helpers import *
@@ -148,6 +150,40 @@ def test_get_pages_list(c):
     assert expected == result
 
 
+def test_get_pages_list_skips_filtered_folders(c):
+    make_dirs(SOURCE_DIR, '.git')
+    make_dirs(SOURCE_DIR, 'bbb/.hidden')
+    create_file(get_source_path('aaa.html'), HTML)
+    create_file(get_source_path('.git/config'), u'')
+    create_file(get_source_path('bbb/.hidden/ccc.html'), HTML)
+
+    result = sorted(c.get_pages_list())
+    assert result == ['aaa.html', 'bbb/.hidden/ccc.html']
+
+    c.settings['INCLUDE'] = ['.git/config']
+    result = sorted(c.get_pages_list())
+    assert result == ['.git/config', 'aaa.html', 'bbb/.hidden/ccc.html']
+
+
+def test_get_pages_list_with_pattern(c):
+    make_dirs(SOURCE_DIR, 'bbb')
+    create_file(get_source_path('aaa.html'), HTML)
+    create_file(get_source_path('bbb/ccc.html'), HTML)
+
+    assert c.get_pages_list('bbb/*') == ['bbb/ccc.html']
+    assert sorted(c.get_pages_list()) == ['aaa.html', 'bbb/ccc.html']
+
+
+def test_index_is_updated(t):
+    create_file(get_source_path('aaa.html'), HTML)
+    resp = t.get('/_index.txt')
+    assert 'ddd.html' not in resp.data
+
+    create_file(get_source_path('ddd.html'), HTML)
+    resp = t.get('/_index.txt')
+    assert 'ddd.html' in resp.data
+
+
 def test_show__index_txt(t):
     make_dirs(SOURCE_DIR, 'bbb')
 
@@ -330,3 +366,198 @@ def test_no_build_variable(t):
     url = '/' + name
     resp = t.get(url)
     assert resp.data == u'foo'
+
+
+def test_bytecode_cache(c):
+    folder = join(TESTS, 'bytecode')
+    c.settings['BYTECODE_CACHE'] = folder
+    create_file(get_source_path('a.md'), u'{{ 1 + 1 }}')
+    try:
+        c.app = c.make_app()
+        assert c.render('a.md', {}).strip() == u'<p>2</p>'
+        assert os.listdir(folder)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('Compiled again')
+
+        c.app = c.make_app()
+        c.app.jinja_env.compile = fail
+        assert c.render('a.md', {}).strip() == u'<p>2</p>'
+
+        # A different preprocessing is a different key
+        cache = c.app.jinja_env.bytecode_cache
+        key = cache.get_cache_key('a.md')
+        cache.fingerprint += 'x'
+        assert cache.get_cache_key('a.md') != key
+    finally:
+        remove_dir(folder)
+
+
+def test_bytecode_cache_disabled(c):
+    c.settings['BYTECODE_CACHE'] = False
+    c.app = c.make_app()
+    assert c.app.jinja_env.bytecode_cache is None
+
+
+def test_compiled_templates(c):
+    folder = c.get_compiled_dir()
+    c.settings['BYTECODE_CACHE'] = False
+    create_file(get_source_path('a.md'), u'{{ 1 + 1 }}')
+    create_file(get_source_path('b.html'), u'{% bad')
+    try:
+        c.compile(jobs=1)
+        assert os.path.isfile(join(folder, 'index.json'))
+
+        def fail(*args, **kwargs):
+            raise AssertionError('Compiled again')
+
+        c.app = c.make_app()
+        c.app.jinja_env.compile = fail
+        assert c.render('a.md', {}).strip() == u'<p>2</p>'
+        # Not compiled because of the error
+        assert 'b.html' not in c.app.jinja_loader.loaders[0].templates
+
+        # A template that changed is loaded from its source
+        create_file(get_source_path('a.md'), u'{{ 2 + 20 }}')
+        c.app = c.make_app()
+        assert c.render('a.md', {}).strip() == u'<p>22</p>'
+    finally:
+        remove_dir(folder)
+
+
+def test_response_cache(c):
+    create_page('base.html', u'<p>{% block c %}{% endblock %}</p>')
+    create_page('a.html', u'{% extends "base.html" %}'
+                u'{% block c %}{{ q }}{% endblock %}')
+    past = time.time() - 60
+    for name in ('base.html', 'a.html'):
+        os.utime(get_source_path(name), (past, past))
+    t = c.get_test_client()
+    cache = c.get_response_cache()
+    assert t.get('/a.html?q=1').data == b'<p>1</p>'
+    assert t.get('/a.html?q=1').data == b'<p>1</p>'
+    assert t.head('/a.html?q=1').status_code == HTTP_OK
+    assert t.get('/a.html?q=2').data == b'<p>2</p>'
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # A change in a dependency
+    create_page('base.html', u'<b>{% block c %}{% endblock %}</b>')
+    assert t.get('/a.html?q=1').data == b'<b>1</b>'
+
+    # Also the not found pages, until they are created
+    assert t.get('/b.html').status_code == HTTP_NOT_FOUND
+    assert t.get('/b.html').status_code == HTTP_NOT_FOUND
+    assert cache.hits == 3
+    create_page('b.html', u'b')
+    assert t.get('/b.html').data == b'b'
+
+    # The static files don't count
+    create_page('c.css', u'c {}')
+    hits, misses = cache.hits, cache.misses
+    assert t.get('/c.css').data == b'c {}'
+    assert t.get('/d.css').status_code == HTTP_NOT_FOUND
+    assert (cache.hits, cache.misses) == (hits, misses)
+
+
+def test_response_cache_request_path(c):
+    create_page('index.html', u"[{{ active('index.html') }}]")
+    create_page('foo/index.html', u"[{{ active('/foo/index.html') }}]")
+    past = time.time() - 60
+    for name in ('index.html', 'foo/index.html'):
+        os.utime(get_source_path(name), (past, past))
+    t = c.get_test_client()
+    cache = c.get_response_cache()
+    assert t.get('/').data == b'[]'
+    assert t.get('/index.html').data == b'[active]'
+    assert t.get('/foo').data == b'[]'
+    assert t.get('/foo/').data == b'[]'
+    assert t.get('/foo/index.html').data == b'[active]'
+    assert (cache.hits, len(cache)) == (0, 5)
+    assert t.get('/foo/').data == b'[]'
+    assert cache.hits == 1
+
+
+def test_response_cache_disabled(c):
+    c.settings['RESPONSE_CACHE'] = False
+    assert c.get_response_cache() is None
+    create_page('a.html', u'a')
+    assert c.get_test_client().get('/a.html').data == b'a'
+
+
+def test_static_file_not_modified(t):
+    create_page('a.css', u'a {}')
+    resp = t.get('/a.css')
+    etag = resp.headers['ETag']
+    last_modified = resp.headers['Last-Modified']
+    assert resp.status_code == HTTP_OK
+
+    resp = t.get('/a.css', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.data == b''
+    assert resp.headers['ETag'] == etag
+    resp = t.get('/a.css', headers={'If-Modified-Since': last_modified})
+    assert resp.status_code == 304
+
+    create_page('a.css', u'a { color: red }')
+    resp = t.get('/a.css', headers={'If-None-Match': etag})
+    assert resp.status_code == HTTP_OK
+    assert resp.headers['ETag'] != etag
+
+
+def test_page_not_modified(c):
+    create_page('a.html', u'a')
+    past = time.time() - 60
+    os.utime(get_source_path('a.html'), (past, past))
+    t = c.get_test_client()
+    resp = t.get('/a.html')
+    etag = resp.headers['ETag']
+    assert resp.headers['Last-Modified']
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Rendered again')
+
+    c.render = fail
+    resp = t.get('/a.html', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    resp = t.get('/a.html', headers={'If-None-Match': '"other"'})
+    assert resp.status_code == HTTP_OK
+    assert resp.data == b'a'
+
+
+def test_not_found_has_no_etag(t):
+    resp = t.get('/missing.html')
+    assert resp.status_code == HTTP_NOT_FOUND
+    assert 'ETag' not in resp.headers
+
+
+def test_range_requests(t):
+    create_page('a.txt', u'0123456789')
+    resp = t.get('/a.txt')
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    etag = resp.headers['ETag']
+
+    resp = t.get('/a.txt', headers={'Range': 'bytes=2-4'})
+    assert resp.status_code == 206
+    assert resp.data == b'234'
+    assert resp.headers['Content-Range'] == 'bytes 2-4/10'
+
+    resp = t.get('/a.txt', headers={'Range': 'bytes=-3'})
+    assert resp.data == b'789'
+
+    resp = t.get('/a.txt', headers={'Range': 'bytes=0-1,8-'})
+    assert resp.status_code == 206
+    assert resp.mimetype == 'multipart/byteranges'
+    assert b'\r\nContent-Range: bytes 0-1/10\r\n\r\n01\r\n' in resp.data
+    assert b'\r\nContent-Range: bytes 8-9/10\r\n\r\n89\r\n' in resp.data
+    assert int(resp.headers['Content-Length']) == len(resp.data)
+
+    resp = t.get('/a.txt', headers={'Range': 'bytes=20-'})
+    assert resp.status_code == 416
+    assert resp.headers['Content-Range'] == 'bytes */10'
+
+    # Another version of the file
+    resp = t.get('/a.txt', headers={'Range': 'bytes=2-4', 'If-Range': etag})
+    assert resp.status_code == 206
+    resp = t.get('/a.txt', headers={'Range': 'bytes=2-4', 'If-Range': '"x"'})
+    assert resp.status_code == HTTP_OK
+    assert resp.data == b'0123456789'
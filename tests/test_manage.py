@@ -77,3 +77,35 @@ def test_can_build_pattern(c):
     assert os.path.exists(bp2)
     assert read_content(bp2) == u'bar'
     remove_dir(test_dir)
+
+
+def test_cant_watch_archive_or_shard(c):
+    test_dir = mkdtemp()
+    make_dirs(test_dir, 'source')
+    create_file(join(test_dir, 'source', 'foo.txt'), u'bar')
+    archive = join(test_dir, 'site.zip')
+
+    for option in (['--archive', archive], ['--shard', '1/2']):
+        sys.argv = [sys.argv[0], 'build', '--path', test_dir, '--watch'] + \
+            option
+        o = execute_and_read_stdout(manager.run)
+        assert "`--watch` can't be used" in o
+    assert not os.path.exists(archive)
+    assert not os.path.exists(join(test_dir, 'build'))
+    remove_dir(test_dir)
+
+
+def test_build_shard_with_costs(c):
+    test_dir = mkdtemp()
+    make_dirs(test_dir, 'source')
+    create_file(join(test_dir, 'source', 'foo.txt'), u'bar')
+    costs = join(test_dir, 'costs.json')
+
+    sys.argv = [sys.argv[0], 'build', '--path', test_dir, '--costs', costs]
+    o = execute_and_read_stdout(manager.run)
+    assert '`--costs` can only be used with `--shard`' in o
+    sys.argv += ['--shard', '1/2']
+    o = execute_and_read_stdout(manager.run)
+    assert "Can't read the costs" in o
+    assert not os.path.exists(join(test_dir, 'build'))
+    remove_dir(test_dir)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from itertools import imap
+import random
+import time
+
+from clay.pipeline import Pipeline, Stage
+import pytest
+
+
+def slow_double(n):
+    time.sleep(random.random() / 1000)
+    return n * 2
+
+
+def test_pipeline_keeps_order():
+    result = []
+    pipeline = Pipeline(range(100), [
+        Stage('double', slow_double, workers=4),
+        Stage('odd', lambda n: n if n % 3 else None, workers=2),
+        Stage('collect', result.append),
+    ])
+    pipeline.run()
+    assert result == [n * 2 for n in range(100) if (n * 2) % 3]
+
+
+def test_pipeline_imap_stage():
+    result = []
+
+    def double(n):
+        return None if n is None else n * 2
+
+    pipeline = Pipeline(range(10), [
+        Stage('odd', lambda n: n if n % 2 else None),
+        Stage('double', imap=lambda items: imap(double, items)),
+        Stage('collect', result.append),
+    ])
+    pipeline.run()
+    assert result == [2, 6, 10, 14, 18]
+
+
+def test_pipeline_errors():
+    def fail(n):
+        if n == 5:
+            raise ValueError(n)
+        return n
+
+    result = []
+    pipeline = Pipeline(range(100), [
+        Stage('fail', fail, workers=2),
+        Stage('collect', result.append),
+    ], maxsize=2)
+    with pytest.raises(ValueError):
+        pipeline.run()
+    assert 5 not in result
+
+
+def test_pipeline_stats():
+    pipeline = Pipeline(range(10), [
+        Stage('even', lambda n: n if n % 2 == 0 else None),
+        Stage('noop', lambda n: n),
+    ])
+    pipeline.run()
+    counts = [(stage.name, stage.count) for stage in pipeline.all_stages]
+    assert counts == [('discovery', 10), ('even', 10), ('noop', 5)]
+    stats = pipeline.format_stats()
+    assert 'discovery' in stats
+    assert 'items/s' in stats
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from clay.rendercache import RenderCache, make_key
+
+from .helpers import *
+
+
+def get_cache(max_size=1000):
+    return RenderCache(join(TESTS, 'cache'), max_size)
+
+
+def teardown_function(f=None):
+    remove_dir(join(TESTS, 'cache'))
+
+
+def test_make_key():
+    key = make_key(u'a.html', {u'a.html': u'1'}, u'{}', u'2.8')
+    assert key == make_key(u'a.html', {u'a.html': u'1'}, u'{}', u'2.8')
+    assert key != make_key(u'b.html', {u'a.html': u'1'}, u'{}', u'2.8')
+    assert key != make_key(u'a.html', {u'a.html': u'2'}, u'{}', u'2.8')
+    assert key != make_key(u'a.html', {u'a.html': u'1'}, u'{"A": 1}', u'2.8')
+    assert key != make_key(u'a.html', {u'a.html': u'1'}, u'{}', u'2.9')
+    assert make_key(u'a.html', None, u'{}', u'2.8') is None
+
+
+def test_get_and_set():
+    cache = get_cache()
+    key = make_key(u'a.html', {}, u'{}', u'1')
+    assert cache.get(key) is None
+    cache.set(key, u'mañana')
+    assert cache.get(key) == u'mañana'
+    stats = cache.get_stats()
+    assert stats['entries'] == 1
+    assert stats['size'] == len(u'mañana'.encode('utf8'))
+
+
+def test_prune_least_recently_used():
+    cache = get_cache(max_size=250)
+    keys = [make_key(u'p%s' % i, {}, u'{}', u'1') for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.set(key, u'x' * 100)
+        past = time.time() - 100 + i
+        os.utime(cache.get_path(key), (past, past))
+    # Using it makes it recent
+    assert cache.get(keys[0])
+
+    removed, freed = cache.prune()
+    assert (removed, freed) == (2, 200)
+    assert cache.get(keys[0])
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is None
+    assert cache.get(keys[3])
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from clay.renders import RenderStore
+
+
+def test_store_fragments():
+    store = RenderStore()
+    assert store.is_fragment('a.html') is None
+    store.set_fragment('a.html', True)
+    store.set_fragment('b.html', False)
+    assert store.is_fragment('a.html') is True
+    assert store.is_fragment('b.html') is False
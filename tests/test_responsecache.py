@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from werkzeug.datastructures import MultiDict
+
+from clay.helpers import get_stat
+from clay.responsecache import ResponseCache, make_key
+
+from .helpers import *
+
+
+def make_old_page(name, content=u'x'):
+    create_page(name, content)
+    past = time.time() - 60
+    os.utime(get_source_path(name), (past, past))
+    return get_stat(get_source_path(name))
+
+
+def test_make_key():
+    key = make_key(u'a.html', MultiDict([('b', '2'), ('a', '1')]))
+    assert key == make_key(u'a.html', MultiDict([('a', '1'), ('b', '2')]))
+    assert key != make_key(u'a.html', MultiDict([('a', '1')]))
+    assert key != make_key(u'b.html', MultiDict([('a', '1'), ('b', '2')]))
+
+
+def test_get_and_set():
+    cache = ResponseCache(SOURCE_DIR)
+    deps = {u'a.html': make_old_page(u'a.html'), u'b.html': None}
+    cache.set('a', 'response', deps, 8)
+    assert cache.get('a') == 'response'
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.get_stats()['size'] == 8
+
+
+def test_changed_dependency():
+    cache = ResponseCache(SOURCE_DIR)
+    deps = {u'a.html': make_old_page(u'a.html'), u'b.html': None}
+    cache.set('a', 'response', deps, 8)
+    make_old_page(u'b.html')
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_recently_changed_dependency():
+    cache = ResponseCache(SOURCE_DIR)
+    create_page(u'a.html', u'x')
+    cache.set('a', 'response', {u'a.html': get_stat(
+        get_source_path(u'a.html'))}, 8)
+    assert cache.get('a') is None
+
+
+def test_least_recently_used():
+    cache = ResponseCache(SOURCE_DIR, max_size=20)
+    cache.set('a', 'a', {}, 8)
+    cache.set('b', 'b', {}, 8)
+    assert cache.get('a') == 'a'
+    cache.set('c', 'c', {}, 8)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'a'
+    assert cache.get('c') == 'c'
+    assert cache.size == 16
+    cache.set('d', 'd', {}, 30)
+    assert cache.get('d') is None
+
+
+def test_invalidate():
+    cache = ResponseCache(SOURCE_DIR)
+    cache.watched = True
+    cache.set('a', 'a', {u'a.html': None}, 1)
+    cache.set('b', 'b', {u'b.html': None, u'c.html': None}, 1)
+    cache.invalidate([u'c.html'])
+    assert cache.get('a') == 'a'
+    assert cache.get('b') is None
+    cache.invalidate()
+    assert cache.get('a') is None
+    assert cache.size == 0
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+import httplib
+import threading
 
+from clay import Clay
+from clay.livereload import LiveReloadHub
 from clay.server import RequestLogger
 import pytest
 import socket
+import time
 
 from .helpers import *
 
@@ -135,3 +140,218 @@ def test_request_logger_as_middleware_fail():
     assert called
 
 
+def test_request_logger_with_access_log(c):
+    records = []
+
+    class FakeAccessLog(object):
+        def log(self, environ, now, status, size, duration):
+            records.append((environ['PATH_INFO'], status, size))
+
+    content = get_large_content()
+    create_page('a.txt', content)
+    create_page('b.html', u'<p>hello</p>')
+    server = serve(RequestLogger(c.app, access_log=FakeAccessLog()))
+    try:
+        conn = httplib.HTTPConnection(*server.socket.getsockname())
+        for path in ('/a.txt', '/b.html', '/c.html'):
+            conn.request('GET', path)
+            conn.getresponse().read()
+        conn.close()
+    finally:
+        server.stop()
+    assert records[0] == ('/a.txt', '200 OK', len(content))
+    assert records[1] == ('/b.html', '200 OK', len(u'<p>hello</p>'))
+    assert records[2][:2] == ('/c.html', '404 NOT FOUND')
+
+
+def test_access_log_compressed_size(c):
+    from clay.server import Server
+
+    records = []
+
+    class FakeAccessLog(object):
+        def log(self, environ, now, status, size, duration):
+            records.append((environ['REQUEST_METHOD'], size))
+
+        def close(self):
+            pass
+
+    create_page('a.txt', get_large_content())
+    c.settings['ACCESS_LOG'] = False
+    app = Server(c).dispatcher.apps[0][1]
+    app.access_log = FakeAccessLog()
+    server = serve(app)
+    try:
+        conn = httplib.HTTPConnection(*server.socket.getsockname())
+        for method in ('GET', 'HEAD'):
+            conn.request(method, '/a.txt', headers={'Accept-Encoding': 'gzip'})
+            resp = conn.getresponse()
+            resp.read()
+            assert resp.getheader('Content-Encoding') == 'gzip'
+        conn.close()
+    finally:
+        server.stop()
+    assert records[0] == ('GET', int(resp.getheader('Content-Length')))
+    assert records[1] == ('HEAD', 0)
+
+
+def test_serve_file_ranges(c):
+    content = get_large_content()
+    create_page('a.txt', content)
+    server = serve(c.app)
+    try:
+        conn = httplib.HTTPConnection(*server.socket.getsockname())
+        conn.request('GET', '/a.txt')
+        resp = conn.getresponse()
+        assert resp.status == 200
+        assert resp.read() == content.encode('ascii')
+
+        conn.request('GET', '/a.txt', headers={'Range': 'bytes=70000-70009'})
+        resp = conn.getresponse()
+        assert resp.status == 206
+        assert resp.read() == content[70000:70010].encode('ascii')
+        conn.close()
+    finally:
+        server.stop()
+
+
+def test_serve_file_with_sendfile(c, monkeypatch):
+    from clay.cheroot import server as cheroot_server
+    calls = []
+
+    def sendfile(outfd, infd, offset, count):
+        calls.append((offset, count))
+        os.lseek(infd, offset, os.SEEK_SET)
+        return os.write(outfd, os.read(infd, min(count, 4096)))
+
+    monkeypatch.setattr(cheroot_server, 'sendfile', sendfile)
+    content = get_large_content()
+    create_page('a.txt', content)
+    server = serve(c.app)
+    try:
+        conn = httplib.HTTPConnection(*server.socket.getsockname())
+        conn.request('GET', '/a.txt')
+        assert conn.getresponse().read() == content.encode('ascii')
+        assert calls[0] == (0, len(content))
+
+        conn.request('GET', '/a.txt', headers={'Range': 'bytes=50000-'})
+        assert conn.getresponse().read() == content[50000:].encode('ascii')
+        assert (50000, len(content) - 50000) in calls
+        conn.close()
+    finally:
+        server.stop()
+
+
+def test_live_reload(c):
+    create_page('base.html', u'<html><body>{% block b %}{% endblock %}'
+                             u'</body></html>')
+    create_page('a.html', u'{% extends "base.html" %}')
+    create_page('b.html', u'<html><body>b</body></html>')
+    c.livereload = LiveReloadHub()
+    # A single worker thread
+    server = serve(c.app, minthreads=1, maxthreads=1)
+    sock = None
+    try:
+        conn = httplib.HTTPConnection(*server.socket.getsockname())
+        conn.request('GET', '/a.html', headers={'Connection': 'close'})
+        resp = conn.getresponse()
+        assert b'new EventSource' in resp.read()
+        conn.close()
+
+        sock = socket.create_connection(server.socket.getsockname())
+        sock.settimeout(5)
+        sock.sendall(b'GET /_clay/events?path=%2Fa.html HTTP/1.1\r\n'
+                     b'Host: localhost\r\n\r\n')
+        head = read_until(sock, b'\n\n')
+        assert b'Content-Type: text/event-stream' in head
+        while not len(c.livereload):
+            time.sleep(0.01)
+
+        # The worker is free for other requests
+        conn = httplib.HTTPConnection(*server.socket.getsockname())
+        conn.request('GET', '/b.html', headers={'Connection': 'close'})
+        assert conn.getresponse().status == 200
+        conn.close()
+
+        c.notify_livereload({u'b.html'})
+        c.notify_livereload({u'base.html'})
+        event = read_until(sock, b'\n\n')
+        assert event == b'event: changed\ndata: a.html\n\n'
+    finally:
+        if sock is not None:
+            sock.close()
+        c.livereload.close()
+        c.livereload = None
+        server.stop()
+
+
+def test_live_reload_keepalive():
+    hub = LiveReloadHub(keepalive=0.2)
+    server_sock, sock = socket.socketpair()
+    stop = threading.Event()
+
+    def wakeup():
+        # More often than the keepalive interval
+        while not stop.is_set():
+            hub._wakeup()
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=wakeup)
+    thread.daemon = True
+    try:
+        sock.settimeout(2)
+        hub.add(server_sock, u'a.html')
+        read_until(sock, b'\n\n')
+        thread.start()
+        assert sock.recv(1024) == b':\n\n'
+    finally:
+        stop.set()
+        sock.close()
+        hub.close()
+
+
+def test_stats():
+    import json
+    c = Clay(TESTS, {'STATS': True})
+    create_page('a.html', u'<p>{{ 1 + 1 }}</p>')
+    server = c.server.server = c.server._get_wsgi_server('127.0.0.1', 0)
+    thread = threading.Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    while not server.ready:
+        time.sleep(0.01)
+    try:
+        conn = httplib.HTTPConnection(*server.socket.getsockname())
+        for i in range(3):
+            conn.request('GET', '/a.html')
+            assert conn.getresponse().read() == b'<p>2</p>'
+
+        conn.request('GET', '/_clay/stats')
+        resp = conn.getresponse()
+        assert resp.getheader('Content-Type') == 'application/json'
+        stats = json.loads(resp.read())
+        assert stats['server']['Enabled']
+        assert stats['server']['Accepts'] == 1
+        assert stats['server']['Requests'] >= 3
+        route = stats['routes']['/<path:path>']
+        assert route['count'] == 3
+        assert route['p50'] <= route['p95'] <= route['p99']
+        cache = stats['caches']['response']
+        assert cache['hits'] + cache['misses'] == 3
+        assert stats['templates']['compiled'] >= 1
+
+        conn.request('GET', '/_clay/stats?format=prometheus')
+        resp = conn.getresponse()
+        assert resp.getheader('Content-Type').startswith('text/plain')
+        text = resp.read()
+        assert 'clay_server_accepts_total 1\n' in text
+        assert 'clay_request_duration_seconds_count{route="/<path:path>"} 3' \
+            in text
+        conn.close()
+    finally:
+        server.stop()
+
+
+def test_stats_disabled(c):
+    resp = c.app.test_client().get('/_clay/stats')
+    assert resp.status_code == 404
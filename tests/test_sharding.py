@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+
+import pytest
+
+from clay.sharding import (parse_shard, partition, get_stable_shard,
+                           load_costs, get_partition_key, check_shards)
+
+from .helpers import *
+
+
+def test_parse_shard():
+    assert parse_shard('1/4') == (1, 4)
+    assert parse_shard(' 4 / 4 ') == (4, 4)
+    for value in ('0/4', '5/4', '1', 'a/b', '', None):
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+def test_partition_by_hash():
+    groups = dict((u'p%s.html' % i, [u'p%s.html' % i]) for i in range(100))
+    shards = partition(groups, 3)
+    assert sorted(shards) == sorted(groups)
+    assert set(shards.values()) == set([1, 2, 3])
+    for path, shard in shards.items():
+        assert shard == get_stable_shard(path, 3)
+
+    # Adding pages doesn't move the others
+    groups[u'new.html'] = [u'new.html']
+    more = partition(groups, 3)
+    assert all(more[path] == shard for path, shard in shards.items())
+
+
+def test_partition_keeps_groups_together():
+    groups = {u'foo.html': [u'foo.md', u'foo.html'], u'bar.html': [u'bar.html']}
+    for total in (2, 3, 5):
+        shards = partition(groups, total)
+        assert shards[u'foo.md'] == shards[u'foo.html']
+
+
+def test_partition_by_cost():
+    groups = dict((name, [name]) for name in u'abcdef')
+    costs = {u'a': 10.0, u'b': 5.0, u'c': 5.0, u'd': 1.0}
+    shards = partition(groups, 2, costs)
+    loads = {1: 0.0, 2: 0.0}
+    for path, shard in shards.items():
+        loads[shard] += costs.get(path, 5.25)
+    # The average cost of the known pages is used for the others
+    assert abs(loads[1] - loads[2]) < 1
+    assert partition(groups, 2, costs) == shards
+
+
+def test_load_costs():
+    path = os.path.join(TESTS, 'profile.json')
+    try:
+        with io.open(path, 'wt', encoding='utf8') as f:
+            f.write(u'{"pages": [{"path": "a.html", "total": 2}]}')
+        assert load_costs(path) == {'a.html': 2.0}
+        with io.open(path, 'wt', encoding='utf8') as f:
+            f.write(u'{}')
+        with pytest.raises(ValueError):
+            load_costs(path)
+    finally:
+        remove_file(path)
+    with pytest.raises(IOError):
+        load_costs(path)
+
+
+def test_partition_key():
+    assert get_partition_key() == get_partition_key({}) == 'hash'
+    key = get_partition_key({u'a': 1.0, u'b': 2.0})
+    assert key == get_partition_key({u'b': 2.0, u'a': 1.0})
+    assert key != get_partition_key({u'a': 1.0, u'b': 3.0})
+
+
+def test_check_shards():
+    check_shards([[2, 2, 'hash'], [1, 2, 'hash']])
+    for shards in ([], [[1, 2, 'hash'], None],
+                   [[1, 2, 'hash'], [2, 2, 'costs:x']],
+                   [[1, 2, 'hash'], [2, 3, 'hash']],
+                   [[1, 2, 'hash'], [1, 2, 'hash']],
+                   [[1, 3, 'hash'], [2, 3, 'hash']]):
+        with pytest.raises(ValueError):
+            check_shards(shards)
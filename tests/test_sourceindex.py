@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+
+from clay.sourceindex import SourceIndex
+
+from .helpers import *
+
+
+def make_tree():
+    make_dirs(SOURCE_DIR, 'a/b')
+    make_dirs(SOURCE_DIR, '.git')
+    create_file(get_source_path('x.html'), u'')
+    create_file(get_source_path('a/y.md'), u'')
+    create_file(get_source_path('a/b/z.txt'), u'')
+    create_file(get_source_path('.git/config'), u'')
+
+
+def test_list_files():
+    make_tree()
+    index = SourceIndex(SOURCE_DIR, ['.*'])
+    assert index.list_files() == [
+        'x.html', os.path.join('a', 'y.md'), os.path.join('a', 'b', 'z.txt')]
+    assert index.list_files('*.md') == [os.path.join('a', 'y.md')]
+
+
+def test_lookups():
+    make_tree()
+    index = SourceIndex(SOURCE_DIR, ['.*'])
+    assert index.isfile('x.html')
+    assert index.isfile('a/y.md')
+    assert not index.isfile('a')
+    assert index.isdir('a/b')
+    assert not index.isdir('a/y.md')
+    assert not index.exists('a/nope.html')
+    assert not index.exists('../source/x.html')
+    # Inside the skipped folders, asks the disk
+    assert index.isdir('.git')
+    assert index.isfile('.git/config')
+
+
+def test_finds_new_and_deleted_files():
+    make_tree()
+    index = SourceIndex(SOURCE_DIR)
+    assert not index.isfile('a/b/new.html')
+    create_file(get_source_path('a/b/new.html'), u'')
+    assert index.isfile('a/b/new.html')
+    assert os.path.join('a', 'b', 'new.html') in index.list_files()
+
+    remove_file(get_source_path('a/b/new.html'))
+    assert not index.isfile('a/b/new.html')
+    remove_dir(get_source_path('a'))
+    assert not index.isdir('a')
+    assert index.list_files() == ['x.html', os.path.join('.git', 'config')]
+
+
+def test_watched_index_uses_the_changes():
+    make_tree()
+    index = SourceIndex(SOURCE_DIR)
+    index.watched = True
+    index.list_files()
+
+    create_file(get_source_path('a/new.html'), u'')
+    assert not index.isfile('a/new.html')
+    index.invalidate(['a/new.html'])
+    assert index.isfile('a/new.html')
+
+    make_dirs(SOURCE_DIR, 'c')
+    create_file(get_source_path('c/d.html'), u'')
+    index.invalidate(['c'])
+    assert index.isfile('c/d.html')
+
+    remove_dir(get_source_path('a'))
+    index.invalidate(None)
+    assert not index.isdir('a')
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from clay.stats import (
+    LatencyHistogram, RequestStats, get_server_stats, to_prometheus)
+
+
+def test_histogram_quantiles():
+    h = LatencyHistogram(bounds=(0.01, 0.1, 1))
+    assert h.quantile(0.5) is None
+    for i in range(90):
+        h.observe(0.005)
+    for i in range(10):
+        h.observe(0.5)
+    assert h.get_cumulative() == [90, 90, 100, 100]
+    assert h.quantile(0.5) == 0.01 * 50 / 90
+    assert abs(h.quantile(0.95) - 0.55) < 1e-9
+    h.observe(5)
+    assert h.quantile(0.999) == 1
+    data = h.to_dict()
+    assert data['count'] == 101
+    assert sorted(data) == ['count', 'p50', 'p95', 'p99', 'sum']
+
+
+def test_get_server_stats():
+    stats = {
+        'Enabled': True,
+        'Accepts': 3,
+        'Queue': lambda s: 2,
+        'Accepts/sec': lambda s: s['Accepts'] / 0,
+        'Worker Threads': {'w1': {'Requests': lambda s: 5}},
+    }
+    data = get_server_stats(stats)
+    assert data['Queue'] == 2
+    assert data['Accepts/sec'] is None
+    assert data['Worker Threads'] == {'w1': {'Requests': 5}}
+
+
+def test_to_prometheus():
+    rs = RequestStats(bounds=(0.1, 1))
+    rs.observe('/<path:path>', 0.05)
+    rs.observe('/<path:path>', 0.5)
+    data = {
+        'server': {'Accepts': 3, 'Queue': 0},
+        'routes': rs.get_stats(),
+        'caches': {
+            'response': {'hits': 3, 'misses': 1, 'entries': 1, 'size': 10},
+            'bytecode': None,
+        },
+        'templates': {'compiled': 2},
+    }
+    text = to_prometheus(data, rs.get_histograms())
+    lines = text.splitlines()
+    assert '# TYPE clay_server_accepts_total counter' in lines
+    assert 'clay_server_accepts_total 3' in lines
+    assert 'clay_server_queue 0' in lines
+    assert '# TYPE clay_request_duration_seconds histogram' in lines
+    assert 'clay_request_duration_seconds_bucket' \
+        '{route="/<path:path>",le="0.1"} 1' in lines
+    assert 'clay_request_duration_seconds_bucket' \
+        '{route="/<path:path>",le="+Inf"} 2' in lines
+    assert 'clay_request_duration_seconds_count{route="/<path:path>"} 2' \
+        in lines
+    assert 'clay_request_duration_quantile_seconds' \
+        '{route="/<path:path>",quantile="0.5"} 0.1' in lines
+    assert 'clay_cache_hits_total{cache="response"} 3' in lines
+    assert 'bytecode' not in text
+    assert 'clay_templates_compiled_total 2' in lines
@@ -61,3 +61,18 @@ def test_active_in_templates(t):
     expected = u'class="active"'
     resp = t.get('/' + path)
     assert resp.data == expected
+
+
+def test_active_partial_is_a_prefix_not_a_pattern(c):
+    with c.app.test_request_context('/foo/bar.html', method='GET'):
+        assert active('/fo', partial=True) == 'active'
+        assert not active('/fo')
+        assert not active('/f?x', partial=True)
+
+
+def test_active_is_cached_per_request_path(c):
+    with c.app.test_request_context('/foo/bar.html', method='GET'):
+        assert active('bar.html') == 'active'
+    with c.app.test_request_context('/lorem/ipsum.html', method='GET'):
+        assert not active('bar.html')
+        assert active('ipsum.html') == 'active'
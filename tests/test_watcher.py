@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import sys
+
+import pytest
+
+from clay.watcher import PollingWatcher, InotifyWatcher
+
+from .helpers import *
+
+
+is_linux = sys.platform.startswith('linux')
+WATCHERS = [lambda root: PollingWatcher(root, interval=0.01)]
+if is_linux:
+    WATCHERS.append(InotifyWatcher)
+
+
+@pytest.fixture(params=WATCHERS)
+def watcher(request):
+    make_dirs(SOURCE_DIR)
+    w = request.param(SOURCE_DIR)
+    yield w
+    w.close()
+
+
+def test_no_changes(watcher):
+    assert watcher.get_changes(0.05) == set()
+
+
+def test_detect_new_and_updated_files(watcher):
+    create_file(get_source_path('a.html'), u'a')
+    assert 'a.html' in watcher.wait(0.05, 1)
+
+    create_file(get_source_path('a.html'), u'aa')
+    assert watcher.wait(0.05, 1) == set(['a.html'])
+
+
+def test_detect_files_in_new_folders(watcher):
+    make_dirs(SOURCE_DIR, 'foo')
+    create_file(get_source_path('foo/b.html'), u'b')
+    assert 'foo/b.html' in watcher.wait(0.05, 1)
+
+    create_file(get_source_path('foo/b.html'), u'bb')
+    assert watcher.wait(0.05, 1) == set(['foo/b.html'])
+
+
+def test_detect_deleted_files(watcher):
+    create_file(get_source_path('a.html'), u'a')
+    watcher.wait(0.05, 1)
+    remove_file(get_source_path('a.html'))
+    assert watcher.wait(0.05, 1) == set(['a.html'])
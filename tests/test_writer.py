@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import os
+
+from clay.writer import OutputWriter, StaticCopier, write_file
+import pytest
+
+from .helpers import *
+
+
+def test_write_file():
+    path = get_build_path('a.txt')
+    written, result = write_file(path, b'foo')
+    assert written
+    assert read_content(path) == 'foo'
+    assert result == [
+        '0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33', 3, os.path.getmtime(path)]
+    assert os.listdir(BUILD_DIR) == ['a.txt']
+
+
+def test_write_file_mode():
+    # Not only readable by the owner, like the temporal file
+    path = get_build_path('a.txt')
+    write_file(path, b'foo')
+    assert os.stat(path).st_mode & 0o777 == 0o666 & ~get_umask()
+    # The permissions of the file replaced are kept
+    os.chmod(path, 0o640)
+    write_file(path, b'bar')
+    assert os.stat(path).st_mode & 0o777 == 0o640
+
+
+def test_write_file_skip_if_identical():
+    path = get_build_path('a.txt')
+    create_file(path, u'foo')
+    os.utime(path, (1, 1))
+    written, result = write_file(path, b'foo')
+    assert not written
+    assert os.path.getmtime(path) == 1
+
+    written, _ = write_file(path, b'foo', result)
+    assert not written
+    written, _ = write_file(path, b'bar', result)
+    assert written
+    assert read_content(path) == 'bar'
+
+
+def test_writer():
+    outputs = {}
+    writer = OutputWriter(BUILD_DIR, outputs)
+    writer.write(get_build_path('a.txt'), u'mañana')
+    writer.write(get_build_path('b.txt'), u'foo')
+    writer.write(get_build_path('b.txt'), u'foo')
+    writer.close()
+    assert read_content(get_build_path('a.txt')) == u'mañana'.encode('utf8')
+    assert sorted(outputs) == ['a.txt', 'b.txt']
+    assert writer.written == 2
+    assert writer.skipped == 1
+
+
+def test_writer_errors():
+    writer = OutputWriter(BUILD_DIR)
+    writer.write(get_build_path('nope/a.txt'), u'foo')
+    with pytest.raises(OSError):
+        writer.close()
+
+
+def test_static_copier():
+    create_file(get_source_path('a.txt'), u'foo')
+    create_file(get_source_path('b.txt'), u'bar')
+    create_file(get_build_path('b.txt'), u'bar')
+
+    copier = StaticCopier(threads=2)
+    copier.copy(get_source_path('a.txt'), get_build_path('a.txt'))
+    copier.copy(get_source_path('b.txt'), get_build_path('b.txt'))
+    copier.close()
+    assert read_content(get_build_path('a.txt')) == 'foo'
+    assert copier.copied == 1
+    assert copier.skipped == 1
+
+
+def test_static_copier_errors():
+    copier = StaticCopier(threads=2)
+    copier.copy(get_source_path('nope.txt'), get_build_path('nope.txt'))
+    with pytest.raises(OSError):
+        copier.close()